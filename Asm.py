@@ -11,13 +11,26 @@ values. The following instructions are recognized:
     * xor rd, rs1, rs2: rd = rs1 ^ rs2
     * xori rd, rs1, imm: rd = rs1 ^ imm
     * div rd, rs1, rs2: rd = rs1 // rs2 (signed integer division)
+    * rem rd, rs1, rs2: rd = rs1 % rs2 (remainder of the division)
     * slt rd, rs1, rs2: rd = (rs1 < rs2) ? 1 : 0 (signed comparison)
     * slti rd, rs1, imm: rd = (rs1 < imm) ? 1 : 0
+    * sltu rd, rs1, rs2: rd = (rs1 < rs2) ? 1 : 0 (unsigned comparison)
+    * sltiu rd, rs1, imm: rd = (rs1 < imm) ? 1 : 0 (unsigned comparison)
+    * seqz rd, rs1: rd = (rs1 == 0) ? 1 : 0
+    * snez rd, rs2: rd = (rs2 != 0) ? 1 : 0
+    * slli rd, rs1, imm: rd = rs1 << imm
+    * srli rd, rs1, imm: rd = rs1 >> imm (logical shift)
+    * srai rd, rs1, imm: rd = rs1 >> imm (arithmetic shift)
     * beq rs1, rs2, lab: pc = lab if rs1 == rs2 else pc + 1
+    * bne rs1, rs2, lab: pc = lab if rs1 != rs2 else pc + 1
+    * blt rs1, rs2, lab: pc = lab if rs1 < rs2 else pc + 1
+    * bge rs1, rs2, lab: pc = lab if rs1 >= rs2 else pc + 1
     * jal rd, lab: rd = pc + 1 and pc = lab
     * jalr rd, rs1, offset: rd = pc + 1 and pc = rs1 + offset
+    * la rd, lab: rd = lab (the address of an instruction)
     * sw reg, offset(rs1): mem[offset+rs1] = reg
     * lw reg, offset(rs1): reg = mem[offset+rs1]
+    * alloc rd, size: rd = address of a new block of size memory cells
 
 This file uses doctests all over. To test it, just run python 3 as follows:
 "python3 -m doctest Asm.py". The program uses syntax that is excluive of
@@ -25,23 +38,180 @@ Python 3. It will not work with standard Python 2.
 """
 
 import sys
+from array import array
 from collections import deque
 from abc import ABC, abstractmethod
 
+"""
+The number of bits in a machine word. Registers hold unbounded integers, but
+the unsigned instructions, like 'sltu' and 'srli', read them as words with
+XLEN bits, in two's complement.
+"""
+XLEN = 64
+
+
+class Address(int):
+    """
+    The value of a register or of a memory cell that holds the address of a
+    block of the heap. Addresses are integers, but the machine tags them, so
+    that the garbage collector can tell them apart from other values. Copies
+    keep the tag: adding zero to an address gives the same address, whereas
+    any other arithmetic gives an untagged integer.
+
+    Example:
+        >>> a = Address(8)
+        >>> type(a + 0).__name__, type(0 + a).__name__, type(a + 4).__name__
+        ('Address', 'Address', 'int')
+    """
+
+    def __add__(self, other):
+        if other == 0:
+            return self
+        return int(self) + other
+
+    __radd__ = __add__
+
+
+class WordMemory:
+    """
+    A memory of XLEN-bit words, stored in a typed array, instead of a list of
+    Python integers: each cell takes eight bytes, plus one byte for its tag.
+    Values wrap around, as in the memory of a machine, and keep the tag that
+    marks them as addresses (see the class Address), which the garbage
+    collector needs. The memory can be read and written like a list, and the
+    whole array of words can be seen through a memoryview, without copies.
+
+    Example:
+        >>> mem = WordMemory(4)
+        >>> mem[0], mem[1] = 2**63, Address(2)
+        >>> mem[0], type(mem[1]).__name__, mem[1:3]
+        (-9223372036854775808, 'Address', [2, 0])
+        >>> mem.load([7, 8], 2)
+        >>> mem.view()[2:].tolist(), len(mem)
+        ([7, 8], 4)
+    """
+
+    def __init__(self, size):
+        assert XLEN == 64, "the words of the array have 64 bits"
+        self.words = array("q", [0]) * size
+        self.tags = bytearray(size)
+
+    @staticmethod
+    def word(value):
+        """
+        Returns the signed XLEN-bit word that represents value.
+
+        Example:
+            >>> WordMemory.word(2**64 + 5), WordMemory.word(2**64 - 1)
+            (5, -1)
+        """
+        value = unsigned(value)
+        return value - (1 << XLEN) if value >> (XLEN - 1) else value
+
+    def __len__(self):
+        return len(self.words)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        value = self.words[index]
+        return Address(value) if self.tags[index] else value
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            assert step == 1, "slices of the memory must be contiguous"
+            value = list(value)
+            assert len(value) == stop - start, "the memory cannot be resized"
+            self.load(value, start)
+            return
+        bound = 1 << (XLEN - 1)
+        word = value if -bound <= value < bound else self.word(value)
+        self.words[index] = word
+        self.tags[index] = isinstance(value, Address)
+
+    def load(self, values, start=0):
+        """
+        Writes the values into consecutive cells, from address start on.
+        Arrays of words are copied as a whole; their values are not
+        addresses.
+        """
+        stop = start + len(values)
+        if isinstance(values, array):
+            self.words[start:stop] = values
+            self.tags[start:stop] = bytes(len(values))
+            return
+        self.words[start:stop] = array("q", map(self.word, values))
+        self.tags[start:stop] = bytes(isinstance(v, Address) for v in values)
+
+    def dump(self, start=0, stop=None):
+        """
+        Returns a copy of the words from address start to address stop, as
+        an array, which is how snapshots of the memory are taken.
+        """
+        return self.words[start:stop]
+
+    def view(self):
+        """
+        Returns a memoryview of the words, which shares them with the memory.
+        """
+        return memoryview(self.words)
+
 
 class Program:
     """
     The 'Program' is a list of instructions plus an environment that associates
     names with values, plus a program counter, which marks the next instruction
     that must be executed. The environment contains a special variable x0,
-    which always contains the value zero.
+    which always contains the value zero. The program also has a symbol table,
+    which associates names with labels, such as the entry points of functions.
+
+    The code of a program can be split into sections, such as the bodies of
+    functions, which are appended after the main program when the program is
+    linked. This happens before the program runs, or before its instructions
+    are inspected or transformed.
+
+    The memory holds, from the lowest to the highest address: the static data,
+    which ends at the start of the heap, the heap, which grows upwards, and the
+    stack, which grows downwards from the end of the memory. Blocks of the
+    heap are allocated with a bump pointer, by the 'alloc' instruction. When
+    the heap and the stack meet, a garbage collector reclaims the blocks that
+    the program can no longer reach.
+
+    The memory is a list of Python integers, which can be as large as
+    registers. If typed is True, it is a WordMemory instead, which takes less
+    space, and whose cells hold XLEN-bit words. Registers still hold unbounded
+    integers, so, with a typed memory, a value that does not fit in a word is
+    not the same after it is stored with 'sw' and loaded back with 'lw': it
+    wraps around to the signed word that represents it, as below. Memories
+    are typed only when asked to be, as programs that keep large values in
+    memory would change their results.
+
+    Example:
+        >>> insts = [Addi("a", "x0", -1), Srli("a", "a", 1), Addi("a", "a", 1),
+        ...          Sw("x0", 0, "a"), Lw("x0", 0, "b")]
+        >>> p = Program(4, {}, insts, typed=True)
+        >>> p.eval()
+        >>> p.get_val("a") == 2**(XLEN - 1), p.get_val("b") == -2**(XLEN - 1)
+        (True, True)
+        >>> p.get_memory().dump(0, 2).tolist() == [-2**(XLEN - 1), 0]
+        True
     """
 
-    def __init__(self, memory_size, env, insts):
-        self.__mem = memory_size * [0]
+    def __init__(self, memory_size, env, insts, typed=False):
+        self.__mem = WordMemory(memory_size) if typed else memory_size * [0]
         self.__env = env
         self.__insts = insts
         self.pc = 0
+        self.__symbols = {}
+        self.__sections = []
+        self.__open = []
+        self.__heap_start = 0
+        self.__heap_top = 0
+        self.__blocks = {}
+        self.__heap_stats = {"allocations": 0, "allocated": 0,
+                             "collections": 0, "reclaimed": 0,
+                             "live": 0, "peak": 0}
         self.__env["x0"] = 0
         self.__env["sp"] = memory_size
 
@@ -54,10 +224,111 @@ class Program:
             return None
 
     def get_number_of_instructions(self):
+        """
+        Returns the number of instructions of the section that is receiving
+        instructions, which is the label of the next instruction that is
+        added to it.
+        """
+        if self.__open:
+            return len(self.__open[-1])
         return len(self.__insts)
 
     def add_inst(self, inst):
-        self.__insts.append(inst)
+        if self.__open:
+            self.__open[-1].append(inst)
+        else:
+            self.__insts.append(inst)
+
+    def get_insts(self):
+        self.link()
+        return self.__insts
+
+    def set_insts(self, insts):
+        self.link()
+        self.__insts = insts
+
+    def open_section(self):
+        """
+        Starts a new section of code. The next instructions go to it, until
+        close_section is called, and its labels are relative to its start.
+        Other sections refer to the start of the k-th section that is opened
+        through the label -k. Returns this label.
+        """
+        section = []
+        self.__sections.append(section)
+        self.__open.append(section)
+        return -len(self.__sections)
+
+    def close_section(self):
+        """
+        Ends the last section that was opened: the next instructions go to
+        the section that was receiving instructions before it.
+        """
+        self.__open.pop()
+
+    def link(self):
+        """
+        Appends the sections after the main program, in the order in which
+        they were opened, and relocates the labels of the instructions and of
+        the symbol table. The main program ends with a jump to the end of the
+        code, so that it does not run into the sections.
+
+        Example:
+            >>> p = Program(0, {}, [])
+            >>> entry = p.open_section()
+            >>> p.add_inst(Jal("x0", 0))
+            >>> p.close_section()
+            >>> p.add_inst(Jal("ra", entry))
+            >>> p.add_symbol("f", entry)
+            >>> [str(i) for i in p.get_insts()], p.get_symbols()
+            (['jal ra 2', 'jal x0 3', 'jal x0 2'], {'f': 2})
+        """
+        if not self.__sections:
+            return
+        assert not self.__open, "cannot link a program with open sections"
+        bases = []
+        end = len(self.__insts) + 1
+        for section in self.__sections:
+            bases.append(end)
+            end += len(section)
+
+        def relocate(lab, base):
+            return bases[-lab - 1] if lab < 0 else lab + base
+
+        sections = [self.__insts] + self.__sections
+        for base, section in zip([0] + bases, sections):
+            for inst in section:
+                if getattr(inst, "lab", None) is not None:
+                    inst.set_target(relocate(inst.lab, base))
+        for name, lab in self.__symbols.items():
+            self.__symbols[name] = relocate(lab, 0)
+        self.__insts.append(Jal("x0", end))
+        for section in self.__sections:
+            self.__insts.extend(section)
+        self.__sections = []
+
+    def rewrite(self, expansions):
+        """
+        Replaces each instruction i with the list of instructions
+        expansions[i], updating the labels of the branches and of the symbol
+        table (see the function rewrite at the end of this file).
+
+        Example:
+            >>> p = Program(0, {}, [Addi("a", "x0", 1), Jalr("x0", "ra")])
+            >>> p.add_symbol("f", 1)
+            >>> p.rewrite([[], [Addi("a", "a", 1), p.get_insts()[1]]])
+            >>> p.get_symbols()
+            {'f': 0}
+        """
+        self.link()
+        self.__insts = rewrite(self.__insts, expansions, self.__symbols)
+
+    def add_symbol(self, name, lab):
+        assert isinstance(lab, int)
+        self.__symbols[name] = lab
+
+    def get_symbols(self):
+        return self.__symbols
 
     def get_pc(self):
         return self.pc
@@ -66,8 +337,32 @@ class Program:
         self.pc = pc
 
     def set_val(self, name, value):
+        """
+        Writes value into the register name. The stack must not reach the
+        heap: if it does, the garbage collector runs, and, if it still does,
+        the program stops.
+
+        Example:
+            >>> p = Program(10, {}, [])
+            >>> p.set_val("a", p.allocate(8))
+            >>> p.set_val("a", 0)
+            >>> p.set_val("sp", 4)
+            >>> p.get_heap_stats()["collections"]
+            1
+        """
         if name != "x0":  # Can't change x0, which is always zero.
             self.__env[name] = value
+            if name == "sp" and value < self.__heap_top:
+                self.check_stack(value)
+
+    def check_stack(self, sp):
+        """
+        Makes room for a stack that starts at address sp, by collecting the
+        heap, or stops the program if there is no room.
+        """
+        self.collect()
+        if sp < self.__heap_top:
+            sys.exit("Stack overflow")
 
     def set_mem(self, addr, value):
         self.__mem[addr] = value
@@ -75,6 +370,163 @@ class Program:
     def get_mem(self, addr):
         return self.__mem[addr]
 
+    def get_memory(self):
+        """
+        Returns the memory of the program, which bulk operations, such as the
+        loads and dumps of a WordMemory, can use.
+        """
+        return self.__mem
+
+    def set_heap_start(self, addr):
+        """
+        Places the start of the heap at address addr, leaving the memory below
+        it for static data. This must be done before any allocation.
+        """
+        self.__heap_start = addr
+        self.__heap_top = addr
+        self.__blocks = {}
+
+    def get_heap_start(self):
+        return self.__heap_start
+
+    def add_static(self, size):
+        """
+        Reserves size memory cells of static data, at the start of the heap,
+        which moves upwards. Returns the address of these cells. This must be
+        done before any allocation. The program stops if the static data
+        would reach the stack.
+
+        Example:
+            >>> p = Program(10, {}, [])
+            >>> p.add_static(4), p.add_static(2), p.allocate(1)
+            (0, 4, 6)
+            >>> p.add_static(5)
+            Traceback (most recent call last):
+            ...
+            SystemExit: Out of memory
+        """
+        addr = self.__heap_start
+        if addr + size > self.get_val("sp"):
+            sys.exit("Out of memory")
+        self.set_heap_start(addr + size)
+        return addr
+
+    def allocate(self, size):
+        """
+        Returns the address of a new block of size memory cells, taken from
+        the top of the heap. The heap must not reach the stack: if it does,
+        the garbage collector runs, and, if it still does, the program stops.
+
+        Example:
+            >>> p = Program(10, {}, [])
+            >>> p.set_heap_start(2)
+            >>> p.allocate(4), p.allocate(4)
+            (2, 6)
+        """
+        addr = self.__heap_top
+        if addr + size > self.get_val("sp"):
+            self.collect()
+            addr = self.__heap_top
+            if addr + size > self.get_val("sp"):
+                sys.exit("Out of memory")
+        self.__heap_top = addr + size
+        self.__blocks[addr] = size
+        stats = self.__heap_stats
+        stats["allocations"] += 1
+        stats["allocated"] += size
+        stats["peak"] = max(stats["peak"], self.__heap_top - self.__heap_start)
+        return Address(addr)
+
+    def roots(self):
+        """
+        Returns the addresses of the memory cells that the program might read
+        without going through the heap: the static data, and the stack, from
+        sp to the end of the memory.
+        """
+        stack = range(self.get_val("sp"), len(self.__mem))
+        return list(range(self.__heap_start)) + list(stack)
+
+    def collect(self):
+        """
+        Reclaims the blocks of the heap that the program can no longer reach,
+        and slides the others towards the start of the heap, updating every
+        address that points to them. The roots are the registers, plus the
+        cells returned by roots. Blocks are found through the addresses in
+        these places, and in the blocks found before. Returns the number of
+        memory cells reclaimed.
+
+        Example:
+            >>> p = Program(40, {}, [])
+            >>> p.set_val("a", p.allocate(8))
+            >>> p.set_val("b", p.allocate(4))
+            >>> p.set_mem(p.get_val("b"), p.allocate(8))
+            >>> p.set_val("a", 0)
+            >>> p.collect(), p.get_val("b"), p.get_mem(0)
+            (8, 0, 4)
+            >>> stats = p.get_heap_stats()
+            >>> stats["collections"], stats["live"], stats["allocated"]
+            (1, 12, 20)
+
+        Programs that build closures in a loop can run for long:
+            >>> insts = [Addi("n", "x0", 1000), Alloc("c", 8), Sw("c", 4, "n"),
+            ...          Addi("n", "n", -1), Bne("n", "x0", 1)]
+            >>> p = Program(32, {}, insts)
+            >>> p.eval()
+            >>> p.get_heap_stats()["collections"]
+            332
+        """
+        mem, blocks = self.__mem, self.__blocks
+        cells = self.roots()
+        work = [v for v in self.__env.values() if isinstance(v, Address)]
+        work += [mem[i] for i in cells if isinstance(mem[i], Address)]
+        live = set()
+        while work:
+            addr = work.pop()
+            if addr in live or addr not in blocks:
+                continue
+            live.add(addr)
+            work += [v for v in mem[addr:addr + blocks[addr]]
+                     if isinstance(v, Address)]
+        forward, moved = {}, {}
+        top = self.__heap_start
+        for addr, size in blocks.items():
+            if addr in live:
+                forward[addr] = Address(top)
+                moved[top] = size
+                top += size
+        for name, v in self.__env.items():
+            if isinstance(v, Address) and v in forward:
+                self.__env[name] = forward[v]
+        for addr in live:
+            cells += range(addr, addr + blocks[addr])
+        for i in cells:
+            v = mem[i]
+            if isinstance(v, Address) and v in forward:
+                mem[i] = forward[v]
+        for addr, size in blocks.items():
+            if addr in live:
+                new = forward[addr]
+                mem[new:new + size] = mem[addr:addr + size]
+        reclaimed = self.__heap_top - top
+        mem[top:self.__heap_top] = [0] * reclaimed
+        self.__heap_top = top
+        self.__blocks = moved
+        stats = self.__heap_stats
+        stats["collections"] += 1
+        stats["reclaimed"] += reclaimed
+        stats["live"] = top - self.__heap_start
+        return reclaimed
+
+    def get_heap_stats(self):
+        """
+        Returns a dictionary with statistics about the heap: the number of
+        blocks allocated, the total number of cells that they occupy, the
+        number of collections, the number of cells that they reclaimed, the
+        number of cells alive after the last collection, and the largest size
+        of the heap.
+        """
+        return dict(self.__heap_stats)
+
     def get_val(self, name):
         """
         The register x0 always contains the value zero:
@@ -88,21 +540,32 @@ class Program:
         else:
             sys.exit(f"Undefined register: {name}")
 
+    def get_registers(self):
+        """
+        Returns the names of the registers that hold values.
+
+        Example:
+            >>> sorted(Program(0, {"a": 1}, []).get_registers())
+            ['a', 'sp', 'x0']
+        """
+        return list(self.__env)
+
     def print_env(self):
         for name, val in sorted(self.__env.items()):
             print(f"{name}: {val}")
 
     def print_insts(self):
         counter = 0
-        for inst in self.__insts:
+        for inst in self.get_insts():
             print("%03d: %s" % (counter, str(inst)))
             counter += 1
         print("%03d: %s" % (counter, "END"))
 
-    def eval(self):
+    def eval(self, trace=False):
         """
          This function evaluates a program until there is no more instructions to
-         evaluate.
+         evaluate. If trace is True, then it prints each instruction before
+         evaluating it.
 
          Example:
              >>> insts = [Add("t0", "b0", "b1"), Sub("x1", "t0", "b2")]
@@ -127,12 +590,50 @@ class Program:
              sp: 0
              x0: 0
         """
+        self.link()
         inst = self.get_inst()
         while inst:
-            print(f'{inst} (pc:{self.pc-1}, ra:{self.__env["ra"] if "ra" in self.__env else "N/A"})')
+            if trace:
+                print(f'{inst} (pc:{self.pc-1}, ra:{self.__env["ra"] if "ra" in self.__env else "N/A"})')
             inst.eval(self)
             inst = self.get_inst()
 
+    def eval_unchecked(self):
+        """
+        Evaluates the program like eval, but reads and writes registers
+        without checking them: reading a register that has no value is an
+        error of Python, and writes into x0 are not ignored. Only programs
+        that the verifier of Verify.py accepts can run this way. Writes into
+        sp are still checked against the heap, which grows as the program
+        runs.
+
+        Example:
+            >>> insts = [Addi("a", "x0", 3), Jal("x0", 3), Addi("a", "a", 1),
+            ...          Add("b", "a", "a")]
+            >>> p = Program(0, {}, insts)
+            >>> p.eval_unchecked()
+            >>> p.get_val("b")
+            6
+        """
+        self.link()
+        env = self.__env
+
+        def set_val(name, value):
+            env[name] = value
+            if name == "sp" and value < self.__heap_top:
+                self.check_stack(value)
+
+        self.get_val, self.set_val = env.__getitem__, set_val
+        try:
+            insts = self.__insts
+            n = len(insts)
+            while 0 <= self.pc < n:
+                inst = insts[self.pc]
+                self.pc += 1
+                inst.eval(self)
+        finally:
+            del self.get_val, self.set_val
+
 
 def max(a, b):
     """
@@ -204,6 +705,36 @@ class Inst(ABC):
     def eval(self, prog):
         raise NotImplementedError
 
+    @abstractmethod
+    def get_uses(self):
+        """
+        Returns the list of registers that the instruction reads.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_defs(self):
+        """
+        Returns the list of registers that the instruction writes.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def rename(self, mapping):
+        """
+        Replaces the registers of the instruction, following the dictionary
+        mapping. Registers that are not in mapping remain the same.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def rename_uses(self, mapping):
+        """
+        Like rename, but only replaces the registers that the instruction
+        reads.
+        """
+        raise NotImplementedError
+
 
 class BranchOp(Inst):
     """
@@ -217,10 +748,11 @@ class BranchOp(Inst):
         self.lab = lab
 
 
-class Beq(BranchOp):
+class CondBranch(BranchOp):
     """
-    beq rs1, rs2, lab:
-    Jumps to label lab if the value in rs1 is equal to the value in rs2.
+    The general class of conditional branches. These instructions compare the
+    values in rs1 and rs2, and jump to label lab if the comparison, given by
+    the method 'holds', is true. Otherwise, the next instruction is pc + 1.
     """
 
     def __init__(self, rs1, rs2, lab=None):
@@ -231,18 +763,154 @@ class Beq(BranchOp):
             assert isinstance(lab, int)
         self.lab = lab
 
-    def get_opcode(self):
-        return "beq"
+    @abstractmethod
+    def holds(self, a, b):
+        raise NotImplementedError
+
+    @abstractmethod
+    def negate(self):
+        """
+        Returns a new branch, to the same label, that jumps exactly when this
+        branch falls through.
+        """
+        raise NotImplementedError
+
+    def get_uses(self):
+        return [self.rs1, self.rs2]
+
+    def get_defs(self):
+        return []
+
+    def rename(self, mapping):
+        self.rename_uses(mapping)
+
+    def rename_uses(self, mapping):
+        self.rs1 = mapping.get(self.rs1, self.rs1)
+        self.rs2 = mapping.get(self.rs2, self.rs2)
 
     def __str__(self):
         op = self.get_opcode()
         return f"{op} {self.rs1} {self.rs2} {self.lab}"
 
     def eval(self, prog):
-        if prog.get_val(self.rs1) == prog.get_val(self.rs2):
+        if self.holds(prog.get_val(self.rs1), prog.get_val(self.rs2)):
             prog.set_pc(self.lab)
 
 
+class Beq(CondBranch):
+    """
+    beq rs1, rs2, lab:
+    Jumps to label lab if the value in rs1 is equal to the value in rs2.
+
+    Example:
+        >>> i = Beq("a", "b", 7)
+        >>> str(i), str(i.negate())
+        ('beq a b 7', 'bne a b 7')
+
+        >>> p = Program(10, env={"a":2, "b":2}, insts=[Beq("a", "b", 7)])
+        >>> p.eval()
+        >>> p.get_pc()
+        7
+    """
+
+    def get_opcode(self):
+        return "beq"
+
+    def holds(self, a, b):
+        return a == b
+
+    def negate(self):
+        return Bne(self.rs1, self.rs2, self.lab)
+
+
+class Bne(CondBranch):
+    """
+    bne rs1, rs2, lab:
+    Jumps to label lab if the value in rs1 is different from the value in rs2.
+
+    Example:
+        >>> p = Program(10, env={"a":2, "b":3}, insts=[Bne("a", "b", 7)])
+        >>> p.eval()
+        >>> p.get_pc()
+        7
+
+        >>> p = Program(10, env={"a":3, "b":3}, insts=[Bne("a", "b", 7)])
+        >>> p.eval()
+        >>> p.get_pc()
+        1
+    """
+
+    def get_opcode(self):
+        return "bne"
+
+    def holds(self, a, b):
+        return a != b
+
+    def negate(self):
+        return Beq(self.rs1, self.rs2, self.lab)
+
+
+class Blt(CondBranch):
+    """
+    blt rs1, rs2, lab:
+    Jumps to label lab if the value in rs1 is less than the value in rs2
+    (signed comparison).
+
+    Example:
+        >>> i = Blt("a", "b", 7)
+        >>> str(i), str(i.negate())
+        ('blt a b 7', 'bge a b 7')
+
+        >>> p = Program(10, env={"a":-2, "b":3}, insts=[Blt("a", "b", 7)])
+        >>> p.eval()
+        >>> p.get_pc()
+        7
+
+        >>> p = Program(10, env={"a":3, "b":3}, insts=[Blt("a", "b", 7)])
+        >>> p.eval()
+        >>> p.get_pc()
+        1
+    """
+
+    def get_opcode(self):
+        return "blt"
+
+    def holds(self, a, b):
+        return a < b
+
+    def negate(self):
+        return Bge(self.rs1, self.rs2, self.lab)
+
+
+class Bge(CondBranch):
+    """
+    bge rs1, rs2, lab:
+    Jumps to label lab if the value in rs1 is greater than or equal to the
+    value in rs2 (signed comparison). Notice that 'a <= b' can be tested with
+    'bge b a lab'.
+
+    Example:
+        >>> p = Program(10, env={"a":3, "b":3}, insts=[Bge("a", "b", 7)])
+        >>> p.eval()
+        >>> p.get_pc()
+        7
+
+        >>> p = Program(10, env={"a":-4, "b":3}, insts=[Bge("a", "b", 7)])
+        >>> p.eval()
+        >>> p.get_pc()
+        1
+    """
+
+    def get_opcode(self):
+        return "bge"
+
+    def holds(self, a, b):
+        return a >= b
+
+    def negate(self):
+        return Blt(self.rs1, self.rs2, self.lab)
+
+
 class Jal(BranchOp):
     """
     jal rd lab:
@@ -276,6 +944,18 @@ class Jal(BranchOp):
     def get_opcode(self):
         return "jal"
 
+    def get_uses(self):
+        return []
+
+    def get_defs(self):
+        return [self.rd]
+
+    def rename(self, mapping):
+        self.rd = mapping.get(self.rd, self.rd)
+
+    def rename_uses(self, mapping):
+        pass
+
     def __str__(self):
         op = self.get_opcode()
         return f"{op} {self.rd} {self.lab}"
@@ -323,6 +1003,19 @@ class Jalr(BranchOp):
     def get_opcode(self):
         return "jalr"
 
+    def get_uses(self):
+        return [self.rs]
+
+    def get_defs(self):
+        return [self.rd]
+
+    def rename(self, mapping):
+        self.rd = mapping.get(self.rd, self.rd)
+        self.rs = mapping.get(self.rs, self.rs)
+
+    def rename_uses(self, mapping):
+        self.rs = mapping.get(self.rs, self.rs)
+
     def __str__(self):
         op = self.get_opcode()
         return f"{op} {self.rd} {self.rs} {self.offset}"
@@ -334,6 +1027,59 @@ class Jalr(BranchOp):
         prog.set_pc(rs_val + self.offset)
 
 
+class La(Inst):
+    """
+    la rd, lab
+    Stores the address of the instruction at label lab on register rd. Like
+    the branches, this instruction refers to a label, which must be updated
+    whenever instructions are inserted or removed from the program. Thus,
+    function addresses should be loaded with 'la', instead of 'addi'.
+
+    Example:
+        >>> i = La("a", 20)
+        >>> str(i)
+        'la a 20'
+
+        >>> p = Program(10, env={}, insts=[La("a", 20)])
+        >>> p.eval()
+        >>> p.get_val("a")
+        20
+    """
+
+    def __init__(self, rd, lab=None):
+        assert isinstance(rd, str)
+        self.rd = rd
+        if lab != None:
+            assert isinstance(lab, int)
+        self.lab = lab
+
+    def set_target(self, lab):
+        assert isinstance(lab, int)
+        self.lab = lab
+
+    def get_opcode(self):
+        return "la"
+
+    def __str__(self):
+        op = self.get_opcode()
+        return f"{op} {self.rd} {self.lab}"
+
+    def eval(self, prog):
+        prog.set_val(self.rd, self.lab)
+
+    def get_uses(self):
+        return []
+
+    def get_defs(self):
+        return [self.rd]
+
+    def rename(self, mapping):
+        self.rd = mapping.get(self.rd, self.rd)
+
+    def rename_uses(self, mapping):
+        pass
+
+
 class MemOp(Inst):
     """
     The general class of instructions that access memory. These instructions
@@ -351,6 +1097,10 @@ class MemOp(Inst):
         op = self.get_opcode()
         return f"{op} {self.reg}, {self.offset}({self.rs1})"
 
+    def rename(self, mapping):
+        self.rs1 = mapping.get(self.rs1, self.rs1)
+        self.reg = mapping.get(self.reg, self.reg)
+
 
 class Sw(MemOp):
     """
@@ -381,6 +1131,15 @@ class Sw(MemOp):
     def get_opcode(self):
         return "sw"
 
+    def get_uses(self):
+        return [self.reg, self.rs1]
+
+    def get_defs(self):
+        return []
+
+    def rename_uses(self, mapping):
+        self.rename(mapping)
+
 
 class Lw(MemOp):
     """
@@ -417,6 +1176,62 @@ class Lw(MemOp):
     def get_opcode(self):
         return "lw"
 
+    def get_uses(self):
+        return [self.rs1]
+
+    def get_defs(self):
+        return [self.reg]
+
+    def rename_uses(self, mapping):
+        self.rs1 = mapping.get(self.rs1, self.rs1)
+
+
+class Alloc(Inst):
+    """
+    alloc rd, size
+    Allocates a block of size memory cells in the heap, and stores its address
+    on register rd. The contents of the block are not initialized. The address
+    is tagged, so that the garbage collector can update it if it moves the
+    block.
+
+    Example:
+        >>> i = Alloc("a", 8)
+        >>> str(i)
+        'a = alloc 8'
+
+        >>> insts = [Alloc("a", 8), Alloc("b", 4), Sw("b", 0, "a")]
+        >>> p = Program(20, env={}, insts=insts)
+        >>> p.eval()
+        >>> p.get_val("a"), p.get_val("b"), p.get_mem(8)
+        (0, 8, 0)
+    """
+
+    def __init__(self, rd, size):
+        assert isinstance(rd, str) and isinstance(size, int)
+        self.rd = rd
+        self.size = size
+
+    def get_opcode(self):
+        return "alloc"
+
+    def __str__(self):
+        return f"{self.rd} = alloc {self.size}"
+
+    def eval(self, prog):
+        prog.set_val(self.rd, prog.allocate(self.size))
+
+    def get_uses(self):
+        return []
+
+    def get_defs(self):
+        return [self.rd]
+
+    def rename(self, mapping):
+        self.rd = mapping.get(self.rd, self.rd)
+
+    def rename_uses(self, mapping):
+        pass
+
 
 class BinOp(Inst):
     """
@@ -435,6 +1250,20 @@ class BinOp(Inst):
         op = self.get_opcode()
         return f"{self.rd} = {op} {self.rs1} {self.rs2}"
 
+    def get_uses(self):
+        return [self.rs1, self.rs2]
+
+    def get_defs(self):
+        return [self.rd]
+
+    def rename(self, mapping):
+        self.rd = mapping.get(self.rd, self.rd)
+        self.rename_uses(mapping)
+
+    def rename_uses(self, mapping):
+        self.rs1 = mapping.get(self.rs1, self.rs1)
+        self.rs2 = mapping.get(self.rs2, self.rs2)
+
 
 class BinOpImm(Inst):
     """
@@ -454,6 +1283,19 @@ class BinOpImm(Inst):
         op = self.get_opcode()
         return f"{self.rd} = {op} {self.rs1} {self.imm}"
 
+    def get_uses(self):
+        return [self.rs1]
+
+    def get_defs(self):
+        return [self.rd]
+
+    def rename(self, mapping):
+        self.rd = mapping.get(self.rd, self.rd)
+        self.rename_uses(mapping)
+
+    def rename_uses(self, mapping):
+        self.rs1 = mapping.get(self.rs1, self.rs1)
+
 
 class Add(BinOp):
     """
@@ -623,6 +1465,38 @@ class Div(BinOp):
         return "div"
 
 
+class Rem(BinOp):
+    """
+    rem rd, rs1, rs2: rd = rs1 % rs2 (remainder of the signed division)
+    The remainder has the sign of rs2, so that rs1 == (rs1 div rs2) * rs2 +
+    (rs1 rem rs2), where div is the instruction above. Like div, this
+    instruction fails if rs2 is zero.
+
+    Example:
+        >>> i = Rem("a", "b0", "b1")
+        >>> str(i)
+        'a = rem b0 b1'
+
+        >>> p = Program(0, env={"b0":8, "b1":3}, insts=[Rem("a", "b0", "b1")])
+        >>> p.eval()
+        >>> p.get_val("a")
+        2
+
+        >>> p = Program(0, env={"b0":-8, "b1":3}, insts=[Rem("a", "b0", "b1")])
+        >>> p.eval()
+        >>> p.get_val("a")
+        1
+    """
+
+    def eval(self, prog):
+        rs1 = prog.get_val(self.rs1)
+        rs2 = prog.get_val(self.rs2)
+        prog.set_val(self.rd, rs1 % rs2)
+
+    def get_opcode(self):
+        return "rem"
+
+
 class Slt(BinOp):
     """
     slt rd, rs1, rs2: rd = (rs1 < rs2) ? 1 : 0 (signed comparison)
@@ -689,3 +1563,231 @@ class Slti(BinOpImm):
 
     def get_opcode(self):
         return "slti"
+
+
+def unsigned(value):
+    """
+    Returns the value of the XLEN-bit word that represents value, when this
+    word is read as an unsigned integer.
+
+    Example:
+        >>> unsigned(5), unsigned(-1) == 2**XLEN - 1
+        (5, True)
+    """
+    return value % (1 << XLEN)
+
+
+class Sltu(BinOp):
+    """
+    sltu rd, rs1, rs2: rd = (rs1 < rs2) ? 1 : 0 (unsigned comparison)
+
+    Example:
+        >>> i = Sltu("a", "b0", "b1")
+        >>> str(i)
+        'a = sltu b0 b1'
+
+        >>> p = Program(0, env={"b0":2, "b1":3}, insts=[Sltu("a", "b0", "b1")])
+        >>> p.eval()
+        >>> p.get_val("a")
+        1
+
+        >>> insts = [Sltu("a", "b0", "b1")]
+        >>> p = Program(0, env={"b0":-1, "b1":3}, insts=insts)
+        >>> p.eval()
+        >>> p.get_val("a")
+        0
+    """
+
+    def eval(self, prog):
+        rs1 = unsigned(prog.get_val(self.rs1))
+        rs2 = unsigned(prog.get_val(self.rs2))
+        prog.set_val(self.rd, 1 if rs1 < rs2 else 0)
+
+    def get_opcode(self):
+        return "sltu"
+
+
+class Sltiu(BinOpImm):
+    """
+    sltiu rd, rs1, imm: rd = (rs1 < imm) ? 1 : 0
+    (unsigned comparison with immediate)
+
+    Example:
+        >>> i = Sltiu("a", "b0", 4)
+        >>> str(i)
+        'a = sltiu b0 4'
+
+        >>> p = Program(0, env={"b0":-2}, insts=[Sltiu("a", "b0", 4)])
+        >>> p.eval()
+        >>> p.get_val("a")
+        0
+    """
+
+    def eval(self, prog):
+        rs1 = unsigned(prog.get_val(self.rs1))
+        prog.set_val(self.rd, 1 if rs1 < unsigned(self.imm) else 0)
+
+    def get_opcode(self):
+        return "sltiu"
+
+
+class Seqz(Sltiu):
+    """
+    seqz rd, rs1: rd = (rs1 == 0) ? 1 : 0
+    This is 'sltiu rd, rs1, 1': zero is the only unsigned value below one.
+
+    Example:
+        >>> i = Seqz("a", "b0")
+        >>> str(i)
+        'a = seqz b0'
+
+        >>> p = Program(0, env={"b0":0}, insts=[Seqz("a", "b0")])
+        >>> p.eval()
+        >>> p.get_val("a")
+        1
+
+        >>> p = Program(0, env={"b0":-3}, insts=[Seqz("a", "b0")])
+        >>> p.eval()
+        >>> p.get_val("a")
+        0
+    """
+
+    def __init__(self, rd, rs1):
+        super().__init__(rd, rs1, 1)
+
+    def __str__(self):
+        return f"{self.rd} = seqz {self.rs1}"
+
+    def get_opcode(self):
+        return "seqz"
+
+
+class Snez(Sltu):
+    """
+    snez rd, rs2: rd = (rs2 != 0) ? 1 : 0
+    This is 'sltu rd, x0, rs2': every unsigned value but zero is above zero.
+
+    Example:
+        >>> i = Snez("a", "b0")
+        >>> str(i)
+        'a = snez b0'
+
+        >>> p = Program(0, env={"b0":-3}, insts=[Snez("a", "b0")])
+        >>> p.eval()
+        >>> p.get_val("a")
+        1
+    """
+
+    def __init__(self, rd, rs2):
+        super().__init__(rd, "x0", rs2)
+
+    def __str__(self):
+        return f"{self.rd} = snez {self.rs2}"
+
+    def get_opcode(self):
+        return "snez"
+
+
+class Slli(BinOpImm):
+    """
+    slli rd, rs1, imm: rd = rs1 << imm (shift left)
+
+    Example:
+        >>> i = Slli("a", "b0", 3)
+        >>> str(i)
+        'a = slli b0 3'
+
+        >>> p = Program(0, env={"b0":-5}, insts=[Slli("a", "b0", 3)])
+        >>> p.eval()
+        >>> p.get_val("a")
+        -40
+    """
+
+    def eval(self, prog):
+        rs1 = prog.get_val(self.rs1)
+        prog.set_val(self.rd, rs1 << self.imm)
+
+    def get_opcode(self):
+        return "slli"
+
+
+class Srli(BinOpImm):
+    """
+    srli rd, rs1, imm: rd = rs1 >> imm (logical shift right)
+    The vacated bits are filled with zeros, so negative numbers become large
+    positive numbers: rs1 is read as an unsigned XLEN-bit word.
+
+    Example:
+        >>> i = Srli("a", "b0", 1)
+        >>> str(i)
+        'a = srli b0 1'
+
+        >>> p = Program(0, env={"b0":-2}, insts=[Srli("a", "b0", 1)])
+        >>> p.eval()
+        >>> p.get_val("a") == 2**(XLEN - 1) - 1
+        True
+    """
+
+    def eval(self, prog):
+        rs1 = unsigned(prog.get_val(self.rs1))
+        prog.set_val(self.rd, rs1 >> self.imm)
+
+    def get_opcode(self):
+        return "srli"
+
+
+class Srai(BinOpImm):
+    """
+    srai rd, rs1, imm: rd = rs1 >> imm (arithmetic shift right)
+    The sign bit is replicated, so the result is rs1 div 2**imm, rounded
+    towards minus infinity, exactly like the div instruction.
+
+    Example:
+        >>> i = Srai("a", "b0", 2)
+        >>> str(i)
+        'a = srai b0 2'
+
+        >>> p = Program(0, env={"b0":-7}, insts=[Srai("a", "b0", 2)])
+        >>> p.eval()
+        >>> p.get_val("a")
+        -2
+    """
+
+    def eval(self, prog):
+        rs1 = prog.get_val(self.rs1)
+        prog.set_val(self.rd, rs1 >> self.imm)
+
+    def get_opcode(self):
+        return "srai"
+
+
+def rewrite(insts, expansions, symbols=None):
+    """
+    Replaces each instruction insts[i] with the list of instructions
+    expansions[i], and returns the new program. The labels of the branches,
+    and of the 'la' instructions, are updated: a label that pointed to insts[i]
+    now points to the first instruction of expansions[i]. If this list is
+    empty, then the label points to the next instruction that remains in the
+    program. The labels in the expansions must refer to the old program. The
+    labels in the dictionary symbols, if given, are updated in place.
+
+    Example:
+        >>> insts = [Beq("a", "x0", 2), Addi("a", "a", 1), Jal("x0", 0)]
+        >>> expansions = [[insts[0]], [], [Addi("b", "x0", 0), insts[2]]]
+        >>> [str(i) for i in rewrite(insts, expansions)]
+        ['beq a x0 1', 'b = addi x0 0', 'jal x0 0']
+    """
+    new_index = []
+    new_insts = []
+    for expansion in expansions:
+        new_index.append(len(new_insts))
+        new_insts.extend(expansion)
+    new_index.append(len(new_insts))
+    for inst in new_insts:
+        if getattr(inst, "lab", None) is not None:
+            if 0 <= inst.lab <= len(insts):
+                inst.set_target(new_index[inst.lab])
+    for name, lab in (symbols or {}).items():
+        if 0 <= lab <= len(insts):
+            symbols[name] = new_index[lab]
+    return new_insts
@@ -0,0 +1,310 @@
+"""
+This file implements the calling convention of the programs produced by the
+GenVisitor. Registers are global, so a function that is called while another
+invocation of it is still active (directly or through functions that it
+receives as parameters) overwrites the parameters and the temporaries of the
+first invocation. The convention divides the registers into two sets:
+
+* Callee-saved: ra and sp. A function that makes calls saves ra in its frame,
+  and every function restores ra and sp before returning, and before tail
+  calls, which jump to another function that returns in its place. Functions
+  that make no calls, other than tail calls, do not have a frame at all.
+* Caller-saved: every other register, but x0, a0, which holds arguments and
+  return values, and a1, which holds the closure of the callee. Before a
+  call, the caller stores, in its own frame, the registers that are alive
+  after the call and that the callee, or any function that the callee might
+  call, writes. The caller loads them back after the call.
+
+Registers whose only definition loads a constant, or the address of a
+function, are never saved: every write gives them the same value.
+
+This file uses doctests all over. To test it, just run python 3 as follows:
+"python3 -m doctest CallConv.py".
+"""
+
+import Asm as AsmModule
+from Cfg import Frames, is_call, is_return, is_tail_call, local_successors
+from RegAlloc import RESERVED, is_rematerializable
+
+"""
+The callee of indirect calls: any function whose address is taken.
+"""
+INDIRECT = "*"
+
+
+class CallerSaves:
+    """
+    This class inserts the code that saves and restores caller-saved
+    registers around calls. The slots of the registers are allocated in the
+    frame of the caller, whose size is increased at the entry of its code,
+    and decreased before each of its returns.
+
+    Example:
+        >>> insts = [AsmModule.La("f", 7), AsmModule.Jal("x0", 13),
+        ...          AsmModule.Addi("a0", "x0", 1), AsmModule.Jal("ra", 7),
+        ...          AsmModule.Add("y", "a0", "x0"),
+        ...          AsmModule.Add("r", "y", "y"), AsmModule.Jal("x0", 14),
+        ...          AsmModule.Addi("sp", "sp", -4),
+        ...          AsmModule.Sw("sp", 0, "ra"),
+        ...          AsmModule.Add("x", "a0", "x0"),
+        ...          AsmModule.Jalr("ra", "x0"),
+        ...          AsmModule.Add("a0", "x", "a0"),
+        ...          AsmModule.Lw("sp", 0, "ra"), AsmModule.Jalr("x0", "ra")]
+        >>> p = AsmModule.Program(100, {}, insts)
+        >>> CallerSaves(p).save()
+        1
+        >>> [str(i) for i in p.get_insts()][11:15]
+        ['sw x, 4(sp)', 'jalr ra x0 0', 'lw x, 4(sp)', 'a0 = add x a0']
+    """
+
+    def __init__(self, prog):
+        self.prog = prog
+
+    def find_functions(self, insts):
+        """
+        Computes, for each context, the registers that its code writes and
+        reads, and the contexts that it might call.
+        """
+        fr = self.frames
+        defs, reads, calls = {}, {}, {}
+        constant = {}
+        for i, inst in enumerate(insts):
+            c = fr.context[i]
+            for reg in inst.get_defs():
+                if reg not in RESERVED:
+                    defs.setdefault(c, set()).add(reg)
+                    first = reg not in constant
+                    constant[reg] = first and is_rematerializable(inst)
+            reads.setdefault(c, set()).update(
+                reg for reg in inst.get_uses() if reg not in RESERVED)
+            if is_call(inst) or is_tail_call(inst, fr.functions):
+                callees = calls.setdefault(c, set())
+                if isinstance(inst, AsmModule.Jal):
+                    callees.add(inst.lab)
+                else:
+                    callees.add(INDIRECT)
+        self.invariant = {reg for reg, value in constant.items() if value}
+        return defs, reads, calls
+
+    def successors(self, c, calls):
+        if c == INDIRECT:
+            return self.address_taken
+        return calls.get(c, ())
+
+    def components(self, calls):
+        """
+        Returns the strongly connected components of the call graph, in
+        reverse topological order: the components that a component calls come
+        before it. This is Tarjan's algorithm, without recursion.
+        """
+        index, low, stack, on_stack = {}, {}, [], set()
+        components = []
+        for root in list(calls) + [INDIRECT]:
+            if root in index:
+                continue
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(self.successors(root, calls)))]
+            while work:
+                c, children = work[-1]
+                d = next(children, None)
+                if d is None:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[c])
+                    if low[c] == index[c]:
+                        component = set()
+                        while True:
+                            d = stack.pop()
+                            on_stack.discard(d)
+                            component.add(d)
+                            if d == c:
+                                break
+                        components.append(component)
+                elif d not in index:
+                    index[d] = low[d] = len(index)
+                    stack.append(d)
+                    on_stack.add(d)
+                    work.append((d, iter(self.successors(d, calls))))
+                elif d in on_stack:
+                    low[c] = min(low[c], index[d])
+        return components
+
+    def find_effects(self, defs, reads, calls):
+        """
+        Computes, for each context, and for INDIRECT, the registers that a
+        call to it might write, and the registers that it might read before
+        writing them: those that the callees read, but do not define. Code
+        that belongs to no context, because it is shared by several entries,
+        might run during any call.
+        """
+        shared_defs = defs.get(None, set())
+        shared_reads = reads.get(None, set()) - shared_defs
+        effects = {}
+        for component in self.components(calls):
+            written, read = set(shared_defs), set(shared_reads)
+            for c in component:
+                written |= defs.get(c, set())
+                read |= reads.get(c, set()) - defs.get(c, set())
+                for d in self.successors(c, calls):
+                    if d not in component:
+                        written |= effects[d][0]
+                        read |= effects[d][1]
+            for c in component:
+                effects[c] = (written, read)
+        return effects
+
+    def call_effects(self, inst):
+        """
+        Returns the registers that the call inst might write, and the
+        registers that it might read before writing them.
+        """
+        key = inst.lab if isinstance(inst, AsmModule.Jal) else INDIRECT
+        written, read = self.effects.get(key, (set(), set()))
+        return written - self.invariant, read
+
+    def live_after_calls(self, insts, members, effects, universe):
+        """
+        Computes the registers of universe that are alive after each call in
+        the code of a context, whose instructions are given by members. Calls
+        fall through to the next instruction, and read the registers that
+        their callees read; so do tail calls, which have no successors.
+        Returns a dictionary that maps calls to sets.
+        """
+        live_in, live_after = {}, {}
+        changed = True
+        while changed:
+            changed = False
+            for i in reversed(members):
+                live = set()
+                for s in local_successors(insts, i, self.frames.functions):
+                    live |= live_in.get(s, set())
+                inst = insts[i]
+                if i in effects:
+                    live_after[i] = live
+                    live = live | effects[i][1]
+                else:
+                    live = live.difference(inst.get_defs())
+                live.update(reg for reg in inst.get_uses() if reg in universe)
+                if live != live_in.get(i):
+                    live_in[i] = live
+                    changed = True
+        return live_after
+
+    def defined_at_calls(self, insts, entry, members, calls):
+        """
+        Computes the registers that are written on every path from the entry
+        of a context to each call in calls. Only these registers can be saved:
+        reading the others might read a register that does not exist yet.
+        """
+        preds = {i: [] for i in members}
+        for i in members:
+            for s in local_successors(insts, i, self.frames.functions):
+                if s in preds:
+                    preds[s].append(i)
+        defined_out = {}
+        changed = True
+        while changed:
+            changed = False
+            for i in members:
+                known = [defined_out[p] for p in preds[i] if p in defined_out]
+                if i == entry or not known:
+                    defined = set()
+                else:
+                    defined = set.intersection(*known)
+                if i in calls:
+                    calls[i] = defined
+                else:
+                    defined = defined.union(insts[i].get_defs())
+                if defined != defined_out.get(i):
+                    defined_out[i] = defined
+                    changed = True
+        return calls
+
+    def save(self):
+        """
+        Inserts the saves and restores, and returns the number of calls
+        around which registers are saved.
+        """
+        insts = self.prog.get_insts()
+        self.frames = fr = Frames(insts, self.prog.get_symbols().values())
+        self.address_taken = {inst.lab for inst in insts
+                              if isinstance(inst, AsmModule.La)}
+        defs, reads, calls = self.find_functions(insts)
+        self.effects = self.find_effects(defs, reads, calls)
+        universe = set()
+        for c, regs in defs.items():
+            if c != 0:
+                universe |= regs
+        universe -= self.invariant
+        members = {}
+        for i, c in enumerate(fr.context):
+            members.setdefault(c, []).append(i)
+        saved = {}
+        for c, indices in members.items():
+            effects = {}
+            for i in indices:
+                inst = insts[i]
+                jumps = is_call(inst) or is_tail_call(inst, fr.functions)
+                if jumps and fr.reached[i]:
+                    written, read = self.call_effects(insts[i])
+                    effects[i] = (written, read & universe)
+            if not effects:
+                continue
+            live_after = self.live_after_calls(insts, indices, effects,
+                                               universe)
+            defined = self.defined_at_calls(insts, c, indices, dict(effects))
+            for i, live in live_after.items():
+                if not is_call(insts[i]):
+                    continue
+                regs = sorted(live & effects[i][0] & defined[i])
+                if regs:
+                    if c is None or fr.depth[i] is None:
+                        raise ValueError(f"cannot save registers at call {i}")
+                    saved[i] = regs
+        frame_size = {}
+        for i, regs in saved.items():
+            c = fr.context[i]
+            frame_size[c] = max(frame_size.get(c, 0), 4 * len(regs))
+        expansions = [[inst] for inst in insts]
+        for i, inst in enumerate(insts):
+            before, after = [], []
+            if i in frame_size:
+                before.append(AsmModule.Addi("sp", "sp", -frame_size[i]))
+            c = fr.context[i]
+            leaves = is_return(inst) or is_tail_call(inst, fr.functions)
+            if leaves and c in frame_size and c != 0:
+                before.append(AsmModule.Addi("sp", "sp", frame_size[c]))
+            for k, reg in enumerate(saved.get(i, [])):
+                offset = 4 * k - fr.depth[i]
+                before.append(AsmModule.Sw("sp", offset, reg))
+                after.append(AsmModule.Lw("sp", offset, reg))
+            expansions[i] = before + [inst] + after
+        if saved:
+            self.prog.rewrite(expansions)
+        return len(saved)
+
+
+def save_registers(prog):
+    """
+    Makes the program prog follow the calling convention, by saving the
+    caller-saved registers around its calls. The program is modified in
+    place. This pass must run before register allocation, while each
+    variable still has its own register.
+
+    Example:
+        >>> import Visitor
+        >>> from Expression import *
+        >>> t = Fn('k', Add(App(Var('k'), Num(1)), App(Var('k'), Num(2))))
+        >>> e = Let('t', t, App(Var('t'), Fn('y', App(Var('t'),
+        ...         Fn('z', Add(Var('z'), Var('y')))))))
+        >>> p = AsmModule.Program(1000, {}, [])
+        >>> v = e.accept(Visitor.GenVisitor(), p)
+        >>> save_registers(p)
+        >>> p.eval()
+        >>> p.get_val(v)
+        12
+    """
+    CallerSaves(prog).save()
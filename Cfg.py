@@ -0,0 +1,681 @@
+"""
+This file contains the control flow graph of Asm programs, plus the dataflow
+analyses that work on it: liveness and reaching definitions, plus the frames
+of the functions, i.e., the code and stack depths of each. Sets of registers
+and sets of definitions are represented as Python integers (bitsets), so that
+union, intersection and difference are single operations on machine words.
+
+The graph has one node for each basic block, plus three special nodes: exit,
+which is reached when the program counter leaves the program; call, which
+stands for the entry of any function called indirectly; and ret, which stands
+for the return of any function. Function entries are the instructions whose
+addresses are loaded by 'la'; direct calls, 'jal ra lab', go straight to the
+block of lab instead, and so do direct tail calls, 'jal x0 lab'. Indirect
+jumps through registers other than ra are tail calls, which lead to the call
+node. This view is conservative, and is exact enough for programs where
+registers are global, as those produced by the GenVisitor.
+
+This file uses doctests all over. To test it, just run python 3 as follows:
+"python3 -m doctest Cfg.py".
+"""
+
+import Asm as AsmModule
+
+
+def is_call(inst):
+    """
+    Tells if the instruction is a function call, i.e., a jump that saves the
+    return address in a register.
+
+    Example:
+        >>> is_call(AsmModule.Jalr("ra", "f"))
+        True
+        >>> is_call(AsmModule.Jalr("x0", "ra"))
+        False
+    """
+    jumps = isinstance(inst, (AsmModule.Jal, AsmModule.Jalr))
+    return jumps and inst.rd != "x0"
+
+
+def is_return(inst):
+    """
+    Tells if the instruction is an indirect jump that does not save the return
+    address. In the code produced by the GenVisitor, these jumps are the
+    returns of functions, through ra, and indirect tail calls.
+
+    Example:
+        >>> is_return(AsmModule.Jalr("x0", "ra"))
+        True
+        >>> is_return(AsmModule.Jal("x0", 2))
+        False
+    """
+    return isinstance(inst, AsmModule.Jalr) and inst.rd == "x0"
+
+
+def is_tail_call(inst, functions):
+    """
+    Tells if the instruction jumps to a function without saving the return
+    address: the function then returns straight to the caller of the current
+    function. Direct tail calls jump to one of the entry points in functions,
+    and indirect tail calls are jumps through registers other than ra.
+
+    Example:
+        >>> is_tail_call(AsmModule.Jal("x0", 7), {7})
+        True
+        >>> is_tail_call(AsmModule.Jal("x0", 5), {7})
+        False
+        >>> is_tail_call(AsmModule.Jalr("x0", "f"), {7})
+        True
+        >>> is_tail_call(AsmModule.Jalr("x0", "ra"), {7})
+        False
+    """
+    if isinstance(inst, AsmModule.Jal):
+        return inst.rd == "x0" and inst.lab in functions
+    return is_return(inst) and inst.rs != "ra"
+
+
+def is_jump(inst):
+    """
+    Tells if the instruction might change the flow of control.
+
+    Example:
+        >>> is_jump(AsmModule.Beq("a", "b", 2)), is_jump(AsmModule.La("a", 2))
+        (True, False)
+    """
+    return isinstance(inst, (AsmModule.CondBranch, AsmModule.Jal,
+                             AsmModule.Jalr))
+
+
+def local_successors(insts, i, functions=()):
+    """
+    Returns the instructions that might run after insts[i] within the same
+    function. Calls are assumed to return to the instruction that follows
+    them, and returns have no local successor. Neither have tail calls to
+    the entry points in functions.
+
+    Example:
+        >>> insts = [AsmModule.Beq("a", "x0", 3), AsmModule.Jal("x0", 0),
+        ...          AsmModule.Jalr("ra", "f"), AsmModule.Jalr("x0", "ra")]
+        >>> [local_successors(insts, i) for i in range(len(insts))]
+        [[1, 3], [0], [3], []]
+        >>> local_successors(insts, 1, functions={0})
+        []
+    """
+    inst = insts[i]
+    if is_return(inst) or is_tail_call(inst, functions):
+        return []
+    if is_call(inst):
+        succs = [i + 1]
+    elif isinstance(inst, AsmModule.CondBranch):
+        succs = [i + 1, inst.lab]
+    elif isinstance(inst, AsmModule.Jal):
+        succs = [inst.lab]
+    else:
+        succs = [i + 1]
+    return [s for s in succs if 0 <= s < len(insts)]
+
+
+class Cfg:
+    """
+    The control flow graph of a list of instructions. Block b contains the
+    instructions in range(starts[b], ends[b]), and block_of[i] is the block
+    that contains instruction i. The special nodes exit, call and ret have
+    no instructions.
+
+    Example:
+        >>> insts = [AsmModule.Addi("a", "x0", 1),
+        ...          AsmModule.Beq("a", "x0", 4),
+        ...          AsmModule.Addi("a", "a", 1),
+        ...          AsmModule.Jal("x0", 1),
+        ...          AsmModule.Add("b", "a", "a")]
+        >>> g = Cfg(insts)
+        >>> [list(g.block_insts(b)) for b in range(g.num_blocks)]
+        [[0], [1], [2, 3], [4]]
+        >>> g.succs[:g.num_blocks], g.preds[:g.num_blocks]
+        ([[1], [2, 3], [1], [4]], [[], [0, 2], [1], [1]])
+        >>> g.block_of
+        [0, 1, 2, 2, 3]
+    """
+
+    def __init__(self, insts):
+        self.insts = insts
+        n = len(insts)
+        leaders = {0, n}
+        entries, ret_points = set(), set()
+        for i, inst in enumerate(insts):
+            if isinstance(inst, AsmModule.La):
+                if 0 <= inst.lab < n:
+                    entries.add(inst.lab)
+                    leaders.add(inst.lab)
+            elif is_jump(inst):
+                leaders.add(i + 1)
+                if is_call(inst):
+                    ret_points.add(i + 1)
+                lab = getattr(inst, "lab", None)
+                if lab is not None and 0 <= lab < n:
+                    leaders.add(lab)
+        self.starts = sorted(leaders)[:-1] if n else []
+        self.ends = self.starts[1:] + [n] if n else []
+        m = len(self.starts)
+        self.num_blocks = m
+        self.exit, self.call, self.ret = m, m + 1, m + 2
+        self.block_of = [0] * n
+        for b in range(m):
+            for i in range(self.starts[b], self.ends[b]):
+                self.block_of[i] = b
+        self.entries = sorted(self.block_of[i] for i in entries)
+        self.ret_points = sorted(self.block_of[i]
+                                 for i in ret_points if i < n)
+        if n in ret_points:
+            self.ret_points.append(self.exit)
+        self.succs = [self.block_successors(b) for b in range(m)]
+        self.succs += [[], list(self.entries), list(self.ret_points)]
+        self.preds = [[] for _ in self.succs]
+        for b, succs in enumerate(self.succs):
+            for s in succs:
+                self.preds[s].append(b)
+
+    def block_insts(self, b):
+        """
+        Returns the range of indices of the instructions in block b.
+        """
+        if b >= self.num_blocks:
+            return range(0)
+        return range(self.starts[b], self.ends[b])
+
+    def block(self, i):
+        """
+        Returns the block that contains instruction i; instructions out of
+        the program belong to the exit node.
+        """
+        return self.block_of[i] if 0 <= i < len(self.insts) else self.exit
+
+    def block_successors(self, b):
+        last = self.ends[b] - 1
+        inst = self.insts[last]
+        if is_return(inst):
+            targets = [self.ret] if inst.rs == "ra" else [self.call]
+        elif is_call(inst):
+            if isinstance(inst, AsmModule.Jal):
+                targets = [self.block(inst.lab)]
+            else:
+                targets = [self.call]
+        elif isinstance(inst, AsmModule.CondBranch):
+            targets = [self.block(last + 1), self.block(inst.lab)]
+        elif isinstance(inst, AsmModule.Jal):
+            targets = [self.block(inst.lab)]
+        else:
+            targets = [self.block(last + 1)]
+        return list(dict.fromkeys(targets))
+
+    def entry(self):
+        """
+        The node where the program starts.
+        """
+        return 0 if self.num_blocks else self.exit
+
+    def reverse_postorder(self):
+        """
+        Returns the nodes reachable from the entry, in reverse postorder. The
+        traversal uses an explicit stack, so that it works on large graphs.
+
+        Example:
+            >>> insts = [AsmModule.Beq("a", "x0", 2),
+            ...          AsmModule.Addi("a", "a", 1),
+            ...          AsmModule.Add("b", "a", "a")]
+            >>> Cfg(insts).reverse_postorder()
+            [0, 1, 2, 3]
+        """
+        order = []
+        visited = [False] * len(self.succs)
+        root = self.entry()
+        visited[root] = True
+        stack = [(root, iter(self.succs[root]))]
+        while stack:
+            node, children = stack[-1]
+            for child in children:
+                if not visited[child]:
+                    visited[child] = True
+                    stack.append((child, iter(self.succs[child])))
+                    break
+            else:
+                stack.pop()
+                order.append(node)
+        order.reverse()
+        return order
+
+    def dominators(self):
+        """
+        Returns the list of immediate dominators of the nodes, computed with
+        the algorithm of Cooper, Harvey and Kennedy. The entry is its own
+        dominator, and unreachable nodes have dominator None.
+
+        Example:
+            >>> insts = [AsmModule.Beq("a", "x0", 2),
+            ...          AsmModule.Addi("a", "a", 1),
+            ...          AsmModule.Add("b", "a", "a")]
+            >>> Cfg(insts).dominators()
+            [0, 0, 0, 2, None, None]
+        """
+        order = self.reverse_postorder()
+        number = {node: k for k, node in enumerate(order)}
+        idom = [None] * len(self.succs)
+        root = self.entry()
+        idom[root] = root
+
+        def intersect(a, b):
+            while a != b:
+                while number[a] > number[b]:
+                    a = idom[a]
+                while number[b] > number[a]:
+                    b = idom[b]
+            return a
+
+        changed = True
+        while changed:
+            changed = False
+            for node in order[1:]:
+                new_idom = None
+                for p in self.preds[node]:
+                    if idom[p] is None:
+                        continue
+                    if new_idom is None:
+                        new_idom = p
+                    else:
+                        new_idom = intersect(p, new_idom)
+                if idom[node] != new_idom:
+                    idom[node] = new_idom
+                    changed = True
+        return idom
+
+
+def dominates(idom, a, b):
+    """
+    Tells if node a dominates node b, given the immediate dominators idom.
+
+    Example:
+        >>> dominates([0, 0, 1], 0, 2), dominates([0, 0, 1], 2, 1)
+        (True, False)
+    """
+    while True:
+        if a == b:
+            return True
+        if b is None or idom[b] == b:
+            return False
+        b = idom[b]
+
+
+class Frames:
+    """
+    This class finds the context of each instruction: the entry point of the
+    code that contains it, which is either the start of the program, or the
+    first instruction of a function, i.e., the target of a 'la', of a direct
+    call, or one of the given entries, such as the symbols of the program.
+    Jumps to these functions are tail calls, which leave the context. It also
+    computes how much sp has been decremented at each instruction, relative to
+    the entry of its context. A context of None means that the instruction can
+    be reached from more than one entry, or from none (in which case
+    reached[i] is False), and a depth of None means that it is not statically
+    known.
+
+    Example:
+        >>> insts = [AsmModule.La("f", 3), AsmModule.Jal("x0", 5),
+        ...          AsmModule.Jalr("ra", "f"),
+        ...          AsmModule.Addi("sp", "sp", -4),
+        ...          AsmModule.Jalr("x0", "ra"), AsmModule.Jalr("ra", "f")]
+        >>> fr = Frames(insts)
+        >>> fr.context
+        [0, 0, None, 3, 3, 0]
+        >>> fr.depth
+        [0, 0, None, 0, -4, 0]
+    """
+
+    def __init__(self, insts, entries=()):
+        n = len(insts)
+        self.functions = {
+            inst.lab for inst in insts
+            if isinstance(inst, AsmModule.La) or
+            isinstance(inst, AsmModule.Jal) and is_call(inst)}
+        self.functions.update(entries)
+        self.functions = {lab for lab in self.functions if 0 < lab < n}
+        self.entries = [0] + sorted(self.functions)
+        self.context = ["unreached"] * n
+        self.depth = [None] * n
+        unknown = "unknown"
+        depth = [unknown] * n
+        for entry in self.entries:
+            if n == 0:
+                break
+            seen = {entry}
+            depth_entry = depth[entry]
+            depth[entry] = 0 if depth_entry == unknown else None
+            worklist = [entry]
+            while worklist:
+                i = worklist.pop()
+                if self.context[i] == "unreached":
+                    self.context[i] = entry
+                elif self.context[i] != entry:
+                    self.context[i] = None
+                d = depth[i]
+                inst = insts[i]
+                if d is not None and "sp" in inst.get_defs():
+                    if isinstance(inst, AsmModule.Addi) and inst.rs1 == "sp":
+                        d = d + inst.imm
+                    else:
+                        d = None
+                for s in local_successors(insts, i, self.functions):
+                    old = depth[s]
+                    new = d if old == unknown or old == d else None
+                    if s not in seen or new != old:
+                        seen.add(s)
+                        depth[s] = new
+                        worklist.append(s)
+        self.reached = [c != "unreached" for c in self.context]
+        for i in range(n):
+            if self.context[i] == "unreached":
+                self.context[i] = None
+            if depth[i] != unknown and self.context[i] is not None:
+                self.depth[i] = depth[i]
+
+
+class Liveness:
+    """
+    This class computes the registers that are alive at the beginning
+    (block_live_in) and at the end (block_live_out) of each node of the
+    graph. Sets of registers are bitsets: bit k is set if the register
+    self.names[k] is alive. The registers in 'ignore' are not tracked, and the
+    registers in live_out are alive at the exit. The sets of each instruction
+    are computed on demand, from the sets of its block.
+
+    Example:
+        >>> insts = [AsmModule.Addi("a", "x0", 1),
+        ...          AsmModule.Add("b", "a", "c"),
+        ...          AsmModule.Add("d", "b", "b")]
+        >>> lv = Liveness(Cfg(insts), live_out=["d"])
+        >>> [[sorted(lv.set_of(s)) for s in lv.live_at(i)] for i in range(3)]
+        [[['c'], ['a', 'c']], [['a', 'c'], ['b']], [['b'], ['d']]]
+    """
+
+    def __init__(self, cfg, live_out=(), ignore=("x0",)):
+        self.cfg = cfg
+        self.ignore = set(ignore)
+        self.names = []
+        self.index = {}
+        self.number_registers(live_out)
+        self.uses = [self.indices(inst.get_uses()) for inst in cfg.insts]
+        self.defs = [self.indices(inst.get_defs()) for inst in cfg.insts]
+        num_nodes = len(cfg.succs)
+        self.block_live_in = [0] * num_nodes
+        self.block_live_out = [0] * num_nodes
+        self.block_live_in[cfg.exit] = self.bits(live_out)
+        self.solve()
+
+    def number_registers(self, live_out):
+        """
+        Gives indices to the registers. Registers that might be alive between
+        blocks come first, and registers that are only used within the block
+        where they are defined come last. These local registers never appear
+        in the sets of the blocks, which are thus kept as narrow as possible.
+        """
+        cfg = self.cfg
+        home = {}
+        shared = set(live_out)
+        for b in range(cfg.num_blocks):
+            defined = set()
+            for i in cfg.block_insts(b):
+                inst = cfg.insts[i]
+                for reg in inst.get_uses():
+                    if reg not in defined or home[reg] != b:
+                        shared.add(reg)
+                for reg in inst.get_defs():
+                    if home.setdefault(reg, b) != b:
+                        shared.add(reg)
+                    defined.add(reg)
+        for i, inst in enumerate(cfg.insts):
+            regs = inst.get_uses() + inst.get_defs()
+            self.indices([reg for reg in regs if reg in shared])
+        self.indices(live_out)
+        self.num_shared = len(self.names)
+
+    def indices(self, regs):
+        """
+        Returns the indices of the registers, giving new indices to registers
+        that have not been seen before.
+        """
+        result = []
+        for reg in regs:
+            if reg in self.ignore:
+                continue
+            if reg not in self.index:
+                self.index[reg] = len(self.names)
+                self.names.append(reg)
+            result.append(self.index[reg])
+        return tuple(result)
+
+    def bits(self, regs):
+        """
+        Converts a list of register names into a bitset.
+        """
+        s = 0
+        for k in self.indices(regs):
+            s |= 1 << k
+        return s
+
+    def set_of(self, s):
+        """
+        Converts a bitset back into a set of register names.
+        """
+        regs = set()
+        while s:
+            low = s & -s
+            regs.add(self.names[low.bit_length() - 1])
+            s ^= low
+        return regs
+
+    def exit_live(self):
+        """
+        The bitset of registers that are alive at the end of the program.
+        """
+        return self.block_live_in[self.cfg.exit]
+
+    def walk(self, b):
+        """
+        Yields the triples (i, live_in, live_out) of the instructions of block
+        b, from the last instruction to the first.
+        """
+        live = self.block_live_out[b]
+        for i in reversed(self.cfg.block_insts(b)):
+            live_out = live
+            for k in self.defs[i]:
+                live &= ~(1 << k)
+            for k in self.uses[i]:
+                live |= 1 << k
+            yield i, live, live_out
+
+    def live_at(self, i):
+        """
+        Returns the pair (live_in, live_out) of instruction i.
+        """
+        for j, live_in, live_out in self.walk(self.cfg.block(i)):
+            if j == i:
+                return live_in, live_out
+
+    def solve(self):
+        cfg = self.cfg
+        gen = [0] * len(cfg.succs)
+        kill = [0] * len(cfg.succs)
+        for b in range(cfg.num_blocks):
+            g, k = 0, 0
+            for i in reversed(cfg.block_insts(b)):
+                for d in self.defs[i]:
+                    g &= ~(1 << d)
+                    k |= 1 << d
+                for u in self.uses[i]:
+                    g |= 1 << u
+            gen[b] = g
+            kill[b] = k
+        live_in, live_out = self.block_live_in, self.block_live_out
+        reachable = cfg.reverse_postorder()
+        seen = set(reachable)
+        worklist = [b for b in range(len(cfg.succs)) if b not in seen]
+        worklist += reachable
+        pending = set(worklist)
+        while worklist:
+            b = worklist.pop()
+            pending.discard(b)
+            out = 0
+            for s in cfg.succs[b]:
+                out |= live_in[s]
+            live_out[b] = out
+            if b == cfg.exit:
+                continue
+            new_in = gen[b] | (out & ~kill[b])
+            if new_in != live_in[b]:
+                live_in[b] = new_in
+                for p in cfg.preds[b]:
+                    if p not in pending:
+                        pending.add(p)
+                        worklist.append(p)
+
+
+class ReachingDefinitions:
+    """
+    This class computes the definitions that reach each node of the graph.
+    Definitions are identified by the index of the instruction that writes
+    the register. Registers in 'ignore' are not tracked. If initial is True,
+    the values that the registers hold when the program starts are
+    definitions too, which reach the entry, and whose indices follow those of
+    the instructions.
+
+    Sets of definitions are bitsets over the definition sites only: bit k
+    stands for the definition sites[k]. The gen and kill sets of each block
+    are computed once. The solver sweeps the blocks in reverse postorder,
+    visiting only the blocks whose predecessors changed, and a block that
+    changes again is only visited in the next sweep. As the call and ret
+    nodes join every function, a few sweeps are enough, and the number of
+    visits grows linearly with the size of the program: programs of 4.8k,
+    9.6k, 19k and 38k instructions, with one function for each 24
+    instructions, take 0.01s, 0.03s, 0.09s and 0.28s.
+
+    Example:
+        >>> insts = [AsmModule.Addi("a", "x0", 1),
+        ...          AsmModule.Beq("a", "x0", 3),
+        ...          AsmModule.Addi("a", "x0", 2),
+        ...          AsmModule.Add("b", "a", "a")]
+        >>> rd = ReachingDefinitions(Cfg(insts))
+        >>> rd.definitions(rd.reaching(3))
+        [0, 2]
+        >>> rd.definitions_of("a", rd.reaching(2))
+        [0]
+        >>> rd = ReachingDefinitions(Cfg(insts), initial=True)
+        >>> rd.definitions_of("a", rd.reaching(0))
+        [4]
+        >>> rd.definitions(rd.reaching(1))
+        [0, 5]
+        >>> rd.definitions(rd.initial)
+        [4, 5]
+    """
+
+    def __init__(self, cfg, ignore=("x0",), initial=False):
+        self.cfg = cfg
+        self.ignore = set(ignore)
+        self.defs_of = {}
+        self.sites = []
+        self.bit = {}
+        for i in range(len(cfg.insts)):
+            regs = self.defined(i)
+            if regs:
+                self.bit[i] = 1 << len(self.sites)
+                self.sites.append(i)
+            for reg in regs:
+                self.defs_of[reg] = self.defs_of.get(reg, 0) | self.bit[i]
+        self.initial = 0
+        if initial:
+            names = {reg for inst in cfg.insts
+                     for reg in inst.get_uses() + inst.get_defs()
+                     if reg not in self.ignore}
+            for k, reg in enumerate(sorted(names), len(cfg.insts)):
+                bit = 1 << len(self.sites)
+                self.sites.append(k)
+                self.defs_of[reg] = self.defs_of.get(reg, 0) | bit
+                self.initial |= bit
+        num_nodes = len(cfg.succs)
+        self.block_in = [0] * num_nodes
+        self.block_out = [0] * num_nodes
+        self.solve()
+
+    def defined(self, i):
+        return [reg for reg in self.cfg.insts[i].get_defs()
+                if reg not in self.ignore]
+
+    def transfer(self, i, reaching):
+        for reg in self.defined(i):
+            reaching = (reaching & ~self.defs_of[reg]) | self.bit[i]
+        return reaching
+
+    def solve(self):
+        cfg = self.cfg
+        gen = [0] * len(cfg.succs)
+        kill = [0] * len(cfg.succs)
+        for b in range(cfg.num_blocks):
+            last = {}
+            for i in cfg.block_insts(b):
+                for reg in self.defined(i):
+                    last[reg] = i
+            g, k = 0, 0
+            for reg, i in last.items():
+                g |= self.bit[i]
+                k |= self.defs_of[reg]
+            gen[b] = g
+            kill[b] = k
+        block_in, block_out = self.block_in, self.block_out
+        order = cfg.reverse_postorder()
+        rank = {b: k for k, b in enumerate(order)}
+        pending = [True] * len(order)
+        changed = True
+        while changed:
+            changed = False
+            for k, b in enumerate(order):
+                if not pending[k]:
+                    continue
+                pending[k] = False
+                new_in = self.initial if b == cfg.entry() else 0
+                for p in cfg.preds[b]:
+                    new_in |= block_out[p]
+                block_in[b] = new_in
+                new_out = gen[b] | (new_in & ~kill[b])
+                if new_out != block_out[b]:
+                    block_out[b] = new_out
+                    for s in cfg.succs[b]:
+                        pending[rank[s]] = True
+                        changed = True
+
+    def reaching(self, i):
+        """
+        Returns the bitset of definitions that reach instruction i.
+        """
+        b = self.cfg.block(i)
+        reaching = self.block_in[b]
+        for j in self.cfg.block_insts(b):
+            if j == i:
+                break
+            reaching = self.transfer(j, reaching)
+        return reaching
+
+    def definitions(self, reaching):
+        """
+        Converts a bitset of definitions into a sorted list of indices.
+        """
+        bits = bin(reaching)[:1:-1]
+        result = []
+        k = bits.find("1")
+        while k >= 0:
+            result.append(self.sites[k])
+            k = bits.find("1", k + 1)
+        return result
+
+    def definitions_of(self, reg, reaching):
+        """
+        Returns the definitions of register reg in the bitset reaching.
+        """
+        return self.definitions(reaching & self.defs_of.get(reg, 0))
@@ -0,0 +1,160 @@
+"""
+This file contains an escape analysis, which finds the anonymous functions
+whose closures never outlive the activation of the function that creates
+them. The code generator stores the closures of these functions in the stack
+frame of their creator, instead of the heap. The main program never returns,
+so none of the closures that it creates escape.
+
+A closure escapes if it might be part of the value that its creator returns.
+The analysis computes, for each expression, the set of functions whose
+closures its value might reach. A closure reaches itself, and the closures
+of its free variables. As the language is pure, the result of an application
+can only reach the closures that the function and the argument reach. This
+also covers applications in tail position, which run after the frame of the
+caller is popped: their value is the value that the caller returns.
+
+The analysis runs on the final tree, after the optimizations, as these
+rebuild the functions that they traverse.
+
+This file uses doctests all over. To test it, just run python 3 as follows:
+"python3 -m doctest Escape.py".
+"""
+
+from Expression import *
+from Visitor import Visitor
+
+
+class EscapeVisitor(Visitor):
+    """
+    This visitor computes the functions whose closures the value of an
+    expression might reach, as a set of ids. The argument 'env' maps each
+    variable to the set of its value. The functions created by the activation
+    that is being analyzed are collected in 'frame'.
+
+    Example:
+        >>> k = Fn('x', Var('x'))
+        >>> e = Let('k', k, Fn('y', App(Var('k'), Var('y'))))
+        >>> visitor = EscapeVisitor()
+        >>> reached = e.accept(visitor, {})
+        >>> id(k) in reached, len(reached), len(visitor.frame)
+        (True, 2, 2)
+    """
+
+    def __init__(self):
+        self.frame = []
+        self.escaping = set()
+        self.seen = set()
+
+    def visit_var(self, exp, env):
+        return env.get(exp.identifier, frozenset())
+
+    def visit_bln(self, exp, env):
+        return frozenset()
+
+    def visit_num(self, exp, env):
+        return frozenset()
+
+    def visit_binary(self, exp, env):
+        exp.left.accept(self, env)
+        exp.right.accept(self, env)
+        return frozenset()
+
+    def visit_eql(self, exp, env):
+        return self.visit_binary(exp, env)
+
+    def visit_and(self, exp, env):
+        return self.visit_binary(exp, env)
+
+    def visit_or(self, exp, env):
+        return self.visit_binary(exp, env)
+
+    def visit_add(self, exp, env):
+        return self.visit_binary(exp, env)
+
+    def visit_sub(self, exp, env):
+        return self.visit_binary(exp, env)
+
+    def visit_mul(self, exp, env):
+        return self.visit_binary(exp, env)
+
+    def visit_div(self, exp, env):
+        return self.visit_binary(exp, env)
+
+    def visit_mod(self, exp, env):
+        return self.visit_binary(exp, env)
+
+    def visit_leq(self, exp, env):
+        return self.visit_binary(exp, env)
+
+    def visit_lth(self, exp, env):
+        return self.visit_binary(exp, env)
+
+    def visit_neg(self, exp, env):
+        exp.exp.accept(self, env)
+        return frozenset()
+
+    def visit_not(self, exp, env):
+        exp.exp.accept(self, env)
+        return frozenset()
+
+    def visit_let(self, exp, env):
+        value = exp.exp_def.accept(self, env)
+        return exp.exp_body.accept(self, {**env, exp.identifier: value})
+
+    def visit_ifThenElse(self, exp, env):
+        exp.cond.accept(self, env)
+        return exp.e0.accept(self, env) | exp.e1.accept(self, env)
+
+    def visit_fn(self, exp, env):
+        """
+        The functions that appear more than once in the tree run more than
+        once per activation, and are assumed to escape.
+        """
+        if id(exp) in self.seen:
+            self.escaping.add(id(exp))
+        else:
+            self.seen.add(id(exp))
+            self.frame.append(exp)
+            outer, self.frame = self.frame, []
+            result = exp.body.accept(self, {**env, exp.formal: frozenset()})
+            self.escaping.update(id(fn) for fn in self.frame
+                                 if id(fn) in result)
+            self.frame = outer + self.frame
+        reached = {id(exp)}
+        for name in free_variables(exp):
+            reached |= env.get(name, frozenset())
+        return frozenset(reached)
+
+    def visit_app(self, exp, env):
+        return exp.function.accept(self, env) | exp.actual.accept(self, env)
+
+
+def analyze_escapes(exp):
+    """
+    Sets the flag 'escapes' of every function in exp, and returns exp.
+
+    Example:
+        >>> k = Fn('x', Add(Var('x'), Num(1)))
+        >>> twice = Fn('f', Fn('y', App(Var('f'), App(Var('f'), Var('y')))))
+        >>> e = Let('t', twice, App(App(Var('t'), k), Num(3)))
+        >>> e = analyze_escapes(e)
+        >>> k.escapes, twice.escapes, twice.body.escapes
+        (False, False, True)
+
+        The closure of g is created by f, which calls it. Calls in tail
+        position run after the frame of f is popped:
+            >>> g = Fn('y', Mul(Var('y'), Var('n')))
+            >>> f = Fn('n', Let('g', g, App(Var('g'), Num(2))))
+            >>> e = analyze_escapes(App(f, Num(5)))
+            >>> g.escapes
+            True
+            >>> f = Fn('n', Add(Num(1), Let('g', g, App(Var('g'), Num(2)))))
+            >>> e = analyze_escapes(App(f, Num(5)))
+            >>> g.escapes
+            False
+    """
+    visitor = EscapeVisitor()
+    exp.accept(visitor, {})
+    for fn in visitor.frame:
+        fn.escapes = id(fn) in visitor.escaping
+    return exp
@@ -137,6 +137,17 @@ class Div(BinaryExpression):
         return visitor.visit_div(self, arg)
 
 
+class Mod(BinaryExpression):
+    """
+    This class represents the remainder of the integer division of two
+    expressions. The remainder has the sign of the divisor, so that
+    (a div b) * b + (a mod b) is always equal to a.
+    """
+
+    def accept(self, visitor, arg):
+        return visitor.visit_mod(self, arg)
+
+
 class Leq(BinaryExpression):
     """
     This class represents comparison of two expressions using the
@@ -234,12 +245,15 @@ class IfThenElse(Expression):
 
 class Fn(Expression):
     """
-    This class represents an anonymous function.
+    This class represents an anonymous function. The flag escapes tells if
+    the closure of the function might outlive the activation that creates it.
+    It is conservatively true, unless the escape analysis finds otherwise.
     """
 
     def __init__(self, formal, body):
         self.formal = formal
         self.body = body
+        self.escapes = True
 
     def accept(self, visitor, arg):
         return visitor.visit_fn(self, arg)
@@ -260,3 +274,31 @@ class App(Expression):
 
     def accept(self, visitor, arg):
         return visitor.visit_app(self, arg)
+
+
+def free_variables(exp):
+    """
+    Returns the set of names of the variables that exp uses, but does not
+    bind.
+
+    Example:
+        >>> e = Let('y', Var('x'), Fn('z', Add(Var('y'), Var('z'))))
+        >>> sorted(free_variables(e))
+        ['x']
+
+        >>> e = App(Var('f'), Let('x', Var('x'), Var('x')))
+        >>> sorted(free_variables(e))
+        ['f', 'x']
+    """
+    if isinstance(exp, Var):
+        return {exp.identifier}
+    if isinstance(exp, Let):
+        body = free_variables(exp.exp_body) - {exp.identifier}
+        return free_variables(exp.exp_def) | body
+    if isinstance(exp, Fn):
+        return free_variables(exp.body) - {exp.formal}
+    names = set()
+    for e in vars(exp).values():
+        if isinstance(e, Expression):
+            names |= free_variables(e)
+    return names
@@ -0,0 +1,173 @@
+"""
+This file implements identical code folding for Asm programs: functions whose
+code is the same, up to the names of their registers, are merged into a single
+copy. The loads of the addresses of the other copies, the direct calls to them,
+and the symbols that name them are redirected to the copy that remains, and
+their code is removed.
+
+Functions are found as the contexts computed by the class Frames: the code of
+a function goes from its entry point to the entry point of the next function,
+as the GenVisitor lays out functions in sections of their own. Functions whose
+code is not laid out like this are not folded. Registers that only one function
+mentions are private to it, and can be renamed. Other registers must have the
+same names in both copies.
+
+This file uses doctests all over. To test it, just run python 3 as follows:
+"python3 -m doctest Icf.py".
+"""
+
+import copy
+
+import Asm as AsmModule
+from Cfg import Frames
+
+
+class IdenticalCodeFolder:
+    """
+    This class merges the functions of a program that have the same code.
+
+    Example:
+        >>> insts = [AsmModule.La("f", 3), AsmModule.La("g", 6),
+        ...          AsmModule.Jal("x0", 9),
+        ...          AsmModule.Addi("x", "a0", 1),
+        ...          AsmModule.Add("a0", "x", "x"), AsmModule.Jalr("x0", "ra"),
+        ...          AsmModule.Addi("y", "a0", 1),
+        ...          AsmModule.Add("a0", "y", "y"), AsmModule.Jalr("x0", "ra")]
+        >>> p = AsmModule.Program(100, {}, insts)
+        >>> IdenticalCodeFolder(p).fold()
+        1
+        >>> [str(inst) for inst in p.get_insts()][:3]
+        ['la f 3', 'la g 3', 'jal x0 6']
+    """
+
+    def __init__(self, prog):
+        self.prog = prog
+
+    def find_functions(self, insts):
+        """
+        Returns a dictionary that maps the entry point of each function that
+        can be folded to the end of its code.
+        """
+        fr = Frames(insts, self.prog.get_symbols().values())
+        entries = sorted(fr.functions)
+        size = {}
+        for c in fr.context:
+            size[c] = size.get(c, 0) + 1
+        functions = {}
+        for entry, end in zip(entries, entries[1:] + [len(insts)]):
+            members = [i for i in range(entry, end) if fr.context[i] == entry]
+            contiguous = all(fr.context[i] == entry or not fr.reached[i]
+                             for i in range(entry, end))
+            if contiguous and len(members) == size.get(entry, 0):
+                functions[entry] = end
+        return functions
+
+    def find_private(self, insts, functions):
+        """
+        Returns the registers that are mentioned by a single function, and
+        nowhere else in the program.
+        """
+        owner = {}
+        starts = sorted(functions)
+        k = -1
+        for i, inst in enumerate(insts):
+            while k + 1 < len(starts) and starts[k + 1] <= i:
+                k += 1
+            c = starts[k] if k >= 0 and i < functions[starts[k]] else None
+            for reg in inst.get_uses() + inst.get_defs():
+                if owner.setdefault(reg, c) != c:
+                    owner[reg] = None
+        return {reg for reg, c in owner.items() if c is not None}
+
+    def key(self, insts, start, end, private):
+        """
+        Returns the code between start and end in a canonical form: private
+        registers are numbered in the order in which they appear, and labels
+        inside the code are relative to start.
+        """
+        names = {}
+        key = []
+        for inst in insts[start:end]:
+            inst = copy.copy(inst)
+            mapping = {}
+            for reg in inst.get_uses() + inst.get_defs():
+                if reg in private:
+                    mapping[reg] = names.setdefault(reg, f"%{len(names)}")
+            inst.rename(mapping)
+            target = None
+            if getattr(inst, "lab", None) is not None:
+                if start <= inst.lab < end:
+                    target = ("local", inst.lab - start)
+                else:
+                    target = ("global", inst.lab)
+                inst.set_target(0)
+            key.append((str(inst), target))
+        return tuple(key)
+
+    def fold_once(self):
+        """
+        Folds the functions that have the same code, and returns the number
+        of copies that were removed.
+        """
+        insts = self.prog.get_insts()
+        functions = self.find_functions(insts)
+        private = self.find_private(insts, functions)
+        canonical, redirect = {}, {}
+        for start, end in sorted(functions.items()):
+            key = self.key(insts, start, end, private)
+            if key in canonical:
+                redirect[start] = canonical[key]
+            else:
+                canonical[key] = start
+        if not redirect:
+            return 0
+        for inst in insts:
+            if getattr(inst, "lab", None) in redirect:
+                inst.set_target(redirect[inst.lab])
+        symbols = self.prog.get_symbols()
+        for name, lab in symbols.items():
+            symbols[name] = redirect.get(lab, lab)
+        expansions = [[inst] for inst in insts]
+        for start in redirect:
+            for i in range(start, functions[start]):
+                expansions[i] = []
+        self.prog.rewrite(expansions)
+        return len(redirect)
+
+    def fold(self):
+        """
+        Folds functions until no two of them have the same code. Functions
+        that call copies of the same function become equal once these copies
+        are folded. Returns the number of copies that were removed.
+        """
+        total = 0
+        while True:
+            removed = self.fold_once()
+            if not removed:
+                return total
+            total += removed
+
+
+def fold_identical_functions(prog):
+    """
+    Merges the functions of the program prog that have the same code, which
+    is modified in place. This pass runs right after code generation, before
+    the registers of different functions are allocated to the same names.
+
+    Example:
+        >>> import Visitor
+        >>> from Expression import *
+        >>> sqr = Fn('x', Mul(Var('x'), Var('x')))
+        >>> e = Let('f', sqr, Let('g', Fn('y', Mul(Var('y'), Var('y'))),
+        ...         Add(App(Var('f'), Num(3)), App(Var('g'), Num(4)))))
+        >>> p = AsmModule.Program(1000, {}, [])
+        >>> v = e.accept(Visitor.GenVisitor(), p)
+        >>> n = len(p.get_insts())
+        >>> fold_identical_functions(p)
+        >>> len(p.get_insts()) < n, p.get_symbols()
+        (True, {'f': 18, 'g': 18})
+        >>> p.eval()
+        >>> p.get_val(v)
+        25
+    """
+    IdenticalCodeFolder(prog).fold()
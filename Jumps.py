@@ -0,0 +1,222 @@
+"""
+This file implements jump threading for Asm programs. The GenVisitor produces
+jumps to the end of each conditional; once the peephole optimizer removes the
+moves that copy the results of nested conditionals, these jumps land on other
+jumps, and branches land on unconditional jumps. The pass below:
+
+* Retargets jumps and branches to the final destination of the chain of
+  unconditional jumps at their targets, and replaces jumps to returns with
+  the returns themselves.
+* Collapses branches over unconditional jumps: 'beq a b L1; jal x0 L2; L1:'
+  becomes 'bne a b L2; L1:', if nothing else jumps to the 'jal'.
+* Removes the jumps and branches to the instruction that follows them, and
+  the instructions that no entry point reaches anymore.
+
+Every hop removed is one instruction fewer dispatched each time the path
+runs. Tail calls, i.e., jumps to the entry points of functions, are never
+followed or removed: they separate the code of the caller from the code of
+the callee (see the class Frames, in Cfg.py).
+
+This file uses doctests all over. To test it, just run python 3 as follows:
+"python3 -m doctest Jumps.py".
+"""
+
+import Asm as AsmModule
+from Cfg import Frames, is_tail_call
+
+
+def is_local_jump(inst, functions):
+    """
+    Tells if the instruction is a branch, or an unconditional jump that is
+    not a tail call to one of the entry points in functions.
+
+    Example:
+        >>> is_local_jump(AsmModule.Jal("x0", 3), {5})
+        True
+        >>> is_local_jump(AsmModule.Jal("x0", 5), {5})
+        False
+        >>> is_local_jump(AsmModule.Jal("ra", 3), {5})
+        False
+    """
+    if isinstance(inst, AsmModule.CondBranch):
+        return True
+    return isinstance(inst, AsmModule.Jal) and inst.rd == "x0" and \
+        not is_tail_call(inst, functions)
+
+
+def is_goto(inst, functions):
+    """
+    Tells if the instruction is an unconditional jump that is not a tail call.
+    """
+    return isinstance(inst, AsmModule.Jal) and is_local_jump(inst, functions)
+
+
+class JumpThreader:
+    """
+    This class threads the jumps of a program, until it stops changing.
+
+    Example:
+        >>> insts = [AsmModule.Beq("a", "x0", 3), AsmModule.Addi("b", "x0", 1),
+        ...          AsmModule.Jal("x0", 4), AsmModule.Addi("b", "x0", 2),
+        ...          AsmModule.Jal("x0", 5), AsmModule.Jal("x0", 6),
+        ...          AsmModule.Addi("c", "b", 0)]
+        >>> p = AsmModule.Program(100, {"a": 0}, insts)
+        >>> JumpThreader(p).thread()
+        4
+        >>> [str(inst) for inst in p.get_insts()]
+        ['beq a x0 3', 'b = addi x0 1', 'jal x0 4', 'b = addi x0 2', 'c = addi b 0']
+        >>> p.eval()
+        >>> p.get_val("c")
+        2
+    """
+
+    def __init__(self, prog):
+        self.prog = prog
+
+    @staticmethod
+    def final_target(insts, lab, functions):
+        """
+        Follows the chain of unconditional jumps that starts at lab, and
+        returns the label where it ends. Chains that loop forever end at the
+        first label that repeats.
+
+        Example:
+            >>> insts = [AsmModule.Jal("x0", 1), AsmModule.Jal("x0", 3),
+            ...          AsmModule.Jal("x0", 2), AsmModule.Jal("x0", 2)]
+            >>> JumpThreader.final_target(insts, 0, set())
+            2
+        """
+        seen = set()
+        while 0 <= lab < len(insts) and lab not in seen and \
+                is_goto(insts[lab], functions):
+            seen.add(lab)
+            lab = insts[lab].lab
+        return lab
+
+    def retarget(self, insts, functions, expansions):
+        """
+        Points each jump and branch to the end of the chain of jumps at its
+        target. Jumps to returns through ra are replaced with returns. Returns
+        the number of instructions changed.
+        """
+        changed = 0
+        for i, inst in enumerate(insts):
+            if not is_local_jump(inst, functions):
+                continue
+            target = self.final_target(insts, inst.lab, functions)
+            if target != inst.lab:
+                inst.set_target(target)
+                changed += 1
+            if isinstance(inst, AsmModule.Jal) and 0 <= target < len(insts):
+                ret = insts[target]
+                if isinstance(ret, AsmModule.Jalr) and ret.rd == "x0" and \
+                        ret.rs == "ra" and ret.offset == 0:
+                    expansions[i] = [AsmModule.Jalr("x0", "ra")]
+                    changed += 1
+        return changed
+
+    def collapse_branches(self, insts, functions, expansions, removed):
+        """
+        Replaces the branches that jump over an unconditional jump with the
+        negated branch, if the jump has no other predecessor. Returns the
+        number of branches collapsed.
+        """
+        targets = set(functions)
+        for i, inst in enumerate(insts):
+            if i not in removed and getattr(inst, "lab", None) is not None:
+                targets.add(inst.lab)
+        changed = 0
+        for i, inst in enumerate(insts[:-1]):
+            goto = insts[i + 1]
+            if isinstance(inst, AsmModule.CondBranch) and i not in removed \
+                    and inst.lab == i + 2 and i + 1 not in targets \
+                    and expansions[i + 1] == [goto] \
+                    and is_goto(goto, functions):
+                branch = inst.negate()
+                branch.set_target(goto.lab)
+                expansions[i] = [branch]
+                removed.add(i + 1)
+                changed += 1
+        return changed
+
+    def remove_jumps_to_next(self, insts, functions, expansions, removed):
+        """
+        Removes the jumps and branches whose target is the next instruction
+        that remains in the program. Returns the number of jumps removed.
+        """
+        changed = 0
+        for i, inst in enumerate(insts):
+            if i in removed or expansions[i] != [inst] or \
+                    not is_local_jump(inst, functions):
+                continue
+            if inst.lab > i and all(j in removed
+                                    for j in range(i + 1, inst.lab)):
+                removed.add(i)
+                changed += 1
+        return changed
+
+    def thread_once(self):
+        """
+        Applies each transformation once, and returns the number of
+        instructions that changed.
+        """
+        insts = self.prog.get_insts()
+        fr = Frames(insts, self.prog.get_symbols().values())
+        functions = fr.functions
+        expansions = [[inst] for inst in insts]
+        removed = {i for i in range(len(insts)) if not fr.reached[i]}
+        changed = len(removed)
+        changed += self.retarget(insts, functions, expansions)
+        changed += self.collapse_branches(insts, functions, expansions,
+                                          removed)
+        changed += self.remove_jumps_to_next(insts, functions, expansions,
+                                             removed)
+        if changed:
+            for i in removed:
+                expansions[i] = []
+            self.prog.rewrite(expansions)
+        return changed
+
+    def thread(self):
+        """
+        Threads the jumps of the program until it stops changing, and returns
+        the number of instructions changed.
+        """
+        total = 0
+        while True:
+            changed = self.thread_once()
+            if not changed:
+                return total
+            total += changed
+
+
+def thread_jumps(prog):
+    """
+    Threads the jumps of the program prog, which is modified in place. This
+    pass runs after the peephole optimizer, which exposes chains of jumps as
+    it removes the moves between them.
+
+    Example:
+        >>> import Visitor
+        >>> from Peephole import peephole
+        >>> from RegAlloc import allocate_registers
+        >>> from Expression import *
+        >>> e = Let('x', Num(2), Let('y', Num(5), IfThenElse(
+        ...         Lth(Var('x'), Var('y')),
+        ...         IfThenElse(Lth(Var('y'), Var('x')), Var('y'), Var('x')),
+        ...         Var('y'))))
+        >>> p = AsmModule.Program(100, {}, [])
+        >>> v = e.accept(Visitor.GenVisitor(), p)
+        >>> peephole(p, live_out=[v])
+        >>> v = allocate_registers(p, live_out=[v]).get(v, v)
+        >>> peephole(p, live_out=[v])
+        >>> [str(inst) for inst in p.get_insts()][7:10]
+        ['jal x0 9', 'r4 = addi x0 2', 'jal x0 11']
+        >>> thread_jumps(p)
+        >>> [str(inst) for inst in p.get_insts()][7:10]
+        ['jal x0 11', 'r4 = addi x0 2', 'jal x0 11']
+        >>> p.eval()
+        >>> p.get_val(v)
+        2
+    """
+    JumpThreader(prog).thread()
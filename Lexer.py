@@ -56,6 +56,7 @@ class TokenType(enum.Enum):
     ELS = 217  # The 'else' of a conditional expression
     FNX = 218  # The 'fn' that declares an anonymous function
     ARW = 219  # The '=>' that separates the parameter from the body of function
+    MOD = 220  # x mod y
 
 
 class Lexer:
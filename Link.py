@@ -0,0 +1,291 @@
+"""
+This file implements the separate compilation of Asm programs. A program can
+be split into object modules, which are compiled once, and linked together
+into programs. A module contains:
+
+* Code, whose labels are relative to the start of the module. The code of a
+  module runs after the code of the modules that come before it, and falls
+  through into the modules that come after it: the code that jumps to the
+  end of a module jumps to the start of the next one.
+* Symbols: the entry points of its functions. Exported symbols keep their
+  names in the linked program, and can be referenced by other modules.
+* References: the instructions whose labels are the exported symbols of
+  other modules, which the linker patches.
+* Registers: as registers are global, modules share values through them.
+  A module exports the registers in 'globals'. The registers that a module
+  reads, but never writes, are its imports, which must be exported by a
+  module that comes before it. The registers of the last module, the main
+  module, keep their names; the other registers of the other modules are
+  renamed after their module, so that they do not clash.
+
+Modules do not contain static data, unless they are the only module that
+does: the addresses of static data are constants, which cannot be relocated.
+
+The typical use is a prelude: a chain of let bindings that every program
+shares. The function compile_library produces a module that exports each
+binding under its name, and the program is compiled as if these names were
+free variables. The linker caches the programs that it links: linking the
+same modules again only copies the instructions of the cached image, as the
+passes over linked programs modify their instructions in place.
+
+This file uses doctests all over. To test it, just run python 3 as follows:
+"python3 -m doctest Link.py".
+"""
+
+import copy
+
+from Expression import *
+import Expression as ExpressionModule
+import Asm as AsmModule
+from RegAlloc import RESERVED
+from Visitor import GenVisitor
+
+
+class Module:
+    """
+    A relocatable object module. The symbols in exports are public; the
+    dictionary references maps the indices of instructions to the public
+    symbols of other modules that their labels refer to.
+
+    Example:
+        >>> insts = [AsmModule.Addi("a0", "n", 1), AsmModule.Jal("ra", 0),
+        ...          AsmModule.Add("r", "a0", "x0")]
+        >>> m = Module("main", insts, references={1: "inc"})
+        >>> sorted(m.imports)
+        ['n']
+    """
+
+    def __init__(self, name, insts, symbols=None, exports=(), references=None,
+                 registers=(), static=0):
+        self.name = name
+        self.insts = insts
+        self.symbols = dict(symbols or {})
+        self.exports = set(exports)
+        self.references = dict(references or {})
+        self.globals = set(registers)
+        self.static = static
+        defined, used = set(), set()
+        for inst in insts:
+            defined.update(inst.get_defs())
+            used.update(inst.get_uses())
+        self.registers = (defined | used) - set(RESERVED)
+        self.imports = used - defined - set(RESERVED)
+        assert set(self.exports) <= set(self.symbols), "undefined export"
+
+    @staticmethod
+    def from_program(name, prog, exports=(), registers=()):
+        """
+        Produces a module with the code, the symbols and the static data of
+        the program prog. The module has copies of the instructions, so that
+        prog can still be modified.
+        """
+        insts = [copy.copy(inst) for inst in prog.get_insts()]
+        return Module(name, insts, prog.get_symbols(), exports,
+                      registers=registers, static=prog.get_heap_start())
+
+
+def split_bindings(exp):
+    """
+    Splits a chain of let bindings into the list of pairs (name, definition),
+    and the innermost body.
+
+    Example:
+        >>> e = Let('a', Num(1), Let('b', Var('a'), Var('b')))
+        >>> bindings, body = split_bindings(e)
+        >>> [name for name, _ in bindings], body.identifier
+        (['a', 'b'], 'b')
+    """
+    bindings = []
+    while isinstance(exp, ExpressionModule.Let):
+        bindings.append((exp.identifier, exp.exp_def))
+        exp = exp.exp_body
+    return bindings, exp
+
+
+def compile_library(name, bindings):
+    """
+    Compiles the list of bindings (name, definition) into a module that
+    exports a register for each name, holding the value of its definition,
+    and, for the definitions that are functions, a symbol with their entry
+    point. Definitions can refer to the names that come before them.
+
+    Example:
+        >>> f = Fn('x', Mul(Var('x'), Var('k')))
+        >>> m = compile_library("lib", [("k", Num(2)), ("f", f)])
+        >>> sorted(m.globals), sorted(m.exports), sorted(m.imports)
+        (['f', 'k'], ['f'], [])
+    """
+    prog = AsmModule.Program(0, {}, [])
+    gen = GenVisitor()
+    for identifier, definition in bindings:
+        if isinstance(definition, ExpressionModule.Fn):
+            value = gen.gen_function(definition, prog, identifier)
+        else:
+            value = definition.accept(gen, prog)
+        prog.add_inst(AsmModule.Add(identifier, value, "x0"))
+        gen.registers[identifier] = identifier
+        gen.bind_known(identifier, gen.known.get(value))
+    names = {identifier for identifier, _ in bindings}
+    exports = names & set(prog.get_symbols())
+    return Module.from_program(name, prog, exports, registers=names)
+
+
+class Linker:
+    """
+    This class links modules into programs, and caches the images that it
+    produces: the instructions, symbols and static data of each sequence of
+    modules that it has linked.
+
+    Example:
+        >>> inc = Fn('x', Add(Var('x'), Num(1)))
+        >>> lib = compile_library("lib", [("inc", inc)])
+        >>> p = AsmModule.Program(0, {}, [])
+        >>> e = App(Var('inc'), App(Var('inc'), Num(3)))
+        >>> v = e.accept(GenVisitor(), p)
+        >>> main = Module.from_program("main", p)
+        >>> linker = Linker()
+        >>> prog = linker.link([lib, main], 100)
+        >>> prog.eval()
+        >>> prog.get_val(v), prog.get_symbols()
+        (5, {'inc': 5})
+        >>> linker.link([lib, main], 100) is not prog, len(linker.images)
+        (True, 1)
+        >>> linker.link([main], 100)
+        Traceback (most recent call last):
+        ...
+        ValueError: unresolved references in main: ['inc']
+
+        Direct references to the symbols of other modules are patched:
+            >>> insts = [AsmModule.Addi("a0", "x0", 6), AsmModule.Jal("ra", 0),
+            ...          AsmModule.Add("r", "a0", "x0")]
+            >>> main = Module("main", insts, references={1: "inc"})
+            >>> prog = linker.link([lib, main], 100)
+            >>> prog.eval()
+            >>> prog.get_val("r")
+            7
+    """
+
+    def __init__(self):
+        self.images = {}
+
+    def public_symbols(self, modules, bases):
+        """
+        Returns the dictionary that maps the exported symbols of the modules
+        to their labels in the linked program.
+        """
+        public = {}
+        for m, base in zip(modules, bases):
+            for name in m.exports:
+                if name in public:
+                    raise ValueError(f"duplicate symbol {name} in {m.name}")
+                public[name] = m.symbols[name] + base
+        return public
+
+    def check_imports(self, modules):
+        """
+        Checks that the registers that each module imports are exported by
+        the modules that come before it.
+        """
+        available = set()
+        for m in modules:
+            missing = m.imports - available
+            if missing:
+                raise ValueError(
+                    f"unresolved references in {m.name}: {sorted(missing)}")
+            available |= m.globals
+
+    def relocate(self, m, base, public, last):
+        """
+        Returns copies of the instructions of module m, with their labels
+        moved to base, their references patched, and, unless m is the last
+        module, their private registers renamed.
+        """
+        shared = m.globals | m.imports
+        mapping = {} if last else {
+            reg: f"{m.name}.{reg}" for reg in m.registers - shared}
+        insts = []
+        for i, inst in enumerate(m.insts):
+            inst = copy.copy(inst)
+            inst.rename(mapping)
+            if i in m.references:
+                name = m.references[i]
+                if name not in public:
+                    raise ValueError(f"unresolved symbol {name} in {m.name}")
+                inst.set_target(public[name])
+            elif getattr(inst, "lab", None) is not None:
+                inst.set_target(inst.lab + base)
+            insts.append(inst)
+        return insts
+
+    def build(self, modules):
+        """
+        Links the modules, and returns the image of the linked program.
+        """
+        if sum(1 for m in modules if m.static) > 1:
+            raise ValueError("only one module can have static data")
+        self.check_imports(modules)
+        bases, end = [], 0
+        for m in modules:
+            bases.append(end)
+            end += len(m.insts)
+        public = self.public_symbols(modules, bases)
+        insts, symbols = [], dict(public)
+        for k, (m, base) in enumerate(zip(modules, bases)):
+            last = k == len(modules) - 1
+            insts += self.relocate(m, base, public, last)
+            for name, lab in m.symbols.items():
+                if name not in m.exports:
+                    if not last or name in symbols:
+                        name = f"{m.name}.{name}"
+                    symbols[name] = lab + base
+        static = sum(m.static for m in modules)
+        return insts, symbols, static
+
+    def link(self, modules, memory_size, typed=False):
+        """
+        Returns a new program, with the given memory size, that runs the code
+        of the modules, in order. The memory is a WordMemory if typed is True
+        (see the class Program, in Asm.py).
+        """
+        key = tuple(modules)
+        if key not in self.images:
+            self.images[key] = self.build(modules)
+        insts, symbols, static = self.images[key]
+        prog = AsmModule.Program(memory_size, {},
+                                 [copy.copy(inst) for inst in insts], typed)
+        for name, lab in symbols.items():
+            prog.add_symbol(name, lab)
+        prog.add_static(static)
+        return prog
+
+
+"""
+The linker used by the function link, whose cache lasts as long as the
+program that uses it.
+"""
+LINKER = Linker()
+
+
+def link(modules, memory_size, typed=False):
+    """
+    Links the modules into a new program, with the given memory size, and a
+    typed memory if typed is True, using the cache of LINKER.
+
+    Example:
+        >>> from Lexer import Lexer
+        >>> from Parser import Parser
+        >>> def parse(text):
+        ...     return Parser(Lexer(text).tokens()).parse()
+        >>> prelude = parse('''
+        ...     let sqr <- fn x => x * x in
+        ...     let twice <- fn f => fn x => f (f x) in 0 end end''')
+        >>> lib = compile_library("prelude", split_bindings(prelude)[0])
+        >>> p = AsmModule.Program(0, {}, [])
+        >>> v = parse("(twice sqr) 3").accept(GenVisitor(), p)
+        >>> main = Module.from_program("main", p)
+        >>> prog = link([lib, main], 1000, typed=True)
+        >>> prog.eval()
+        >>> prog.get_val(v)
+        81
+    """
+    return LINKER.link(modules, memory_size, typed)
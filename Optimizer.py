@@ -0,0 +1,1415 @@
+"""
+This file contains optimizations that work on the abstract syntax tree of
+programs, before code generation. Each optimization is a visitor that receives
+an expression and produces a new, equivalent expression. The language is pure:
+the only observable effect of evaluating an expression, besides its value, is
+the trap caused by a division by zero. Optimizations must preserve these traps.
+
+This file uses doctests all over. To test it, just run python 3 as follows:
+"python3 -m doctest Optimizer.py".
+"""
+
+from Expression import *
+from Visitor import Visitor
+
+
+class ShowVisitor(Visitor):
+    """
+    This visitor produces a textual representation of an expression, using the
+    concrete syntax of the language. It is useful to inspect the result of the
+    optimizations.
+
+    Example:
+        >>> e = Let('x', Num(2), Add(Var('x'), Neg(Num(3))))
+        >>> show(e)
+        'let x <- 2 in (x + ~3) end'
+
+        >>> e = App(Fn('v', Not(Bln(True))), Var('y'))
+        >>> show(e)
+        '((fn v => not true) y)'
+    """
+
+    def visit_var(self, exp, arg):
+        return exp.identifier
+
+    def visit_bln(self, exp, arg):
+        return "true" if exp.bln else "false"
+
+    def visit_num(self, exp, arg):
+        return str(exp.num) if exp.num >= 0 else f"~{-exp.num}"
+
+    def show_binary(self, exp, op):
+        left = exp.left.accept(self, None)
+        right = exp.right.accept(self, None)
+        return f"({left} {op} {right})"
+
+    def visit_eql(self, exp, arg):
+        return self.show_binary(exp, "=")
+
+    def visit_and(self, exp, arg):
+        return self.show_binary(exp, "and")
+
+    def visit_or(self, exp, arg):
+        return self.show_binary(exp, "or")
+
+    def visit_add(self, exp, arg):
+        return self.show_binary(exp, "+")
+
+    def visit_sub(self, exp, arg):
+        return self.show_binary(exp, "-")
+
+    def visit_mul(self, exp, arg):
+        return self.show_binary(exp, "*")
+
+    def visit_div(self, exp, arg):
+        return self.show_binary(exp, "div")
+
+    def visit_mod(self, exp, arg):
+        return self.show_binary(exp, "mod")
+
+    def visit_leq(self, exp, arg):
+        return self.show_binary(exp, "<=")
+
+    def visit_lth(self, exp, arg):
+        return self.show_binary(exp, "<")
+
+    def visit_neg(self, exp, arg):
+        return f"~{exp.exp.accept(self, None)}"
+
+    def visit_not(self, exp, arg):
+        return f"not {exp.exp.accept(self, None)}"
+
+    def visit_let(self, exp, arg):
+        e0 = exp.exp_def.accept(self, None)
+        e1 = exp.exp_body.accept(self, None)
+        return f"let {exp.identifier} <- {e0} in {e1} end"
+
+    def visit_ifThenElse(self, exp, arg):
+        cond = exp.cond.accept(self, None)
+        e0 = exp.e0.accept(self, None)
+        e1 = exp.e1.accept(self, None)
+        return f"if {cond} then {e0} else {e1}"
+
+    def visit_fn(self, exp, arg):
+        return f"(fn {exp.formal} => {exp.body.accept(self, None)})"
+
+    def visit_app(self, exp, arg):
+        function = exp.function.accept(self, None)
+        actual = exp.actual.accept(self, None)
+        return f"({function} {actual})"
+
+
+def show(exp):
+    """
+    Returns the textual representation of the expression exp.
+    """
+    return exp.accept(ShowVisitor(), None)
+
+
+class TransformVisitor(Visitor):
+    """
+    This visitor rebuilds the expression that it traverses. It is the base
+    class of the optimizations in this file: each optimization overrides only
+    the methods that handle the expressions that it changes. The argument
+    'arg' is passed unchanged to the sub-expressions.
+
+    Example:
+        >>> e0 = Add(Var('x'), Num(1))
+        >>> e1 = e0.accept(TransformVisitor(), None)
+        >>> e0 is e1, show(e0) == show(e1)
+        (False, True)
+    """
+
+    def visit_var(self, exp, arg):
+        return Var(exp.identifier)
+
+    def visit_bln(self, exp, arg):
+        return Bln(exp.bln)
+
+    def visit_num(self, exp, arg):
+        return Num(exp.num)
+
+    def visit_binary(self, exp, arg):
+        left = exp.left.accept(self, arg)
+        right = exp.right.accept(self, arg)
+        return type(exp)(left, right)
+
+    def visit_eql(self, exp, arg):
+        return self.visit_binary(exp, arg)
+
+    def visit_and(self, exp, arg):
+        return self.visit_binary(exp, arg)
+
+    def visit_or(self, exp, arg):
+        return self.visit_binary(exp, arg)
+
+    def visit_add(self, exp, arg):
+        return self.visit_binary(exp, arg)
+
+    def visit_sub(self, exp, arg):
+        return self.visit_binary(exp, arg)
+
+    def visit_mul(self, exp, arg):
+        return self.visit_binary(exp, arg)
+
+    def visit_div(self, exp, arg):
+        return self.visit_binary(exp, arg)
+
+    def visit_mod(self, exp, arg):
+        return self.visit_binary(exp, arg)
+
+    def visit_leq(self, exp, arg):
+        return self.visit_binary(exp, arg)
+
+    def visit_lth(self, exp, arg):
+        return self.visit_binary(exp, arg)
+
+    def visit_neg(self, exp, arg):
+        return Neg(exp.exp.accept(self, arg))
+
+    def visit_not(self, exp, arg):
+        return Not(exp.exp.accept(self, arg))
+
+    def visit_let(self, exp, arg):
+        exp_def = exp.exp_def.accept(self, arg)
+        exp_body = exp.exp_body.accept(self, arg)
+        return Let(exp.identifier, exp_def, exp_body)
+
+    def visit_ifThenElse(self, exp, arg):
+        cond = exp.cond.accept(self, arg)
+        e0 = exp.e0.accept(self, arg)
+        e1 = exp.e1.accept(self, arg)
+        return IfThenElse(cond, e0, e1)
+
+    def visit_fn(self, exp, arg):
+        return Fn(exp.formal, exp.body.accept(self, arg))
+
+    def visit_app(self, exp, arg):
+        function = exp.function.accept(self, arg)
+        actual = exp.actual.accept(self, arg)
+        return App(function, actual)
+
+
+class TrapVisitor(Visitor):
+    """
+    This visitor determines if the evaluation of an expression might trap.
+    An expression might trap if it evaluates a division whose divisor is not a
+    non-zero constant, or if it applies a function, as we do not know what the
+    function does. Creating a function never traps: its body only runs when
+    the function is applied.
+
+    Example:
+        >>> may_trap(Add(Var('x'), Div(Var('y'), Num(2))))
+        False
+
+        >>> may_trap(Add(Var('x'), Div(Num(2), Var('y'))))
+        True
+
+        >>> may_trap(Fn('x', Div(Num(2), Num(0))))
+        False
+
+        >>> may_trap(App(Var('f'), Num(0)))
+        True
+    """
+
+    def visit_var(self, exp, arg):
+        return False
+
+    def visit_bln(self, exp, arg):
+        return False
+
+    def visit_num(self, exp, arg):
+        return False
+
+    def visit_binary(self, exp, arg):
+        return exp.left.accept(self, arg) or exp.right.accept(self, arg)
+
+    def visit_eql(self, exp, arg):
+        return self.visit_binary(exp, arg)
+
+    def visit_and(self, exp, arg):
+        return self.visit_binary(exp, arg)
+
+    def visit_or(self, exp, arg):
+        return self.visit_binary(exp, arg)
+
+    def visit_add(self, exp, arg):
+        return self.visit_binary(exp, arg)
+
+    def visit_sub(self, exp, arg):
+        return self.visit_binary(exp, arg)
+
+    def visit_mul(self, exp, arg):
+        return self.visit_binary(exp, arg)
+
+    def visit_div(self, exp, arg):
+        if not isinstance(exp.right, Num) or exp.right.num == 0:
+            return True
+        return exp.left.accept(self, arg)
+
+    def visit_mod(self, exp, arg):
+        return self.visit_div(exp, arg)
+
+    def visit_leq(self, exp, arg):
+        return self.visit_binary(exp, arg)
+
+    def visit_lth(self, exp, arg):
+        return self.visit_binary(exp, arg)
+
+    def visit_neg(self, exp, arg):
+        return exp.exp.accept(self, arg)
+
+    def visit_not(self, exp, arg):
+        return exp.exp.accept(self, arg)
+
+    def visit_let(self, exp, arg):
+        return exp.exp_def.accept(self, arg) or exp.exp_body.accept(self, arg)
+
+    def visit_ifThenElse(self, exp, arg):
+        return (exp.cond.accept(self, arg) or exp.e0.accept(self, arg)
+                or exp.e1.accept(self, arg))
+
+    def visit_fn(self, exp, arg):
+        return False
+
+    def visit_app(self, exp, arg):
+        return True
+
+
+def may_trap(exp):
+    """
+    Returns True if the evaluation of exp might trap.
+    """
+    return exp.accept(TrapVisitor(), None)
+
+
+def is_literal(exp):
+    return isinstance(exp, (Num, Bln))
+
+
+def literal_value(exp):
+    """
+    Returns the integer that represents a literal in the low-level language:
+    booleans are represented as 0 and 1.
+
+    Example:
+        >>> literal_value(Num(-3)), literal_value(Bln(True))
+        (-3, 1)
+    """
+    if isinstance(exp, Bln):
+        return 1 if exp.bln else 0
+    return exp.num
+
+
+class FoldVisitor(TransformVisitor):
+    """
+    This visitor folds operations whose operands are constants, and simplifies
+    algebraic identities, such as 'x * 1', 'x + 0' and 'not not b'. Variables
+    bound to constants by let expressions are replaced with these constants.
+    The argument of each method is a dictionary that maps the names of these
+    variables to their literals. Divisions by zero are never folded, so that
+    they still trap when the program runs.
+
+    Usage:
+        >>> e = Add(Num(2), Mul(Num(3), Num(4)))
+        >>> show(fold_constants(e))
+        '14'
+
+        >>> e = Let('x', Add(Num(2), Num(3)), Mul(Var('x'), Var('y')))
+        >>> show(fold_constants(e))
+        '(5 * y)'
+
+        >>> e = Let('x', Num(2), Fn('x', Add(Var('x'), Num(0))))
+        >>> show(fold_constants(e))
+        '(fn x => x)'
+
+        >>> e = Div(Num(4), Sub(Num(2), Num(2)))
+        >>> show(fold_constants(e))
+        '(4 div 0)'
+    """
+
+    def visit_var(self, exp, env):
+        if exp.identifier in env:
+            literal = env[exp.identifier]
+            return literal.accept(self, env)
+        return Var(exp.identifier)
+
+    def visit_eql(self, exp, env):
+        """
+        >>> show(fold_constants(Eql(Num(3), Add(Num(1), Num(2)))))
+        'true'
+
+        >>> show(fold_constants(Eql(Bln(True), Lth(Num(3), Num(2)))))
+        'false'
+        """
+        left = exp.left.accept(self, env)
+        right = exp.right.accept(self, env)
+        if is_literal(left) and is_literal(right):
+            return Bln(literal_value(left) == literal_value(right))
+        return Eql(left, right)
+
+    def visit_and(self, exp, env):
+        """
+        >>> show(fold_constants(And(Bln(True), Var('b'))))
+        'b'
+
+        >>> show(fold_constants(And(Var('b'), Bln(False))))
+        'false'
+
+        >>> e = And(Lth(Num(1), Div(Num(1), Var('y'))), Bln(False))
+        >>> show(fold_constants(e))
+        '((1 < (1 div y)) and false)'
+        """
+        left = exp.left.accept(self, env)
+        right = exp.right.accept(self, env)
+        if isinstance(left, Bln):
+            return right if left.bln else Bln(False)
+        if isinstance(right, Bln):
+            if right.bln:
+                return left
+            if not may_trap(left):
+                return Bln(False)
+        return And(left, right)
+
+    def visit_or(self, exp, env):
+        """
+        >>> show(fold_constants(Or(Bln(False), Var('b'))))
+        'b'
+
+        >>> show(fold_constants(Or(Var('b'), Bln(True))))
+        'true'
+
+        >>> show(fold_constants(Or(Bln(True), Div(Num(1), Num(0)))))
+        'true'
+        """
+        left = exp.left.accept(self, env)
+        right = exp.right.accept(self, env)
+        if isinstance(left, Bln):
+            return Bln(True) if left.bln else right
+        if isinstance(right, Bln):
+            if not right.bln:
+                return left
+            if not may_trap(left):
+                return Bln(True)
+        return Or(left, right)
+
+    def visit_add(self, exp, env):
+        """
+        >>> show(fold_constants(Add(Num(0), Var('x'))))
+        'x'
+
+        >>> show(fold_constants(Add(Var('x'), Num(0))))
+        'x'
+        """
+        left = exp.left.accept(self, env)
+        right = exp.right.accept(self, env)
+        if isinstance(left, Num) and isinstance(right, Num):
+            return Num(left.num + right.num)
+        if isinstance(left, Num) and left.num == 0:
+            return right
+        if isinstance(right, Num) and right.num == 0:
+            return left
+        return Add(left, right)
+
+    def visit_sub(self, exp, env):
+        """
+        >>> show(fold_constants(Sub(Num(3), Num(5))))
+        '~2'
+
+        >>> show(fold_constants(Sub(Var('x'), Num(0))))
+        'x'
+
+        >>> show(fold_constants(Sub(Num(0), Var('x'))))
+        '~x'
+        """
+        left = exp.left.accept(self, env)
+        right = exp.right.accept(self, env)
+        if isinstance(left, Num) and isinstance(right, Num):
+            return Num(left.num - right.num)
+        if isinstance(right, Num) and right.num == 0:
+            return left
+        if isinstance(left, Num) and left.num == 0:
+            return Neg(right).accept(self, env)
+        return Sub(left, right)
+
+    def visit_mul(self, exp, env):
+        """
+        >>> show(fold_constants(Mul(Var('x'), Num(1))))
+        'x'
+
+        >>> show(fold_constants(Mul(Num(0), Var('x'))))
+        '0'
+
+        >>> show(fold_constants(Mul(Num(0), App(Var('f'), Var('x')))))
+        '(0 * (f x))'
+        """
+        left = exp.left.accept(self, env)
+        right = exp.right.accept(self, env)
+        if isinstance(left, Num) and isinstance(right, Num):
+            return Num(left.num * right.num)
+        if isinstance(left, Num) and left.num == 1:
+            return right
+        if isinstance(right, Num) and right.num == 1:
+            return left
+        if isinstance(left, Num) and left.num == 0 and not may_trap(right):
+            return Num(0)
+        if isinstance(right, Num) and right.num == 0 and not may_trap(left):
+            return Num(0)
+        return Mul(left, right)
+
+    def visit_div(self, exp, env):
+        """
+        The division rounds towards minus infinity, like the div instruction
+        of the low-level language:
+
+        >>> show(fold_constants(Div(Num(-7), Num(2))))
+        '~4'
+
+        >>> show(fold_constants(Div(Var('x'), Num(1))))
+        'x'
+
+        >>> show(fold_constants(Div(Var('x'), Num(0))))
+        '(x div 0)'
+        """
+        left = exp.left.accept(self, env)
+        right = exp.right.accept(self, env)
+        if isinstance(right, Num) and right.num != 0:
+            if isinstance(left, Num):
+                return Num(left.num // right.num)
+            if right.num == 1:
+                return left
+        return Div(left, right)
+
+    def visit_mod(self, exp, env):
+        """
+        The remainder has the sign of the divisor, like the rem instruction of
+        the low-level language:
+
+        >>> show(fold_constants(Mod(Num(-7), Num(2))))
+        '1'
+
+        >>> show(fold_constants(Mod(Var('x'), Num(1))))
+        '0'
+
+        >>> show(fold_constants(Mod(Var('x'), Num(0))))
+        '(x mod 0)'
+        """
+        left = exp.left.accept(self, env)
+        right = exp.right.accept(self, env)
+        if isinstance(right, Num) and right.num != 0:
+            if isinstance(left, Num):
+                return Num(left.num % right.num)
+            if right.num in (1, -1) and not may_trap(left):
+                return Num(0)
+        return Mod(left, right)
+
+    def visit_leq(self, exp, env):
+        """
+        >>> show(fold_constants(Leq(Num(3), Num(3))))
+        'true'
+        """
+        left = exp.left.accept(self, env)
+        right = exp.right.accept(self, env)
+        if isinstance(left, Num) and isinstance(right, Num):
+            return Bln(left.num <= right.num)
+        return Leq(left, right)
+
+    def visit_lth(self, exp, env):
+        """
+        >>> show(fold_constants(Lth(Num(3), Num(3))))
+        'false'
+        """
+        left = exp.left.accept(self, env)
+        right = exp.right.accept(self, env)
+        if isinstance(left, Num) and isinstance(right, Num):
+            return Bln(left.num < right.num)
+        return Lth(left, right)
+
+    def visit_neg(self, exp, env):
+        """
+        >>> show(fold_constants(Neg(Neg(Var('x')))))
+        'x'
+        """
+        e = exp.exp.accept(self, env)
+        if isinstance(e, Num):
+            return Num(-e.num)
+        if isinstance(e, Neg):
+            return e.exp
+        return Neg(e)
+
+    def visit_not(self, exp, env):
+        """
+        >>> show(fold_constants(Not(Not(Var('b')))))
+        'b'
+
+        >>> show(fold_constants(Not(Num(0))))
+        'true'
+        """
+        e = exp.exp.accept(self, env)
+        if is_literal(e):
+            return Bln(literal_value(e) == 0)
+        if isinstance(e, Not):
+            return e.exp
+        return Not(e)
+
+    def visit_let(self, exp, env):
+        exp_def = exp.exp_def.accept(self, env)
+        if is_literal(exp_def):
+            return exp.exp_body.accept(self, {**env, exp.identifier: exp_def})
+        exp_body = exp.exp_body.accept(self, self.unbind(env, exp.identifier))
+        return Let(exp.identifier, exp_def, exp_body)
+
+    def visit_ifThenElse(self, exp, env):
+        """
+        >>> show(fold_constants(IfThenElse(Bln(True), Var('a'), Var('b'))))
+        'a'
+
+        >>> e = IfThenElse(Lth(Num(3), Num(2)), Var('a'), Var('b'))
+        >>> show(fold_constants(e))
+        'b'
+
+        >>> show(fold_constants(IfThenElse(Var('c'), Bln(False), Bln(True))))
+        'not c'
+        """
+        cond = exp.cond.accept(self, env)
+        if isinstance(cond, Bln):
+            return (exp.e0 if cond.bln else exp.e1).accept(self, env)
+        e0 = exp.e0.accept(self, env)
+        e1 = exp.e1.accept(self, env)
+        if isinstance(e0, Bln) and isinstance(e1, Bln) and e0.bln != e1.bln:
+            return cond if e0.bln else Not(cond).accept(self, env)
+        return IfThenElse(cond, e0, e1)
+
+    def visit_fn(self, exp, env):
+        body = exp.body.accept(self, self.unbind(env, exp.formal))
+        return Fn(exp.formal, body)
+
+    def unbind(self, env, name):
+        """
+        Returns the environment without the constant bound to name, if any.
+        This is necessary whenever a new binding shadows an older one.
+        """
+        if name in env:
+            env = dict(env)
+            del env[name]
+        return env
+
+
+def fold_constants(exp):
+    """
+    Folds the constant expressions in exp, returning a new expression.
+    """
+    return exp.accept(FoldVisitor(), {})
+
+
+def fields(exp):
+    """
+    Returns the names of the attributes of exp that hold sub-expressions, in
+    the order in which these sub-expressions are evaluated.
+
+    Example:
+        >>> fields(Let('x', Num(1), Var('x')))
+        ('exp_def', 'exp_body')
+
+        >>> fields(Num(1))
+        ()
+    """
+    if isinstance(exp, BinaryExpression):
+        return ("left", "right")
+    if isinstance(exp, UnaryExpression):
+        return ("exp",)
+    if isinstance(exp, Let):
+        return ("exp_def", "exp_body")
+    if isinstance(exp, IfThenElse):
+        return ("cond", "e0", "e1")
+    if isinstance(exp, Fn):
+        return ("body",)
+    if isinstance(exp, App):
+        return ("function", "actual")
+    return ()
+
+
+def is_conditional(exp, field):
+    """
+    Tells if the sub-expression stored in the attribute 'field' of exp might
+    not be evaluated when exp is evaluated. This happens with the branches of
+    conditionals, and with the right side of short-circuit operators.
+    """
+    if isinstance(exp, (And, Or)):
+        return field == "right"
+    if isinstance(exp, IfThenElse):
+        return field != "cond"
+    return False
+
+
+class NameSupply:
+    """
+    Generates variable names that do not occur in an expression. The names
+    follow the format used by RenameVisitor: a prefix, followed by a counter.
+
+    Example:
+        >>> names = NameSupply(Let('t_0', Num(1), Var('t_1')))
+        >>> names.fresh('t'), names.fresh('t'), names.fresh('u')
+        ('t_2', 't_3', 'u_0')
+    """
+
+    def __init__(self, exp):
+        self.used = set()
+        self.counters = {}
+        worklist = [exp]
+        while worklist:
+            e = worklist.pop()
+            if isinstance(e, Var):
+                self.used.add(e.identifier)
+            elif isinstance(e, Let):
+                self.used.add(e.identifier)
+            elif isinstance(e, Fn):
+                self.used.add(e.formal)
+            worklist.extend(getattr(e, f) for f in fields(e))
+
+    def fresh(self, prefix):
+        counter = self.counters.get(prefix, 0)
+        name = f"{prefix}_{counter}"
+        while name in self.used:
+            counter += 1
+            name = f"{prefix}_{counter}"
+        self.counters[prefix] = counter + 1
+        self.used.add(name)
+        return name
+
+
+class Box:
+    """
+    A container for the root of an expression. It lets the optimizations
+    replace the root in the same way that they replace any other
+    sub-expression: by assigning to an attribute of its parent.
+    """
+
+    def __init__(self, exp):
+        self.exp = exp
+
+
+class CommonSubexpressionEliminator:
+    """
+    This class removes repeated computations of the same pure expression. The
+    expressions are identified by structural keys, which are integers given to
+    each distinct combination of operator and keys of the operands. Variables
+    are keyed by the expression that binds them, so that two occurrences of 'x'
+    bound by different functions do not get confused.
+
+    The elimination works on regions: a region is a sub-expression that is
+    always evaluated as a whole. Function bodies, branches of conditionals and
+    the right side of short-circuit operators start new regions. A repeated
+    expression is bound to a fresh variable with a let that encloses the
+    smallest sub-expression that contains every occurrence, as long as at least
+    one of these occurrences is evaluated whenever the region is. Hence, moving
+    the computation to the let never evaluates something that the original
+    program would not evaluate. Occurrences in conditional positions dominated
+    by the new let are also replaced, but occurrences within function bodies
+    are left alone.
+
+    Usage:
+        >>> x = Var('x')
+        >>> e = Add(Mul(x, x), Mul(x, x))
+        >>> show(eliminate_common_subexpressions(e))
+        'let cse_0 <- (x * x) in (cse_0 + cse_0) end'
+
+        >>> e = Add(App(Var('f'), x), Mul(App(Var('f'), x), Num(2)))
+        >>> show(eliminate_common_subexpressions(e))
+        'let cse_0 <- (f x) in (cse_0 + (cse_0 * 2)) end'
+
+        >>> e = Add(Add(Mul(x, x), Num(1)), Add(Mul(x, x), Num(1)))
+        >>> show(eliminate_common_subexpressions(e))
+        'let cse_0 <- ((x * x) + 1) in (cse_0 + cse_0) end'
+
+    Expressions that are evaluated only on some paths are not moved:
+        >>> e = And(Var('b'), Lth(Div(Num(1), x), Div(Num(1), x)))
+        >>> show(eliminate_common_subexpressions(e))
+        '(b and let cse_0 <- (1 div x) in (cse_0 < cse_0) end)'
+
+        >>> e = IfThenElse(Var('b'), Mul(x, x), Mul(x, x))
+        >>> show(eliminate_common_subexpressions(e))
+        'if b then (x * x) else (x * x)'
+
+    But they reuse values computed on every path that reaches them:
+        >>> e = Add(Mul(x, x), IfThenElse(Var('b'), Mul(x, x), Num(0)))
+        >>> show(eliminate_common_subexpressions(e))
+        'let cse_0 <- (x * x) in (cse_0 + if b then cse_0 else 0) end'
+
+    Variables with the same name, but different bindings, are different:
+        >>> e = Add(App(Fn('x', Mul(x, x)), Num(2)), Mul(x, x))
+        >>> show(eliminate_common_subexpressions(e))
+        '(((fn x => (x * x)) 2) + (x * x))'
+    """
+
+    def __init__(self, exp):
+        self.names = NameSupply(exp)
+        self.keys = {}
+        self.sizes = {}
+
+    def key_of(self, key, size):
+        if key not in self.keys:
+            self.keys[key] = len(self.keys)
+            self.sizes[self.keys[key]] = size
+        return self.keys[key]
+
+    def unique_key(self):
+        return self.key_of(("unique", len(self.keys)), 1)
+
+    def scan(self, exp, env, path, cond, occurrences, regions):
+        """
+        Computes the key of exp. The key of each candidate for elimination is
+        added to 'occurrences', together with the path from the root of the
+        region to it, and a flag telling if it is conditionally evaluated. The
+        places where new regions start are added to 'regions'. Returns the key
+        and the size of exp.
+        """
+        if isinstance(exp, Var):
+            binder = env.get(exp.identifier, exp.identifier)
+            return self.key_of(("var", binder), 1), 1
+        if isinstance(exp, Num):
+            return self.key_of(("num", exp.num), 1), 1
+        if isinstance(exp, Bln):
+            return self.key_of(("bln", exp.bln), 1), 1
+        if isinstance(exp, Fn):
+            regions.append((exp, "body", {**env, exp.formal: id(exp)}))
+            return self.unique_key(), 1
+        child_keys = []
+        size = 1
+        for field in fields(exp):
+            child_env = env
+            if isinstance(exp, Let) and field == "exp_body":
+                child_env = {**env, exp.identifier: id(exp)}
+            child_cond = cond
+            if is_conditional(exp, field):
+                if not cond:
+                    regions.append((exp, field, child_env))
+                child_cond = True
+            child = getattr(exp, field)
+            child_path = path + [(exp, field)]
+            k, s = self.scan(child, child_env, child_path, child_cond,
+                             occurrences, regions)
+            child_keys.append(k)
+            size += s
+        if isinstance(exp, Let):
+            return self.unique_key(), size
+        key = self.key_of((type(exp).__name__, *child_keys), size)
+        occurrences.setdefault(key, []).append((path, cond))
+        return key, size
+
+    def eliminate(self, parent, field, env):
+        """
+        Removes the redundancies in the region rooted at the expression stored
+        in the attribute 'field' of 'parent'.
+        """
+        while True:
+            occurrences = {}
+            regions = []
+            self.scan(getattr(parent, field), env, [(parent, field)],
+                      False, occurrences, regions)
+            best = None
+            for key, occs in occurrences.items():
+                if len(occs) < 2 or all(cond for _, cond in occs):
+                    continue
+                if best is None or self.sizes[key] > self.sizes[best]:
+                    best = key
+            if best is None:
+                break
+            self.bind(occurrences[best])
+        for region_parent, region_field, region_env in regions:
+            self.eliminate(region_parent, region_field, region_env)
+
+    def bind(self, occs):
+        """
+        Binds the expression that occurs in the places given by 'occs' to a
+        fresh variable, and replaces these occurrences with the variable.
+        """
+        paths = [path for path, _ in occs]
+        common = 0
+        while all(len(p) > common + 1 and p[common] == paths[0][common]
+                  for p in paths):
+            common += 1
+        scope_parent, scope_field = paths[0][common - 1]
+        scope = getattr(scope_parent, scope_field)
+        name = self.names.fresh("cse")
+        occ_parent, occ_field = paths[0][-1]
+        exp_def = getattr(occ_parent, occ_field)
+        for path in paths:
+            occ_parent, occ_field = path[-1]
+            setattr(occ_parent, occ_field, Var(name))
+        setattr(scope_parent, scope_field, Let(name, exp_def, scope))
+
+
+def eliminate_common_subexpressions(exp):
+    """
+    Removes the redundant computations of exp, returning a new expression.
+    """
+    box = Box(exp.accept(TransformVisitor(), None))
+    CommonSubexpressionEliminator(box.exp).eliminate(box, "exp", {})
+    return box.exp
+
+
+class UsageCountVisitor(TransformVisitor):
+    """
+    This visitor counts how many times each binding is used. Bindings are
+    identified by the let or fn expression that creates them, because the
+    same name might be bound in different places. The argument of each method
+    maps names to the expressions that bind them. The counters are stored in
+    the dictionary 'counts', indexed by the id of the binding expression.
+
+    Example:
+        >>> e1 = Fn('x', Mul(Var('x'), Var('y')))
+        >>> e0 = Let('x', Num(2), App(e1, Var('x')))
+        >>> counter = UsageCountVisitor()
+        >>> _ = e0.accept(counter, {})
+        >>> counter.counts[id(e0)], counter.counts[id(e1)]
+        (1, 1)
+    """
+
+    def __init__(self):
+        self.counts = {}
+
+    def visit_var(self, exp, env):
+        if exp.identifier in env:
+            binder = id(env[exp.identifier])
+            self.counts[binder] = self.counts.get(binder, 0) + 1
+        return exp
+
+    def visit_bln(self, exp, env):
+        return exp
+
+    def visit_num(self, exp, env):
+        return exp
+
+    def visit_binary(self, exp, env):
+        exp.left.accept(self, env)
+        exp.right.accept(self, env)
+        return exp
+
+    def visit_neg(self, exp, env):
+        exp.exp.accept(self, env)
+        return exp
+
+    def visit_not(self, exp, env):
+        exp.exp.accept(self, env)
+        return exp
+
+    def visit_let(self, exp, env):
+        exp.exp_def.accept(self, env)
+        exp.exp_body.accept(self, {**env, exp.identifier: exp})
+        return exp
+
+    def visit_ifThenElse(self, exp, env):
+        exp.cond.accept(self, env)
+        exp.e0.accept(self, env)
+        exp.e1.accept(self, env)
+        return exp
+
+    def visit_fn(self, exp, env):
+        exp.body.accept(self, {**env, exp.formal: exp})
+        return exp
+
+    def visit_app(self, exp, env):
+        exp.function.accept(self, env)
+        exp.actual.accept(self, env)
+        return exp
+
+
+class DeadCodeVisitor(TransformVisitor):
+    """
+    This visitor removes let bindings that are never used, and branches that
+    can never be taken. A binding is removed only if evaluating its definition
+    cannot trap, unless 'preserve_traps' is False. Unused functions are always
+    removed, because creating a function does not run its body.
+
+    Branches are removed when the value of the condition is known. This
+    happens if the condition is a constant, or if the same condition has been
+    tested by an enclosing conditional, or by the left side of an enclosing
+    short-circuit operator. The argument of each method is a dictionary that
+    maps the text of the conditions known to be true or false to a pair
+    formed by this truth value and the free variables of the condition.
+
+    Usage:
+        >>> e = Let('f', Fn('x', Mul(Var('x'), Var('x'))), Num(3))
+        >>> show(eliminate_dead_code(e))
+        '3'
+
+        >>> e = Let('x', Div(Num(3), Var('y')), Num(3))
+        >>> show(eliminate_dead_code(e))
+        'let x <- (3 div y) in 3 end'
+
+        >>> show(eliminate_dead_code(e, preserve_traps=False))
+        '3'
+
+        >>> e = Let('c', Var('b'), Num(3))
+        >>> e = Let('a', Num(1), Let('b', Var('a'), e))
+        >>> show(eliminate_dead_code(e))
+        '3'
+
+        >>> c = Lth(Var('x'), Num(1))
+        >>> e = IfThenElse(c, IfThenElse(c, Var('a'), Var('b')), Var('d'))
+        >>> show(eliminate_dead_code(e))
+        'if (x < 1) then a else d'
+
+        >>> e = And(c, Or(Not(c), Var('b')))
+        >>> show(eliminate_dead_code(e))
+        '((x < 1) and b)'
+
+        >>> f = Fn('x', IfThenElse(c, Var('a'), Var('b')))
+        >>> e = IfThenElse(c, f, Var('d'))
+        >>> show(eliminate_dead_code(e))
+        'if (x < 1) then (fn x => if (x < 1) then a else b) else d'
+    """
+
+    def __init__(self, counts, preserve_traps=True):
+        self.counts = counts
+        self.preserve_traps = preserve_traps
+        self.changed = False
+
+    def known(self, cond, facts):
+        """
+        Returns the truth value of cond, if it is known, or None otherwise.
+        """
+        if isinstance(cond, Bln):
+            return cond.bln
+        if isinstance(cond, Not):
+            value = self.known(cond.exp, facts)
+            return None if value is None else not value
+        fact = facts.get(show(cond))
+        return None if fact is None else fact[0]
+
+    def assume(self, cond, value, facts):
+        """
+        Returns the facts extended with the knowledge that cond has the given
+        truth value. Conditions that might trap are not recorded, as they are
+        never tested again in the program that we produce.
+        """
+        if isinstance(cond, Not):
+            return self.assume(cond.exp, not value, facts)
+        if isinstance(cond, Bln) or may_trap(cond):
+            return facts
+        return {**facts, show(cond): (value, free_variables(cond))}
+
+    def forget(self, name, facts):
+        """
+        Removes the facts about conditions that use the given name. We call
+        it whenever a new binding shadows the name.
+        """
+        return {k: v for k, v in facts.items() if name not in v[1]}
+
+    def visit_and(self, exp, facts):
+        left = exp.left.accept(self, facts)
+        value = self.known(left, facts)
+        if value is not None:
+            self.changed = True
+            if not value:
+                return Bln(False)
+            return exp.right.accept(self, facts)
+        right = exp.right.accept(self, self.assume(left, True, facts))
+        return And(left, right)
+
+    def visit_or(self, exp, facts):
+        left = exp.left.accept(self, facts)
+        value = self.known(left, facts)
+        if value is not None:
+            self.changed = True
+            if value:
+                return Bln(True)
+            return exp.right.accept(self, facts)
+        right = exp.right.accept(self, self.assume(left, False, facts))
+        return Or(left, right)
+
+    def visit_not(self, exp, facts):
+        e = exp.exp.accept(self, facts)
+        value = self.known(e, facts)
+        if value is not None:
+            self.changed = True
+            return Bln(not value)
+        return Not(e)
+
+    def visit_let(self, exp, facts):
+        body_facts = self.forget(exp.identifier, facts)
+        if self.counts.get(id(exp), 0) == 0:
+            if not (self.preserve_traps and may_trap(exp.exp_def)):
+                self.changed = True
+                return exp.exp_body.accept(self, body_facts)
+        exp_def = exp.exp_def.accept(self, facts)
+        exp_body = exp.exp_body.accept(self, body_facts)
+        return Let(exp.identifier, exp_def, exp_body)
+
+    def visit_ifThenElse(self, exp, facts):
+        cond = exp.cond.accept(self, facts)
+        value = self.known(cond, facts)
+        if value is not None:
+            self.changed = True
+            return (exp.e0 if value else exp.e1).accept(self, facts)
+        e0 = exp.e0.accept(self, self.assume(cond, True, facts))
+        e1 = exp.e1.accept(self, self.assume(cond, False, facts))
+        if not may_trap(cond) and show(e0) == show(e1):
+            self.changed = True
+            return e0
+        return IfThenElse(cond, e0, e1)
+
+    def visit_fn(self, exp, facts):
+        body = exp.body.accept(self, self.forget(exp.formal, facts))
+        return Fn(exp.formal, body)
+
+
+def eliminate_dead_code(exp, preserve_traps=True):
+    """
+    Removes unused bindings and unreachable branches from exp, returning a new
+    expression. The elimination is repeated until nothing else changes, as
+    removing a binding might make other bindings unused.
+    """
+    while True:
+        counter = UsageCountVisitor()
+        exp.accept(counter, {})
+        eliminator = DeadCodeVisitor(counter.counts, preserve_traps)
+        exp = exp.accept(eliminator, {})
+        if not eliminator.changed:
+            return exp
+
+
+def size(exp):
+    """
+    Returns the number of nodes in the expression exp.
+
+    Example:
+        >>> size(Fn('x', Mul(Var('x'), Var('x'))))
+        4
+    """
+    total = 0
+    worklist = [exp]
+    while worklist:
+        e = worklist.pop()
+        total += 1
+        worklist.extend(getattr(e, f) for f in fields(e))
+    return total
+
+
+class CopyVisitor(TransformVisitor):
+    """
+    This visitor copies an expression, giving fresh names to every variable
+    that the expression binds. The argument of each method maps old names to
+    new names. The copy of a function body can then be placed anywhere in the
+    program, without its bindings capturing or shadowing other variables.
+
+    Example:
+        >>> e = Let('y', Var('x'), Fn('z', Add(Var('y'), Var('z'))))
+        >>> c = CopyVisitor(NameSupply(e))
+        >>> show(e.accept(c, {'x': 'w'}))
+        'let y_0 <- w in (fn z_0 => (y_0 + z_0)) end'
+    """
+
+    def __init__(self, names):
+        self.names = names
+
+    def visit_var(self, exp, renaming):
+        return Var(renaming.get(exp.identifier, exp.identifier))
+
+    def visit_let(self, exp, renaming):
+        exp_def = exp.exp_def.accept(self, renaming)
+        name = self.names.fresh(exp.identifier)
+        renaming = {**renaming, exp.identifier: name}
+        exp_body = exp.exp_body.accept(self, renaming)
+        return Let(name, exp_def, exp_body)
+
+    def visit_fn(self, exp, renaming):
+        name = self.names.fresh(exp.formal)
+        return Fn(name, exp.body.accept(self, {**renaming, exp.formal: name}))
+
+
+class Binding:
+    """
+    The information that the interprocedural optimizations keep about a
+    variable: the expression that binds it, and, if the variable is bound to a
+    function, the function plus the environment where the function was
+    defined. The specializer also records here the clones of the function.
+    """
+
+    def __init__(self, binder, fn=None, fn_env=None, single_use=False):
+        self.binder = binder
+        self.fn = fn
+        self.fn_env = fn_env
+        self.single_use = single_use
+        self.clones = {}
+
+
+class InlineVisitor(TransformVisitor):
+    """
+    This visitor replaces applications of known functions with the bodies of
+    these functions. A function is known at an application if the applied
+    expression is an anonymous function, or a variable bound by a let to a
+    function. The body of a function bound by a let is inlined if the function
+    is used only once, or if the body is small, that is, if it has at most
+    'threshold' nodes. The total number of nodes copied into the program is
+    bounded by 'budget'. An application 'f e', where f is 'fn x => b', becomes
+    'let x' <- e in b' end', where b' is a copy of b with fresh names, with x
+    replaced by x'. If e is a variable, then x is replaced by e directly.
+
+    The argument of each method maps the names of variables to Binding
+    objects. A function is inlined only if its free variables refer to the
+    same bindings at the application as they did at the definition.
+
+    Usage:
+        >>> e = App(Fn('x', Add(Var('x'), Num(1))), Num(5))
+        >>> show(inline_functions(e))
+        'let x_0 <- 5 in (x_0 + 1) end'
+
+        >>> sqr = Fn('x', Mul(Var('x'), Var('x')))
+        >>> twc = Fn('a', Fn('b', App(Var('a'), App(Var('a'), Var('b')))))
+        >>> app = App(App(Var('twice'), Var('sqr')), Num(3))
+        >>> e = Let('sqr', sqr, Let('twice', twc, app))
+        >>> e = fold_constants(inline_functions(e))
+        >>> show(eliminate_dead_code(e))
+        '81'
+
+    Functions that capture a variable are not inlined where a different
+    binding shadows that variable:
+        >>> f = Fn('x', Add(Var('x'), Var('y')))
+        >>> e = Let('f', f, Fn('y', App(Var('f'), Var('y'))))
+        >>> show(inline_functions(e))
+        'let f <- (fn x => (x + y)) in (fn y => (f y)) end'
+
+    The budget limits how much code the inliner copies:
+        >>> body = Add(Mul(Var('x'), Var('x')), Num(1))
+        >>> e = Add(App(Var('f'), Num(1)), App(Var('f'), Num(2)))
+        >>> e = Let('f', Fn('x', body), e)
+        >>> show(inline_functions(e, budget=5))
+        'let f <- (fn x => ((x * x) + 1)) in (let x_0 <- 1 in ((x_0 * x_0) + 1) end + (f 2)) end'
+    """
+
+    def __init__(self, names, counts, budget, threshold):
+        self.names = names
+        self.counts = counts
+        self.budget = budget
+        self.threshold = threshold
+
+    def visit_let(self, exp, env):
+        exp_def = exp.exp_def.accept(self, env)
+        single_use = self.counts.get(id(exp), 0) == 1
+        return self.bind(exp.identifier, exp_def, exp.exp_body, env,
+                         single_use)
+
+    def bind(self, name, exp_def, exp_body, env, single_use=False):
+        """
+        Builds the expression 'let name <- exp_def in exp_body end', inlining
+        the applications within exp_body. The definition must have been
+        visited already.
+        """
+        let = Let(name, exp_def, None)
+        binding = Binding(let)
+        if isinstance(exp_def, Fn):
+            binding = Binding(let, exp_def, env, single_use)
+        let.exp_body = exp_body.accept(self, {**env, name: binding})
+        return let
+
+    def visit_fn(self, exp, env):
+        body = exp.body.accept(self, {**env, exp.formal: Binding(exp)})
+        return Fn(exp.formal, body)
+
+    def visit_app(self, exp, env):
+        function = exp.function.accept(self, env)
+        actual = exp.actual.accept(self, env)
+        return self.apply(function, actual, env)
+
+    def apply(self, function, actual, env):
+        """
+        Builds the application of function to actual, inlining the function
+        if it is known and the heuristics allow it.
+        """
+        if isinstance(function, Let) and \
+                function.identifier not in free_variables(actual):
+            body = self.apply(function.exp_body, actual, env)
+            return Let(function.identifier, function.exp_def, body)
+        if isinstance(function, Fn) and self.budget > 0:
+            self.budget -= 1
+            return self.beta(function, actual, env)
+        if isinstance(function, Var) and function.identifier in env:
+            binding = env[function.identifier]
+            if binding.fn is not None and self.inlinable(binding, env):
+                cost = size(binding.fn.body)
+                self.budget -= cost
+                body = binding.fn.body.accept(CopyVisitor(self.names), {})
+                return self.beta(Fn(binding.fn.formal, body), actual, env)
+        return App(function, actual)
+
+    def inlinable(self, binding, env):
+        cost = size(binding.fn.body)
+        if cost > self.budget:
+            return False
+        if cost > self.threshold and not binding.single_use:
+            return False
+        for name in free_variables(binding.fn):
+            if env.get(name) is not binding.fn_env.get(name):
+                return False
+        return True
+
+    def beta(self, fn, actual, env):
+        """
+        Replaces the application of fn to actual with the body of fn, and
+        inlines the applications that this replacement exposes.
+        """
+        if isinstance(actual, Var):
+            renaming = {fn.formal: actual.identifier}
+            body = fn.body.accept(CopyVisitor(self.names), renaming)
+            return body.accept(self, env)
+        name = self.names.fresh(fn.formal)
+        body = fn.body.accept(CopyVisitor(self.names), {fn.formal: name})
+        return self.bind(name, actual, body, env)
+
+
+def inline_functions(exp, budget=200, threshold=12):
+    """
+    Inlines the applications of known functions in exp, returning a new
+    expression. See InlineVisitor for the meaning of the parameters.
+    """
+    counter = UsageCountVisitor()
+    exp.accept(counter, {})
+    inliner = InlineVisitor(NameSupply(exp), counter.counts, budget, threshold)
+    return exp.accept(inliner, {})
+
+
+class SpecializeVisitor(TransformVisitor):
+    """
+    This visitor clones functions for the constant arguments, and for the
+    known functions, that they receive. A function is known if it is bound to
+    a variable by a let. The clone of 'f' for the argument 'c' is the body of
+    'f', with the formal parameter replaced by 'c', and then folded. It is
+    bound to a new variable right after the definition of 'f'. If the body of
+    'f' is a function, as in 'fn a => fn b => e', then the application 'f c'
+    is replaced with the clone itself, because the clone is the value of the
+    application. Otherwise, the application calls the clone instead of 'f'.
+
+    Clones are cached by function and argument, and each function gets at
+    most 'max_clones' clones. The argument of each method maps names to
+    Binding objects.
+
+    Usage:
+        >>> f = Fn('a', Fn('b', IfThenElse(Lth(Var('a'), Num(0)), Var('b'),
+        ...                                Mul(Var('a'), Var('b')))))
+        >>> e = Let('f', f, Add(App(App(Var('f'), Num(2)), Var('x')),
+        ...                     App(App(Var('f'), Num(2)), Var('y'))))
+        >>> show(specialize_functions(e))
+        'let f <- (fn a => (fn b => if (a < 0) then b else (a * b))) in let f_0 <- (fn b_0 => (2 * b_0)) in ((f_0 x) + (f_0 y)) end end'
+
+        >>> f = Fn('a', Div(Num(12), Var('a')))
+        >>> e = Let('f', f, Add(App(Var('f'), Num(4)),
+        ...                     App(Var('f'), Var('x'))))
+        >>> show(specialize_functions(e))
+        'let f <- (fn a => (12 div a)) in let f_0 <- (fn a_1 => 3) in ((f_0 4) + (f x)) end end'
+
+    Functions passed as arguments are also cloned:
+        >>> sqr = Fn('x', Mul(Var('x'), Var('x')))
+        >>> twc = Fn('a', Fn('b', App(Var('a'), App(Var('a'), Var('b')))))
+        >>> e = App(App(Var('twice'), Var('sqr')), Num(3))
+        >>> e = Let('sqr', sqr, Let('twice', twc, e))
+        >>> show(specialize_functions(e))
+        'let sqr <- (fn x => (x * x)) in let twice <- (fn a => (fn b => (a (a b)))) in let twice_0 <- (fn b_0 => (sqr (sqr b_0))) in (twice_0 3) end end end'
+
+    The number of clones is bounded:
+        >>> f = Fn('a', Add(Var('a'), Num(1)))
+        >>> e = Let('f', f, Add(App(Var('f'), Num(1)),
+        ...                     App(Var('f'), Num(2))))
+        >>> show(specialize_functions(e, max_clones=1))
+        'let f <- (fn a => (a + 1)) in let f_0 <- (fn a_1 => 2) in ((f_0 1) + (f 2)) end end'
+
+    A function is never specialized for itself, as its clone would call
+    itself, and there is no recursive let:
+        >>> rec = App(App(Var('s'), Var('s')), Sub(Var('n'), Num(1)))
+        >>> f = Fn('s', Fn('n', IfThenElse(Lth(Var('n'), Num(1)), Num(1),
+        ...                                Mul(Var('n'), rec))))
+        >>> e = Let('d', f, App(App(Var('d'), Var('d')), Num(5)))
+        >>> e = specialize_functions(e)
+        >>> show(e)
+        'let d <- (fn s => (fn n => if (n < 1) then 1 else (n * ((s s) (n - 1))))) in ((d d) 5) end'
+    """
+
+    def __init__(self, names, max_clones):
+        self.names = names
+        self.max_clones = max_clones
+
+    def visit_let(self, exp, env):
+        exp_def = exp.exp_def.accept(self, env)
+        binding = Binding(exp)
+        if isinstance(exp_def, Fn):
+            binding = Binding(exp, exp_def, env)
+        exp_body = exp.exp_body.accept(self, {**env, exp.identifier: binding})
+        for name, clone in reversed(binding.clones.values()):
+            exp_body = Let(name, clone, exp_body)
+        return Let(exp.identifier, exp_def, exp_body)
+
+    def visit_fn(self, exp, env):
+        body = exp.body.accept(self, {**env, exp.formal: Binding(exp)})
+        return Fn(exp.formal, body)
+
+    def visit_app(self, exp, env):
+        function = exp.function.accept(self, env)
+        actual = exp.actual.accept(self, env)
+        if isinstance(function, Var) and function.identifier in env:
+            binding = env[function.identifier]
+            if binding.fn is not None:
+                clone_name = self.clone(function.identifier, binding, actual,
+                                        env)
+                if clone_name is not None:
+                    if isinstance(binding.fn.body, Fn):
+                        return Var(clone_name)
+                    return App(Var(clone_name), actual)
+        return App(function, actual)
+
+    def argument_key(self, binding, actual, env):
+        """
+        Returns the key of the clone of the function described by binding,
+        for the argument actual, or None if the argument is neither a constant
+        nor a known function visible where the function is defined.
+        """
+        if isinstance(actual, Num):
+            return ("num", actual.num)
+        if isinstance(actual, Bln):
+            return ("bln", actual.bln)
+        if isinstance(actual, Var) and actual.identifier in env:
+            arg_binding = env[actual.identifier]
+            if arg_binding.fn is None:
+                return None
+            if arg_binding is binding.fn_env.get(actual.identifier):
+                return ("fn", id(arg_binding))
+        return None
+
+    def clone(self, name, binding, actual, env):
+        """
+        Returns the name of the clone of the function bound to name for the
+        argument actual, creating the clone if necessary. Returns None if the
+        function cannot be specialized for this argument.
+        """
+        key = self.argument_key(binding, actual, env)
+        if key is None:
+            return None
+        if key in binding.clones:
+            return binding.clones[key][0]
+        if len(binding.clones) >= self.max_clones:
+            return None
+        fn = binding.fn
+        if isinstance(actual, Var):
+            renaming = {fn.formal: actual.identifier}
+            body = fn.body.accept(CopyVisitor(self.names), renaming)
+        else:
+            formal = self.names.fresh(fn.formal)
+            body = fn.body.accept(CopyVisitor(self.names), {fn.formal: formal})
+            body = Let(formal, actual, body)
+        body = fold_constants(body)
+        if not isinstance(fn.body, Fn):
+            body = Fn(self.names.fresh(fn.formal), body)
+        clone_name = self.names.fresh(name)
+        binding.clones[key] = (clone_name, None)
+        clone = body.accept(self, {**binding.fn_env, name: binding})
+        binding.clones[key] = (clone_name, clone)
+        return clone_name
+
+
+def specialize_functions(exp, max_clones=4):
+    """
+    Clones the functions of exp for the constant and known-function arguments
+    that they receive, returning a new expression.
+    """
+    specializer = SpecializeVisitor(NameSupply(exp), max_clones)
+    return exp.accept(specializer, {})
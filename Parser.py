@@ -409,6 +409,10 @@ class Parser:
             self.consumeToken(TokenType.DIV)
             right = self.UNARY_EXP()
             return self.MulDiv(Div(left, right))
+        elif token.kind == TokenType.MOD:
+            self.consumeToken(TokenType.MOD)
+            right = self.UNARY_EXP()
+            return self.MulDiv(Mod(left, right))
         else:
             return left
 
@@ -0,0 +1,391 @@
+"""
+This file contains a peephole optimizer for Asm programs. The GenVisitor
+produces many redundant instructions, such as the moves that copy the value
+of let bindings, or the results of conditionals and calls. The optimizer
+removes them with three kinds of transformation, which are applied until the
+program stops changing:
+
+* Copy propagation: uses of a register that holds a copy of another register
+  are replaced by that register, and chains of additions of immediates are
+  folded into a single 'addi'.
+* Rewriting rules: small windows of consecutive instructions are replaced by
+  cheaper sequences, following the table RULES.
+* Dead-store elimination: instructions that write registers which are never
+  read again are removed.
+
+After each transformation, the targets of branches are updated, so that they
+point to the same code as before.
+
+This file uses doctests all over. To test it, just run python 3 as follows:
+"python3 -m doctest Peephole.py".
+"""
+
+import Asm as AsmModule
+from Cfg import Cfg, Liveness, is_call, is_tail_call
+
+
+def copy_of(inst):
+    """
+    If inst computes d = s + c, with d different from s, returns the triple
+    (d, s, c). Otherwise, returns None.
+
+    Example:
+        >>> copy_of(AsmModule.Add("a", "b", "x0"))
+        ('a', 'b', 0)
+        >>> copy_of(AsmModule.Addi("a", "x0", 3))
+        ('a', 'x0', 3)
+        >>> copy_of(AsmModule.Addi("a", "a", 3)) is None
+        True
+    """
+    if isinstance(inst, AsmModule.Addi):
+        fact = (inst.rd, inst.rs1, inst.imm)
+    elif isinstance(inst, AsmModule.Add) and inst.rs2 == "x0":
+        fact = (inst.rd, inst.rs1, 0)
+    elif isinstance(inst, AsmModule.Add) and inst.rs1 == "x0":
+        fact = (inst.rd, inst.rs2, 0)
+    else:
+        return None
+    if fact[0] == fact[1] or fact[0] == "x0":
+        return None
+    return fact
+
+
+def is_removable(inst):
+    """
+    Tells if inst can be removed when the registers that it writes are dead.
+    Instructions that jump, access memory or might trap are never removed.
+
+    Example:
+        >>> is_removable(AsmModule.Add("a", "b", "c"))
+        True
+        >>> is_removable(AsmModule.Div("a", "b", "c"))
+        False
+    """
+    if isinstance(inst, (AsmModule.Div, AsmModule.Rem)):
+        return False
+    return isinstance(inst, (AsmModule.BinOp, AsmModule.BinOpImm,
+                             AsmModule.La))
+
+
+def remove_self_move(window, i):
+    inst = window[0]
+    if isinstance(inst, AsmModule.Addi):
+        is_move = inst.rd == inst.rs1 and inst.imm == 0
+    elif isinstance(inst, AsmModule.Add):
+        is_move = sorted([inst.rs1, inst.rs2]) == sorted([inst.rd, "x0"])
+    else:
+        is_move = False
+    return [] if is_move else None
+
+
+def remove_jump_to_next(window, i):
+    inst = window[0]
+    if isinstance(inst, AsmModule.CondBranch) or (
+            isinstance(inst, AsmModule.Jal) and inst.rd == "x0"):
+        if inst.lab == i + 1:
+            return []
+    return None
+
+
+def jump_on_same_register(window, i):
+    inst = window[0]
+    if isinstance(inst, AsmModule.CondBranch) and inst.rs1 == inst.rs2:
+        if inst.holds(0, 0):
+            return [AsmModule.Jal("x0", inst.lab)]
+        return []
+    return None
+
+
+def fold_addi_chain(window, i):
+    first, second = window
+    if isinstance(first, AsmModule.Addi) and \
+            isinstance(second, AsmModule.Addi):
+        imm = first.imm + second.imm
+        if first.rd == first.rs1 == second.rs1 == second.rd:
+            return [AsmModule.Addi(first.rd, first.rd, imm)]
+        if second.rs1 == first.rd and first.rd != first.rs1:
+            folded = AsmModule.Addi(second.rd, first.rs1, imm)
+            if second.rd == first.rd:
+                return [folded]
+            return [first, folded]
+    return None
+
+
+def forward_store(window, i):
+    first, second = window
+    if isinstance(first, AsmModule.Sw) and \
+            isinstance(second, AsmModule.MemOp) and \
+            (first.rs1, first.offset) == (second.rs1, second.offset):
+        if isinstance(second, AsmModule.Sw):
+            return [second]
+        if isinstance(second, AsmModule.Lw):
+            return [first, AsmModule.Addi(second.reg, first.reg, 0)]
+    return None
+
+
+"""
+The rewriting rules. Each rule is a pair (size, function), where the function
+receives a window of 'size' consecutive instructions of the same basic block,
+plus the index of the first of them, and returns either None, if the rule does
+not apply, or the list of instructions that replaces the window.
+"""
+RULES = [
+    (1, remove_self_move),
+    (1, remove_jump_to_next),
+    (1, jump_on_same_register),
+    (2, fold_addi_chain),
+    (2, forward_store),
+]
+
+
+class PeepholeOptimizer:
+    """
+    This class applies the peephole optimizations on a program. The registers
+    in live_out are read after the program ends, and must be preserved.
+
+    Example:
+        >>> insts = [AsmModule.Addi("v1", "x0", 2),
+        ...          AsmModule.Add("x", "v1", "x0"),
+        ...          AsmModule.Addi("v2", "x", 3),
+        ...          AsmModule.Add("v3", "v2", "x0")]
+        >>> p = AsmModule.Program(100, {}, insts)
+        >>> PeepholeOptimizer(p, live_out=["v3"]).optimize()
+        >>> [str(inst) for inst in p.get_insts()]
+        ['v3 = addi x0 5']
+    """
+
+    def __init__(self, prog, live_out=()):
+        self.prog = prog
+        self.live_out = list(live_out) + ["sp"]
+
+    def optimize(self):
+        changed = True
+        while changed:
+            changed = self.propagate_copies()
+            changed = self.apply_rules() or changed
+            changed = self.remove_dead_stores() or changed
+
+    def available_copies(self, cfg):
+        """
+        Computes the copies available at the beginning of each block. A copy
+        d = s + c is available if every path from the start of the program
+        goes through the instruction that creates it, and then does not write
+        either d or s. Copies are numbered in self.facts, and sets of copies
+        are bitsets over these numbers.
+        """
+        insts = cfg.insts
+        self.facts = []
+        self.fact_of = {}
+        self.mentions = {}
+        self.by_dest = {}
+        for i, inst in enumerate(insts):
+            fact = copy_of(inst)
+            if fact:
+                bit = 1 << len(self.facts)
+                self.fact_of[i] = bit
+                self.facts.append(fact)
+                for reg in fact[:2]:
+                    self.mentions[reg] = self.mentions.get(reg, 0) | bit
+                self.by_dest[fact[0]] = self.by_dest.get(fact[0], 0) | bit
+        gen = [0] * len(cfg.succs)
+        kill = [0] * len(cfg.succs)
+        for b in range(cfg.num_blocks):
+            g, k = 0, 0
+            for i in cfg.block_insts(b):
+                for reg in insts[i].get_defs():
+                    killed = self.mentions.get(reg, 0)
+                    g &= ~killed
+                    k |= killed
+                if i in self.fact_of:
+                    g |= self.fact_of[i]
+                    k &= ~self.fact_of[i]
+            gen[b], kill[b] = g, k
+        everything = (1 << len(self.facts)) - 1
+        order = cfg.reverse_postorder()
+        reachable = set(order)
+        copies_in = [0] * len(cfg.succs)
+        copies_out = [everything if b in reachable else gen[b]
+                      for b in range(len(cfg.succs))]
+        changed = True
+        while changed:
+            changed = False
+            for b in order:
+                if b == cfg.entry():
+                    new_in = 0
+                else:
+                    new_in = everything
+                    for p in cfg.preds[b]:
+                        new_in &= copies_out[p]
+                copies_in[b] = new_in
+                new_out = gen[b] | (new_in & ~kill[b])
+                if new_out != copies_out[b]:
+                    copies_out[b] = new_out
+                    changed = True
+        return copies_in
+
+    def propagate_copies(self):
+        """
+        Replaces the registers that hold copies by the registers that they
+        copy. Returns True if the program changed.
+
+        Example:
+            >>> insts = [AsmModule.Add("x", "v1", "x0"),
+            ...          AsmModule.Beq("x", "x0", 4),
+            ...          AsmModule.Addi("y", "x", 1),
+            ...          AsmModule.Addi("z", "y", 1)]
+            >>> p = AsmModule.Program(100, {}, insts)
+            >>> PeepholeOptimizer(p).propagate_copies()
+            True
+            >>> [str(inst) for inst in p.get_insts()]
+            ['x = add v1 x0', 'beq v1 x0 4', 'y = addi v1 1', 'z = addi v1 2']
+        """
+        cfg = Cfg(self.prog.get_insts())
+        copies_in = self.available_copies(cfg)
+        changed = False
+        for b in range(cfg.num_blocks):
+            available = copies_in[b]
+            local = {}
+
+            def lookup(reg):
+                if reg in local:
+                    return local[reg]
+                bits = available & self.by_dest.get(reg, 0)
+                if bits:
+                    return self.facts[bits.bit_length() - 1][1:]
+                return None
+
+            for i in cfg.block_insts(b):
+                inst = cfg.insts[i]
+                fact = copy_of(inst)
+                source = fact and lookup(fact[1])
+                if source:
+                    s, c = source
+                    inst = AsmModule.Addi(fact[0], s, c + fact[2])
+                    cfg.insts[i] = inst
+                    changed = True
+                else:
+                    renaming = {}
+                    for reg in inst.get_uses():
+                        source = lookup(reg)
+                        if source and source[1] == 0:
+                            renaming[reg] = source[0]
+                    if renaming:
+                        inst.rename_uses(renaming)
+                        changed = True
+                for reg in inst.get_defs():
+                    available &= ~self.mentions.get(reg, 0)
+                    local = {d: (s, c) for d, (s, c) in local.items()
+                             if d != reg and s != reg}
+                fact = copy_of(inst)
+                if fact:
+                    local[fact[0]] = fact[1:]
+        return changed
+
+    def apply_rules(self):
+        """
+        Applies the rules of the table RULES over the instructions of each
+        basic block. Returns True if the program changed. Tail calls are kept,
+        even if they jump to the next instruction: they separate the code of
+        the caller from the code of the callee.
+
+        Example:
+            >>> insts = [AsmModule.Addi("a", "b", 1),
+            ...          AsmModule.Addi("a", "a", 2),
+            ...          AsmModule.Jal("x0", 3), AsmModule.Add("c", "c", "x0")]
+            >>> p = AsmModule.Program(100, {}, insts)
+            >>> PeepholeOptimizer(p).apply_rules()
+            True
+            >>> [str(inst) for inst in p.get_insts()]
+            ['a = addi b 3']
+
+            >>> insts = [AsmModule.Jal("ra", 2), AsmModule.Jal("x0", 2),
+            ...          AsmModule.Jalr("x0", "ra")]
+            >>> p = AsmModule.Program(100, {}, insts)
+            >>> PeepholeOptimizer(p).apply_rules()
+            False
+        """
+        insts = self.prog.get_insts()
+        cfg = Cfg(insts)
+        functions = set(self.prog.get_symbols().values())
+        functions.update(inst.lab for inst in insts
+                         if isinstance(inst, AsmModule.La) or
+                         isinstance(inst, AsmModule.Jal) and is_call(inst))
+        expansions = [[inst] for inst in insts]
+        changed = False
+        i = 0
+        while i < len(insts):
+            if is_tail_call(insts[i], functions):
+                i += 1
+                continue
+            for size, rule in RULES:
+                window = insts[i:i + size]
+                if len(window) < size:
+                    continue
+                if cfg.block(i + size - 1) != cfg.block(i):
+                    continue
+                replacement = rule(window, i)
+                if replacement is not None:
+                    expansions[i] = replacement
+                    for j in range(i + 1, i + size):
+                        expansions[j] = []
+                    changed = True
+                    i += size - 1
+                    break
+            i += 1
+        if changed:
+            self.prog.rewrite(expansions)
+        return changed
+
+    def remove_dead_stores(self):
+        """
+        Removes the instructions that write registers that are not alive
+        afterwards. Returns True if the program changed.
+
+        Example:
+            >>> insts = [AsmModule.Addi("a", "x0", 1),
+            ...          AsmModule.Addi("b", "x0", 2),
+            ...          AsmModule.Add("c", "a", "a")]
+            >>> p = AsmModule.Program(100, {}, insts)
+            >>> PeepholeOptimizer(p, live_out=["c"]).remove_dead_stores()
+            True
+            >>> [str(inst) for inst in p.get_insts()]
+            ['a = addi x0 1', 'c = add a a']
+        """
+        insts = self.prog.get_insts()
+        cfg = Cfg(insts)
+        lv = Liveness(cfg, self.live_out)
+        expansions = [[inst] for inst in insts]
+        changed = False
+        for b in range(cfg.num_blocks):
+            for i, _, live_out in lv.walk(b):
+                inst = insts[i]
+                if is_removable(inst) and \
+                        not any(live_out >> k & 1 for k in lv.defs[i]):
+                    expansions[i] = []
+                    changed = True
+        if changed:
+            self.prog.rewrite(expansions)
+        return changed
+
+
+def peephole(prog, live_out=()):
+    """
+    Applies the peephole optimizations on the program prog, which is modified
+    in place. The registers in live_out are the results of the program.
+
+    Example:
+        >>> import Visitor
+        >>> from Expression import *
+        >>> e = Let('x', Num(2), IfThenElse(Lth(Var('x'), Num(3)),
+        ...                                 Add(Var('x'), Num(1)), Num(0)))
+        >>> p = AsmModule.Program(100, {}, [])
+        >>> v = e.accept(Visitor.GenVisitor(), p)
+        >>> n = p.get_number_of_instructions()
+        >>> peephole(p, live_out=[v])
+        >>> p.get_number_of_instructions() < n
+        True
+        >>> p.eval()
+        >>> p.get_val(v)
+        3
+    """
+    PeepholeOptimizer(prog, live_out).optimize()
@@ -0,0 +1,319 @@
+"""
+This file contains a register allocator for the programs produced by the
+GenVisitor. The code generator creates a new virtual register for every
+intermediate value; the allocator maps these virtual registers onto a fixed
+number of physical registers, using the linear scan algorithm of Poletto and
+Sarkar. When the registers are not enough, some virtual registers are spilled
+into memory, and are accessed via loads and stores relative to sp.
+
+The registers x0, sp, ra, a0 and a1 have special meaning in the calling
+convention of the GenVisitor, and are never renamed. Registers that are read,
+but never written (the inputs of the program) are not renamed either.
+
+This file uses doctests all over. To test it, just run python 3 as follows:
+"python3 -m doctest RegAlloc.py".
+"""
+
+import Asm as AsmModule
+from Cfg import Cfg, Frames, Liveness, is_return, is_tail_call
+
+RESERVED = ["x0", "sp", "ra", "a0", "a1"]
+
+
+def is_rematerializable(inst):
+    """
+    Tells if inst loads a constant into a register. If such an instruction is
+    the only definition of a register, then the register does not need to be
+    stored in memory when spilled: the instruction can be repeated instead.
+
+    Example:
+        >>> is_rematerializable(AsmModule.Addi("a", "x0", 3))
+        True
+        >>> is_rematerializable(AsmModule.Addi("a", "b", 3))
+        False
+    """
+    if isinstance(inst, AsmModule.Addi):
+        return inst.rs1 == "x0"
+    return isinstance(inst, AsmModule.La)
+
+
+def rematerialize(inst, rd):
+    """
+    Returns a copy of the constant load inst that writes register rd.
+    """
+    if isinstance(inst, AsmModule.La):
+        return AsmModule.La(rd, inst.lab)
+    return AsmModule.Addi(rd, "x0", inst.imm)
+
+
+class LinearScanAllocator:
+    """
+    This class maps the virtual registers of a program onto num_regs physical
+    registers. Each virtual register has a live interval: the range between
+    the first and the last position where it is alive, or written. Positions
+    2*i and 2*i+1 denote the points where instruction i reads and writes its
+    registers. Intervals that overlap get different physical registers.
+
+    If the physical registers are not enough, then two of them are set apart
+    as scratch registers, and virtual registers are spilled to a frame that
+    each function allocates on the stack when it starts. Spilled registers
+    are loaded into the scratch registers before each use, and stored back
+    into the frame after each definition. Registers shared between functions
+    are spilled into static slots instead, which are reserved in the static
+    data, below the heap. Registers that only hold constants are never
+    stored: they are preferred for spilling, and the instruction that loads
+    the constant is repeated before each use. Registers that are alive at the
+    end of the program are never spilled.
+    """
+
+    def __init__(self, prog, num_regs=16, live_out=()):
+        self.prog = prog
+        self.num_regs = num_regs
+        self.live_out = list(live_out)
+        self.mapping = {}
+        self.spilled = {}
+        self.scratch = None
+
+    def allocate(self):
+        """
+        Allocates registers and rewrites the program. Returns the dictionary
+        that maps each virtual register to its physical register.
+
+        Example:
+            >>> insts = [AsmModule.Addi("v1", "x0", 2),
+            ...          AsmModule.Addi("v2", "x0", 3),
+            ...          AsmModule.Add("v3", "v1", "v2"),
+            ...          AsmModule.Add("v4", "v3", "v3")]
+            >>> p = AsmModule.Program(100, {}, insts)
+            >>> allocator = LinearScanAllocator(p, num_regs=2, live_out=["v4"])
+            >>> m = allocator.allocate()
+            >>> sorted(set(m.values()))
+            ['r1', 'r2']
+            >>> p.eval()
+            >>> p.get_val(m["v4"])
+            10
+        """
+        insts = self.prog.get_insts()
+        self.cfg = Cfg(insts)
+        self.liveness = Liveness(self.cfg, self.live_out, ignore=RESERVED)
+        self.frames = Frames(insts, self.prog.get_symbols().values())
+        self.intervals = self.build_intervals()
+        taken = set(self.liveness.names) | set(RESERVED)
+        registers = self.fresh_registers(self.num_regs, taken)
+        if not self.scan(registers):
+            if self.num_regs < 3:
+                raise ValueError("not enough registers to spill")
+            self.scratch = registers[-2:]
+            if not self.scan(registers[:-2]):
+                raise ValueError("not enough registers to allocate program")
+            self.prog.rewrite(self.spill_code(insts))
+        else:
+            for inst in insts:
+                inst.rename(self.mapping)
+        return self.mapping
+
+    @staticmethod
+    def fresh_registers(k, taken):
+        registers = []
+        counter = 0
+        while len(registers) < k:
+            counter += 1
+            name = f"r{counter}"
+            if name not in taken:
+                registers.append(name)
+        return registers
+
+    def build_intervals(self):
+        """
+        Returns a dictionary that maps each register, except the inputs of the
+        program, to its live interval. Inputs are the registers that might be
+        alive at the start of the program, and that are never written.
+        """
+        lv, cfg = self.liveness, self.cfg
+        inputs = lv.block_live_in[cfg.entry()]
+        self.occurrences = [[] for _ in lv.names]
+        for i in range(len(cfg.insts)):
+            for k in lv.uses[i] + lv.defs[i]:
+                self.occurrences[k].append(i)
+            for k in lv.defs[i]:
+                inputs &= ~(1 << k)
+        self.inputs = lv.set_of(inputs)
+        self.remat = {}
+        for k, occurrences in enumerate(self.occurrences):
+            defs = [i for i in occurrences if k in lv.defs[i]]
+            if len(defs) == 1 and is_rematerializable(cfg.insts[defs[0]]):
+                self.remat[lv.names[k]] = cfg.insts[defs[0]]
+        start, end = {}, {}
+
+        def extend(k, pos):
+            if inputs >> k & 1:
+                return
+            if k not in start or pos < start[k]:
+                start[k] = pos
+            if k not in end or pos > end[k]:
+                end[k] = pos
+
+        def extend_all(bits, pos):
+            while bits:
+                low = bits & -bits
+                extend(low.bit_length() - 1, pos)
+                bits ^= low
+
+        for b in range(cfg.num_blocks):
+            first, last = cfg.starts[b], cfg.ends[b] - 1
+            extend_all(lv.block_live_in[b], 2 * first)
+            extend_all(lv.block_live_out[b], 2 * last + 1)
+            for i in cfg.block_insts(b):
+                for k in lv.uses[i]:
+                    extend(k, 2 * i)
+                for k in lv.defs[i]:
+                    extend(k, 2 * i + 1)
+        return {lv.names[k]: (start[k], end[k]) for k in start}
+
+    def spillable(self, reg):
+        """
+        Tells if reg can be kept in memory: registers that are alive at the
+        end of the program must stay in registers.
+        """
+        lv = self.liveness
+        return not lv.exit_live() & (1 << lv.index[reg])
+
+    def spill_context(self, reg):
+        """
+        Returns the context whose frame will hold reg, or None, if reg must be
+        stored in a static slot, which is addressed from x0. Only registers
+        that are used within a single context, where the depth of the stack
+        is known, and that do not flow into that context from elsewhere, can
+        be stored in the frame.
+        """
+        lv, fr = self.liveness, self.frames
+        k = lv.index[reg]
+        contexts = set()
+        for i in self.occurrences[k]:
+            if fr.depth[i] is None:
+                return None
+            contexts.add(fr.context[i])
+        if len(contexts) != 1:
+            return None
+        context = contexts.pop()
+        if lv.block_live_in[self.cfg.block(context)] >> k & 1:
+            return None
+        return context
+
+    def scan(self, registers):
+        """
+        The linear scan proper. Returns False if some register had to be
+        spilled, but there are no scratch registers available.
+        """
+        self.mapping = {}
+        self.spilled = {}
+        free = list(reversed(registers))
+        active = []
+        order = sorted(self.intervals, key=lambda r: self.intervals[r][0])
+        for reg in order:
+            start, end = self.intervals[reg]
+            for other in list(active):
+                if self.intervals[other][1] < start:
+                    active.remove(other)
+                    free.append(self.mapping[other])
+            if free:
+                self.mapping[reg] = free.pop()
+                active.append(reg)
+                continue
+            if self.scratch is None:
+                return False
+            candidates = [r for r in active + [reg] if self.spillable(r)]
+            if not candidates:
+                raise ValueError("not enough registers to allocate program")
+            victim = max(candidates,
+                         key=lambda r: (r in self.remat, self.intervals[r][1]))
+            if victim != reg:
+                self.mapping[reg] = self.mapping.pop(victim)
+                active.remove(victim)
+                active.append(reg)
+            self.spilled[victim] = None
+        slots = {}
+        for reg in self.spilled:
+            if reg in self.remat:
+                continue
+            context = self.spill_context(reg)
+            offset = 4 * slots.get(context, 0)
+            slots[context] = slots.get(context, 0) + 1
+            self.spilled[reg] = (context, offset)
+        if None in slots:
+            base = self.prog.add_static(4 * slots[None])
+            for reg, slot in self.spilled.items():
+                if slot is not None and slot[0] is None:
+                    self.spilled[reg] = (None, base + slot[1])
+        return True
+
+    def spill_code(self, insts):
+        fr = self.frames
+        frame_size = {}
+        for reg, slot in self.spilled.items():
+            if reg not in self.remat and slot[0] is not None:
+                frame_size[slot[0]] = frame_size.get(slot[0], 0) + 4
+        expansions = []
+        for i, inst in enumerate(insts):
+            before, release, after = [], [], []
+            if i in frame_size:
+                before.append(AsmModule.Addi("sp", "sp", -frame_size[i]))
+            context = fr.context[i]
+            leaves = is_return(inst) or is_tail_call(inst, fr.functions)
+            if leaves and context in frame_size and context != 0:
+                release.append(AsmModule.Addi("sp", "sp", frame_size[context]))
+            if any(reg in self.spilled and reg in self.remat
+                   for reg in inst.get_defs()):
+                expansions.append(before)
+                continue
+            renaming = dict(self.mapping)
+            scratch = list(self.scratch)
+            for reg in inst.get_uses():
+                if reg in self.spilled and reg not in renaming:
+                    renaming[reg] = scratch.pop(0)
+                    if reg in self.remat:
+                        before.append(rematerialize(self.remat[reg],
+                                                    renaming[reg]))
+                        continue
+                    base, offset = self.address(reg, i)
+                    before.append(AsmModule.Lw(base, offset, renaming[reg]))
+            for reg in inst.get_defs():
+                if reg in self.spilled:
+                    renaming.setdefault(reg, self.scratch[0])
+                    base, offset = self.address(reg, i)
+                    after.append(AsmModule.Sw(base, offset, renaming[reg]))
+            inst.rename(renaming)
+            expansions.append(before + release + [inst] + after)
+        return expansions
+
+    def address(self, reg, i):
+        """
+        Returns the base register and the offset of the memory slot of the
+        spilled register reg, as seen by the i-th instruction.
+        """
+        context, offset = self.spilled[reg]
+        if context is None:
+            return "x0", offset
+        return "sp", offset - self.frames.depth[i]
+
+
+def allocate_registers(prog, num_regs=16, live_out=()):
+    """
+    Allocates the registers of the program prog, which is rewritten in place.
+    The registers in live_out are the results of the program: they are kept
+    in physical registers at the end of the execution. Returns the dictionary
+    that maps virtual registers to physical registers.
+
+    Example:
+        >>> import Visitor
+        >>> from Expression import *
+        >>> e = Let('f', Fn('x', Add(Var('x'), Num(1))),
+        ...         Add(App(Var('f'), Num(2)), App(Var('f'), Num(3))))
+        >>> p = AsmModule.Program(1000, {}, [])
+        >>> v = e.accept(Visitor.GenVisitor(), p)
+        >>> m = allocate_registers(p, num_regs=3, live_out=[v])
+        >>> p.eval()
+        >>> p.get_val(m.get(v, v))
+        7
+    """
+    return LinearScanAllocator(prog, num_regs, live_out).allocate()
@@ -0,0 +1,379 @@
+"""
+This file implements sparse conditional constant propagation for Asm
+programs. The analysis runs over the control flow graph of Cfg.py, starting
+from its entry, and only visits the blocks that might run: the branches whose
+operands are constants follow a single edge. Values flow sparsely, from each
+definition to the instructions that it reaches. The value of a definition is
+an element of a lattice with three levels:
+
+* Unknown (None): the definition has not been found to run yet.
+* A constant: every run of the definition writes the same value.
+* VARYING: the definition might write different values.
+
+Only arithmetic instructions produce constants. Memory reads, allocations,
+addresses of functions and calls produce values that vary. Registers are
+global, so the values flow from calls into the entries of functions, and
+from returns back to the instructions that follow calls. The values that the
+registers hold when the program starts, such as sp, vary.
+
+Once the analysis is done, the pass rewrites the program:
+
+* Instructions whose results are constants become 'addi rd x0 c'.
+* Operands that are constants become immediates, when the instruction has a
+  form with an immediate, and operands that are zero become x0.
+* Branches whose outcome is known become jumps, or are removed.
+
+The code that no longer runs is left in place, for the jump threader of
+Jumps.py removes it. Divisions by zero are never folded, so that they still
+trap.
+
+This file uses doctests all over. To test it, just run python 3 as follows:
+"python3 -m doctest Sccp.py".
+"""
+
+import copy
+
+import Asm as AsmModule
+from Cfg import Cfg, ReachingDefinitions, is_jump
+
+
+class Varying:
+    """
+    The bottom of the lattice: the value of a register that is not constant.
+    """
+
+    def __repr__(self):
+        return "VARYING"
+
+
+VARYING = Varying()
+
+"""
+The instructions whose second operand can be an immediate: each one maps to
+the instruction with the immediate, and to the function that gives the
+immediate from the value of the operand.
+"""
+IMMEDIATE_FORMS = {
+    AsmModule.Add: (AsmModule.Addi, lambda c: c),
+    AsmModule.Sub: (AsmModule.Addi, lambda c: -c),
+    AsmModule.Xor: (AsmModule.Xori, lambda c: c),
+    AsmModule.Slt: (AsmModule.Slti, lambda c: c),
+    AsmModule.Sltu: (AsmModule.Sltiu, lambda c: c),
+}
+
+"""
+The instructions whose operands can be swapped.
+"""
+COMMUTATIVE = (AsmModule.Add, AsmModule.Xor)
+
+
+class Registers(dict):
+    """
+    The registers of the scratch machine where evaluate runs instructions.
+    Arithmetic instructions only read and write registers, so they do not
+    need a whole Program.
+    """
+
+    def get_val(self, name):
+        return 0 if name == "x0" else self[name]
+
+    def set_val(self, name, value):
+        if name != "x0":
+            self[name] = value
+
+
+def evaluate(inst, values):
+    """
+    Computes the value that the arithmetic instruction inst writes, given the
+    values of its operands, by running the instruction. Returns None if some
+    operand is unknown, and VARYING if some operand varies, or if the
+    instruction traps, or if it is not an arithmetic instruction.
+
+    Example:
+        >>> evaluate(AsmModule.Slt("a", "b", "c"), {"b": 2, "c": 3})
+        1
+        >>> evaluate(AsmModule.Div("a", "b", "x0"), {"b": 2})
+        VARYING
+        >>> evaluate(AsmModule.Addi("a", "b", 1), {}) is None
+        True
+    """
+    if not isinstance(inst, (AsmModule.BinOp, AsmModule.BinOpImm)):
+        return VARYING
+    regs = Registers()
+    for reg in inst.get_uses():
+        if reg != "x0":
+            value = values.get(reg)
+            if value is None or value is VARYING:
+                return value
+            regs[reg] = value
+    try:
+        inst.eval(regs)
+    except (ZeroDivisionError, ValueError):
+        return VARYING
+    return regs.get_val(inst.rd)
+
+
+def meet(a, b):
+    """
+    Joins two values of the lattice, where None stands for unknown.
+
+    Example:
+        >>> meet(None, 3), meet(3, 3), meet(3, 4)
+        (3, 3, VARYING)
+    """
+    if a is None:
+        return b
+    if b is None or a == b:
+        return a
+    return VARYING
+
+
+class ConditionalConstants:
+    """
+    This class computes the constants of a program. The value of each
+    definition flows to the instructions that it reaches, and only the
+    definitions in blocks that might run count. value[i] is the value that
+    instruction i writes, if it might run, and executable[b] tells if node b
+    might run.
+
+    Operands that the same set of definitions reaches share a merge point,
+    which holds the meet of the values of these definitions, as the phi
+    functions of the SSA form do. The value of a merge point only goes down
+    the lattice, so it is updated with the new value of a definition alone,
+    and its readers are visited again only when it changes. Merge points
+    that vary never change again.
+
+    Example:
+        >>> insts = [AsmModule.Addi("a", "x0", 1),
+        ...          AsmModule.Beq("a", "x0", 4),
+        ...          AsmModule.Addi("b", "a", 2),
+        ...          AsmModule.Jal("x0", 5),
+        ...          AsmModule.Addi("b", "x0", 7),
+        ...          AsmModule.Add("c", "b", "b")]
+        >>> cc = ConditionalConstants(Cfg(insts))
+        >>> [cc.executable[cc.cfg.block(i)] for i in range(6)]
+        [True, True, True, True, False, True]
+        >>> cc.operands(5), cc.value[5]
+        ({'b': 3}, 6)
+    """
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.executable = [False] * len(cfg.succs)
+        self.value = {}
+        self.find_sources()
+        self.solve()
+
+    def find_sources(self):
+        """
+        Computes the merge point of each operand of each instruction, the
+        merge points that each definition reaches, and the instructions that
+        read each merge point. The values that registers hold when the
+        program starts vary.
+        """
+        cfg = self.cfg
+        rd = ReachingDefinitions(cfg, initial=True)
+        for d in rd.definitions(rd.initial):
+            self.value[d] = VARYING
+        self.sources = [{} for _ in cfg.insts]
+        self.merged = []
+        self.readers = []
+        self.merges_of = {}
+        points = {}
+        for b in range(cfg.num_blocks):
+            reaching = rd.block_in[b]
+            for i in cfg.block_insts(b):
+                for reg in cfg.insts[i].get_uses():
+                    if reg == "x0":
+                        continue
+                    defs = reaching & rd.defs_of.get(reg, 0)
+                    key = (reg, defs)
+                    if key not in points:
+                        points[key] = self.merge_point(
+                            None if defs & rd.initial else
+                            rd.definitions(defs))
+                    p = points[key]
+                    self.sources[i][reg] = p
+                    self.readers[p].append(i)
+                reaching = rd.transfer(i, reaching)
+
+    def merge_point(self, defs):
+        """
+        Creates a merge point for the list of definitions defs, and returns
+        its index. If defs is None, the point varies, and its definitions do
+        not matter.
+        """
+        p = len(self.merged)
+        self.readers.append([])
+        if defs is None:
+            self.merged.append(VARYING)
+        else:
+            self.merged.append(None)
+            for d in defs:
+                self.merges_of.setdefault(d, []).append(p)
+        return p
+
+    def operands(self, i):
+        """
+        Returns a dictionary with the values of the operands of instruction
+        i. Unknown operands are absent.
+        """
+        return {reg: self.merged[p] for reg, p in self.sources[i].items()
+                if self.merged[p] is not None}
+
+    def successors(self, b, values):
+        """
+        Returns the successors of node b that might run after it, given the
+        values of the operands of its last instruction.
+        """
+        cfg = self.cfg
+        if b >= cfg.num_blocks:
+            return cfg.succs[b]
+        last = cfg.ends[b] - 1
+        inst = cfg.insts[last]
+        if not isinstance(inst, AsmModule.CondBranch):
+            return cfg.succs[b]
+        a, c = (0 if reg == "x0" else values.get(reg)
+                for reg in inst.get_uses())
+        if a is None or c is None:
+            return []
+        if a is VARYING or c is VARYING:
+            return cfg.succs[b]
+        if inst.holds(a, c):
+            return [cfg.block(inst.lab)]
+        return [cfg.block(last + 1)]
+
+    def solve(self):
+        """
+        Runs the two worklists of the algorithm: nodes that start to run, and
+        instructions whose operands changed.
+        """
+        cfg = self.cfg
+        nodes, insts = [cfg.entry()], []
+        while nodes or insts:
+            if nodes:
+                b = nodes.pop()
+                if self.executable[b]:
+                    continue
+                self.executable[b] = True
+                if b >= cfg.num_blocks:
+                    nodes.extend(cfg.succs[b])
+                insts.extend(cfg.block_insts(b))
+                continue
+            i = insts.pop()
+            b = cfg.block(i)
+            if not self.executable[b]:
+                continue
+            values = self.operands(i)
+            if i == cfg.ends[b] - 1:
+                nodes.extend(s for s in self.successors(b, values)
+                             if not self.executable[s])
+            old = self.value.get(i)
+            if old is VARYING or not cfg.insts[i].get_defs():
+                continue
+            new = meet(old, evaluate(cfg.insts[i], values))
+            if new != old:
+                self.value[i] = new
+                self.propagate(new, self.merges_of.get(i, ()), insts)
+
+    def propagate(self, value, points, insts):
+        """
+        Lowers the merge points to the new value of one of their definitions,
+        and adds the readers of the merge points that change to insts.
+        """
+        merged = self.merged
+        for p in points:
+            old = merged[p]
+            if old is VARYING:
+                continue
+            new = meet(old, value)
+            if new != old:
+                merged[p] = new
+                insts.extend(self.readers[p])
+
+
+def constant_of(reg, values):
+    """
+    Returns the constant in register reg, or None if it is not constant.
+    """
+    value = 0 if reg == "x0" else values.get(reg)
+    return None if value is None or value is VARYING else value
+
+
+def simplify(inst, operands, result):
+    """
+    Returns the instructions that replace inst, given the values of its
+    operands and of its result, or None if inst does not change.
+
+    Example:
+        >>> [str(i) for i in simplify(AsmModule.Sub("a", "b", "c"),
+        ...                           {"b": VARYING, "c": 2}, VARYING)]
+        ['a = addi b -2']
+        >>> simplify(AsmModule.Bge("b", "c", 7), {"b": 2, "c": 1}, None)[0].lab
+        7
+        >>> [str(i) for i in simplify(AsmModule.Sw("p", 0, "c"),
+        ...                           {"p": VARYING, "c": 0}, None)]
+        ['sw x0, 0(p)']
+    """
+    if isinstance(inst, AsmModule.CondBranch):
+        a, b = (constant_of(reg, operands) for reg in inst.get_uses())
+        if a is not None and b is not None:
+            return [AsmModule.Jal("x0", inst.lab)] if inst.holds(a, b) else []
+    if isinstance(inst, (AsmModule.BinOp, AsmModule.BinOpImm)):
+        if inst.rd != "x0" and result is not None and result is not VARYING:
+            if isinstance(inst, AsmModule.Addi) and inst.rs1 == "x0":
+                return None
+            return [AsmModule.Addi(inst.rd, "x0", result)]
+    if type(inst) in IMMEDIATE_FORMS:
+        form, immediate = IMMEDIATE_FORMS[type(inst)]
+        rs1, rs2 = inst.rs1, inst.rs2
+        if constant_of(rs2, operands) is None and \
+                isinstance(inst, COMMUTATIVE):
+            rs1, rs2 = rs2, rs1
+        c = constant_of(rs2, operands)
+        if c is not None and rs2 != "x0":
+            return [form(inst.rd, rs1, immediate(c))]
+    if is_jump(inst):
+        return None
+    zeros = {reg: "x0" for reg in inst.get_uses()
+             if reg != "x0" and constant_of(reg, operands) == 0}
+    if zeros:
+        inst = copy.copy(inst)
+        inst.rename_uses(zeros)
+        return [inst]
+    return None
+
+
+def propagate_constants(prog):
+    """
+    Propagates the constants of the program prog, which is modified in
+    place. Returns the number of instructions that changed.
+
+    Example:
+        >>> import Visitor
+        >>> from Expression import *
+        >>> e = Let('x', Num(2), IfThenElse(Or(Lth(Var('x'), Num(1)),
+        ...         Eql(Var('x'), Num(2))), Add(Var('x'), Num(3)), Num(0)))
+        >>> p = AsmModule.Program(100, {}, [])
+        >>> v = e.accept(Visitor.GenVisitor(), p)
+        >>> propagate_constants(p) > 0
+        True
+        >>> any(isinstance(i, AsmModule.CondBranch) for i in p.get_insts())
+        False
+        >>> p.eval()
+        >>> p.get_val(v)
+        5
+    """
+    insts = prog.get_insts()
+    cc = ConditionalConstants(Cfg(insts))
+    expansions = [[inst] for inst in insts]
+    changed = 0
+    for i, inst in enumerate(insts):
+        if cc.executable[cc.cfg.block(i)]:
+            replacement = simplify(inst, cc.operands(i), cc.value.get(i))
+            if replacement is not None:
+                expansions[i] = replacement
+                changed += 1
+    if changed:
+        prog.rewrite(expansions)
+    return changed
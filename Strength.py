@@ -0,0 +1,356 @@
+"""
+This file contains a strength-reduction pass for Asm programs. Multiplications,
+divisions and remainders by constants are replaced with sequences of shifts,
+additions and subtractions, or, for divisions by constants that are not powers
+of two, with a multiplication by a "magic number". The replacement preserves
+the semantics of the 'div' and 'rem' instructions, which round towards minus
+infinity. Divisions and remainders by zero are never replaced, so that they
+still trap.
+
+A sequence replaces an instruction only if it is cheaper, according to a cost
+model. Two models are available:
+
+* INTERPRETER: every instruction costs the same, as the time spent by the
+  interpreter is dominated by the dispatch of each instruction. Only rewrites
+  that produce fewer instructions are applied.
+* NATIVE: the costs of a processor with a slow multiplier and a much slower
+  divider. This model assumes that values fit in XLEN-bit words, and only
+  under this assumption are magic-number divisions exact.
+
+Constants are registers with a single definition, of the form 'addi r x0 c',
+that dominates the instruction that reads them, as produced by GenVisitor.
+
+This file uses doctests all over. To test it, just run python 3 as follows:
+"python3 -m doctest Strength.py".
+"""
+
+import Asm as AsmModule
+from Cfg import Cfg, dominates
+from Peephole import copy_of
+
+
+class CostModel:
+    """
+    Estimates the cost of running instructions. The cost of an instruction is
+    given by the dictionary costs, indexed by opcode, and is 1 for opcodes
+    that are not in it. Copies cost nothing, because copy propagation removes
+    them. If word_bits is not None, values are assumed to fit in words with
+    that many bits.
+
+    Example:
+        >>> NATIVE.cost(AsmModule.Mul("a", "b", "c"))
+        3
+        >>> INTERPRETER.cost(AsmModule.Mul("a", "b", "c"))
+        1
+        >>> NATIVE.cost(AsmModule.Addi("a", "b", 0))
+        0
+    """
+
+    def __init__(self, costs, word_bits=None):
+        self.costs = costs
+        self.word_bits = word_bits
+
+    def cost(self, inst):
+        fact = copy_of(inst)
+        if fact is not None and fact[2] == 0:
+            return 0
+        return self.costs.get(inst.get_opcode(), 1)
+
+    def sequence_cost(self, insts):
+        return sum(self.cost(inst) for inst in insts)
+
+
+INTERPRETER = CostModel({})
+
+NATIVE = CostModel({"mul": 3, "div": 20, "rem": 20},
+                   word_bits=AsmModule.XLEN)
+
+
+def log2(c):
+    """
+    Returns k if c is 2**k, and None otherwise.
+
+    Example:
+        >>> log2(8), log2(1), log2(6), log2(-4)
+        (3, 0, None, None)
+    """
+    if c > 0 and c & (c - 1) == 0:
+        return c.bit_length() - 1
+    return None
+
+
+def signed_digits(c):
+    """
+    Returns the non-adjacent form of c: a list of pairs (sign, k), such that c
+    is the sum of the terms sign * 2**k, and no two terms have consecutive
+    exponents. This form has the least number of terms.
+
+    Example:
+        >>> signed_digits(7)
+        [(-1, 0), (1, 3)]
+        >>> signed_digits(10)
+        [(1, 1), (1, 3)]
+        >>> signed_digits(-3)
+        [(1, 0), (-1, 2)]
+    """
+    digits = []
+    k = 0
+    while c != 0:
+        if c & 1:
+            sign = 2 - (c & 3)
+            digits.append((sign, k))
+            c -= sign
+        c >>= 1
+        k += 1
+    return digits
+
+
+def multiply(rd, rs, c, temp):
+    """
+    Returns a sequence of shifts, additions and subtractions that computes
+    rd = rs * c. The function temp returns the name of a new register; only
+    the last instruction writes rd, so rd may be equal to rs.
+
+    Example:
+        >>> names = iter(["t1", "t2", "t3", "t4", "t5"])
+        >>> [str(i) for i in multiply("a", "b", 7, lambda: next(names))]
+        ['t1 = slli b 3', 'a = sub t1 b']
+        >>> insts = multiply("a", "b", -5, lambda: next(names))
+        >>> p = AsmModule.Program(0, {"b": 3}, insts)
+        >>> p.eval()
+        >>> p.get_val("a")
+        -15
+    """
+    if c == 0:
+        return [AsmModule.Addi(rd, "x0", 0)]
+    digits = sorted(signed_digits(c), key=lambda digit: -digit[0])
+    if digits[0][0] < 0:
+        name = temp()
+        return multiply(name, rs, -c, temp) + [AsmModule.Sub(rd, "x0", name)]
+    insts = []
+
+    def shifted(k):
+        if k == 0:
+            return rs
+        name = temp()
+        insts.append(AsmModule.Slli(name, rs, k))
+        return name
+
+    acc = shifted(digits[0][1])
+    for sign, k in digits[1:]:
+        term = shifted(k)
+        name = temp()
+        if sign > 0:
+            insts.append(AsmModule.Add(name, acc, term))
+        else:
+            insts.append(AsmModule.Sub(name, acc, term))
+        acc = name
+    if insts:
+        insts[-1].rd = rd
+    else:
+        insts.append(AsmModule.Addi(rd, rs, 0))
+    return insts
+
+
+def divide(rd, rs, c, temp, word_bits=None):
+    """
+    Returns a sequence of instructions that computes rd = rs div c, rounding
+    towards minus infinity, without a 'div', or None if there is no such
+    sequence. Divisions by powers of two are arithmetic shifts. Divisions by
+    other constants multiply by a magic number, which is only exact if rs
+    fits in a word with word_bits bits; thus, they are only produced if
+    word_bits is given. The constant c is never zero.
+
+    Example:
+        >>> names = iter(["t1", "t2", "t3", "t4", "t5", "t6"])
+        >>> [str(i) for i in divide("a", "b", 4, lambda: next(names))]
+        ['a = srai b 2']
+        >>> divide("a", "b", 7, lambda: next(names)) is None
+        True
+        >>> insts = divide("a", "b", -7, lambda: next(names), word_bits=64)
+        >>> results = []
+        >>> for b in [-15, -14, -1, 0, 13, 14, 2**62]:
+        ...     p = AsmModule.Program(0, {"b": b}, insts)
+        ...     p.eval()
+        ...     results.append(p.get_val("a") == b // -7)
+        >>> all(results)
+        True
+    """
+    insts = []
+    if c < 0:
+        negated = temp()
+        insts.append(AsmModule.Sub(negated, "x0", rs))
+        rs, c = negated, -c
+    k = log2(c)
+    if k is not None:
+        if k == 0:
+            insts.append(AsmModule.Addi(rd, rs, 0))
+        else:
+            insts.append(AsmModule.Srai(rd, rs, k))
+        return insts
+    if word_bits is None:
+        return None
+    # For y >= 0, y div c = (y * m) >> s. For negative values, x div c is
+    # equal to ~(~x div c), where ~x = x ^ -1 is not negative. The register
+    # sign is -1 for negative values, and 0 otherwise.
+    s = word_bits - 1 + (c - 1).bit_length()
+    m = (1 << s) // c + 1
+    sign, y, magic, product, quotient = [temp() for _ in range(5)]
+    insts.append(AsmModule.Srai(sign, rs, word_bits - 1))
+    insts.append(AsmModule.Xor(y, rs, sign))
+    insts.append(AsmModule.Addi(magic, "x0", m))
+    insts.append(AsmModule.Mul(product, y, magic))
+    insts.append(AsmModule.Srai(quotient, product, s))
+    insts.append(AsmModule.Xor(rd, quotient, sign))
+    return insts
+
+
+class StrengthReducer:
+    """
+    This class replaces the multiplications, divisions and remainders by
+    constants of a program, whenever the cost model finds the replacement
+    cheaper.
+
+    Example:
+        >>> insts = [AsmModule.Addi("c", "x0", 8),
+        ...          AsmModule.Mul("a", "x", "c"),
+        ...          AsmModule.Addi("d", "x0", 3),
+        ...          AsmModule.Div("b", "a", "d")]
+        >>> p = AsmModule.Program(100, {"x": -3}, insts)
+        >>> StrengthReducer(p, NATIVE).reduce()
+        2
+        >>> [str(inst) for inst in p.get_insts()][1]
+        'a = slli x 3'
+        >>> p.eval()
+        >>> p.get_val("b")
+        -8
+    """
+
+    def __init__(self, prog, model=INTERPRETER):
+        self.prog = prog
+        self.model = model
+        self.counter = 0
+
+    def temp(self):
+        while True:
+            self.counter += 1
+            name = f"sr{self.counter}"
+            if name not in self.names:
+                return name
+
+    def find_constants(self, cfg):
+        """
+        Finds the registers that have a single definition, and that this
+        definition loads a constant. Returns a dictionary that maps each such
+        register to a pair (value, index of the definition).
+        """
+        defs = {}
+        for i, inst in enumerate(cfg.insts):
+            for reg in inst.get_defs():
+                defs[reg] = None if reg in defs else i
+        constants = {"x0": (0, None)}
+        for reg, i in defs.items():
+            inst = i is not None and cfg.insts[i]
+            if isinstance(inst, AsmModule.Addi) and inst.rs1 == "x0" \
+                    and reg != "x0":
+                constants[reg] = (inst.imm, i)
+        return constants
+
+    def constant(self, reg, i):
+        """
+        Returns the value of register reg at instruction i, if it is a
+        constant, and None otherwise.
+        """
+        if reg not in self.constants:
+            return None
+        value, d = self.constants[reg]
+        if d is not None:
+            block_d, block_i = self.cfg.block(d), self.cfg.block(i)
+            if block_d == block_i:
+                if d >= i:
+                    return None
+            elif not dominates(self.idom, block_d, block_i):
+                return None
+        return value
+
+    def replacement(self, inst, i):
+        """
+        Returns the cheapest sequence of instructions that does what inst
+        does, or None if no sequence is cheaper than inst.
+        """
+        options = []
+        if isinstance(inst, AsmModule.Mul):
+            for rs, other in [(inst.rs1, inst.rs2), (inst.rs2, inst.rs1)]:
+                c = self.constant(other, i)
+                if c is not None:
+                    options.append(multiply(inst.rd, rs, c, self.temp))
+        elif isinstance(inst, (AsmModule.Div, AsmModule.Rem)):
+            c = self.constant(inst.rs2, i)
+            if c is not None and c != 0:
+                options.append(self.divide(inst, c))
+        options = [o for o in options if o is not None]
+        if not options:
+            return None
+        best = min(options, key=self.model.sequence_cost)
+        if self.model.sequence_cost(best) < self.model.cost(inst):
+            return best
+        return None
+
+    def divide(self, inst, c):
+        word_bits = self.model.word_bits
+        if isinstance(inst, AsmModule.Div):
+            return divide(inst.rd, inst.rs1, c, self.temp, word_bits)
+        # rs1 rem c = rs1 - (rs1 div c) * c.
+        quotient, product = self.temp(), self.temp()
+        insts = divide(quotient, inst.rs1, c, self.temp, word_bits)
+        if insts is None:
+            return None
+        times = min([multiply(product, quotient, c, self.temp),
+                     [AsmModule.Mul(product, quotient, inst.rs2)]],
+                    key=self.model.sequence_cost)
+        return insts + times + [AsmModule.Sub(inst.rd, inst.rs1, product)]
+
+    def reduce(self):
+        """
+        Rewrites the program, and returns the number of instructions that
+        were replaced.
+        """
+        insts = self.prog.get_insts()
+        self.cfg = Cfg(insts)
+        self.idom = self.cfg.dominators()
+        self.constants = self.find_constants(self.cfg)
+        self.names = {reg for inst in insts
+                      for reg in inst.get_uses() + inst.get_defs()}
+        expansions = [[inst] for inst in insts]
+        count = 0
+        for i, inst in enumerate(insts):
+            if isinstance(inst, (AsmModule.Mul, AsmModule.Div, AsmModule.Rem)):
+                replacement = self.replacement(inst, i)
+                if replacement is not None:
+                    expansions[i] = replacement
+                    count += 1
+        if count:
+            self.prog.rewrite(expansions)
+        return count
+
+
+def reduce_strength(prog, model=INTERPRETER):
+    """
+    Applies strength reduction on the program prog, which is modified in
+    place, using the cost model model. The constant loads that are no longer
+    needed can be removed afterwards by the peephole optimizer.
+
+    Example:
+        >>> import Visitor
+        >>> from Expression import *
+        >>> e = Add(Mul(Var('x'), Num(5)), Mod(Var('x'), Num(4)))
+        >>> p = AsmModule.Program(100, {"x": -7}, [])
+        >>> v = e.accept(Visitor.GenVisitor(), p)
+        >>> reduce_strength(p, NATIVE)
+        >>> sorted({inst.get_opcode() for inst in p.get_insts()})
+        ['add', 'addi', 'slli', 'srai', 'sub']
+        >>> p.eval()
+        >>> p.get_val(v)
+        -34
+    """
+    StrengthReducer(prog, model).reduce()
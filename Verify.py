@@ -0,0 +1,275 @@
+"""
+This file contains a verifier for Asm programs. The interpreter checks, on
+every read, that the register has a value, and, on every write, that the
+register is not x0, because it cannot assume that programs are well formed.
+The verifier proves these facts once, before the program runs:
+
+* Every label points into the program, or to its end, where it stops.
+* No instruction writes x0, but the jumps, which never do.
+* sp is only changed by 'addi sp sp c'. Its offset from the entry of each
+  function is statically known, and is zero when the function returns, or
+  jumps to another function in a tail call.
+* Every register is written before it is read, on every path. Registers are
+  global: a call defines the registers that the callee defines on all of
+  its paths, and a function can read the registers that every one of its
+  callers defines before calling it.
+
+Programs that pass these checks can run with Program.eval_unchecked, which
+reads and writes registers without the checks. The function run picks the
+fastest way to run a program.
+
+This file uses doctests all over. To test it, just run python 3 as follows:
+"python3 -m doctest Verify.py".
+"""
+
+import Asm as AsmModule
+from Cfg import Frames, is_call, is_return, is_tail_call, local_successors
+
+
+def meet(a, b):
+    """
+    Intersects two bitsets of registers, where None stands for the set of
+    every register.
+
+    Example:
+        >>> meet(None, 6), meet(6, 3)
+        (6, 2)
+    """
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return a & b
+
+
+class Verifier:
+    """
+    This class checks a program, and collects the problems that it finds.
+
+    Example:
+        >>> insts = [AsmModule.Addi("a", "x0", 1), AsmModule.Beq("a", "x0", 3),
+        ...          AsmModule.Addi("b", "a", 1), AsmModule.Add("c", "b", "a"),
+        ...          AsmModule.Jal("x0", 5)]
+        >>> p = AsmModule.Program(10, {}, insts)
+        >>> Verifier(p).check()
+        ['3: register b might be read before it is written']
+        >>> insts[4].set_target(7)
+        >>> Verifier(p).check()
+        ['4: label 7 is out of the program']
+    """
+
+    def __init__(self, prog):
+        self.prog = prog
+        self.insts = prog.get_insts()
+        self.problems = []
+
+    def report(self, i, message):
+        self.problems.append(f"{i}: {message}")
+
+    def check(self):
+        """
+        Runs every check, and returns the list of problems found. Registers
+        are only checked in programs whose labels and stack are sound.
+        """
+        self.check_labels()
+        self.check_writes()
+        fr = Frames(self.insts, self.prog.get_symbols().values())
+        self.check_stack(fr)
+        if not self.problems:
+            self.check_definitions(fr)
+        return self.problems
+
+    def check_labels(self):
+        n = len(self.insts)
+        for i, inst in enumerate(self.insts):
+            if isinstance(inst, (AsmModule.CondBranch, AsmModule.Jal,
+                                 AsmModule.La)):
+                last = n - 1 if isinstance(inst, AsmModule.La) else n
+                if inst.lab is None or not 0 <= inst.lab <= last:
+                    self.report(i, f"label {inst.lab} is out of the program")
+
+    def check_writes(self):
+        for i, inst in enumerate(self.insts):
+            if isinstance(inst, (AsmModule.Jal, AsmModule.Jalr)):
+                continue
+            defs = inst.get_defs()
+            if "x0" in defs:
+                self.report(i, "writes x0")
+            if "sp" in defs and not (isinstance(inst, AsmModule.Addi) and
+                                     inst.rs1 == "sp"):
+                self.report(i, "changes sp by an unknown amount")
+
+    def check_stack(self, fr):
+        """
+        Checks that the depth of the stack is known at each instruction that
+        might run, and that functions leave with an empty frame.
+        """
+        for i, inst in enumerate(self.insts):
+            if not fr.reached[i]:
+                continue
+            if fr.context[i] is None:
+                self.report(i, "belongs to more than one function")
+            elif fr.depth[i] is None:
+                self.report(i, "has an unknown stack depth")
+            elif fr.context[i] != 0 and fr.depth[i] != 0 and (
+                    is_return(inst) or is_tail_call(inst, fr.functions)):
+                cells = -fr.depth[i]
+                self.report(i, f"leaves with {cells} cells on the stack")
+
+    def number_registers(self):
+        self.index = {}
+        for inst in self.insts:
+            for reg in inst.get_uses() + inst.get_defs():
+                self.index.setdefault(reg, len(self.index))
+
+    def bits(self, regs):
+        result = 0
+        for reg in regs:
+            if reg in self.index:
+                result |= 1 << self.index[reg]
+        return result
+
+    def callees(self, inst):
+        if isinstance(inst, AsmModule.Jal):
+            return [inst.lab]
+        return self.address_taken
+
+    def summary_of(self, inst):
+        """
+        Returns the registers that every callee of inst defines, or None if
+        none of them returns.
+        """
+        result = None
+        for c in self.callees(inst):
+            result = meet(result, self.summary.get(c))
+        return result
+
+    def local_definitions(self, c, members):
+        """
+        Computes the registers defined on every path from the entry of the
+        function c to each of its instructions, and the registers defined on
+        every path from the entry to its returns, or None if it never
+        returns. Registers defined before the entry do not count. The
+        instructions are visited in order, until the sets stop shrinking.
+        """
+        fr, insts = self.frames, self.insts
+        defined_in = {c: 0}
+        changed = True
+        while changed:
+            changed = False
+            returned = None
+            for i in members:
+                if i not in defined_in:
+                    continue
+                inst = insts[i]
+                out = defined_in[i] | self.bits(inst.get_defs())
+                if is_call(inst) or is_tail_call(inst, fr.functions):
+                    called = self.summary_of(inst)
+                    if called is None:
+                        continue
+                    out |= called
+                    if not is_call(inst):
+                        returned = meet(returned, out)
+                elif is_return(inst):
+                    returned = meet(returned, out)
+                for s in local_successors(insts, i, fr.functions):
+                    new = meet(defined_in.get(s), out)
+                    if new != defined_in.get(s):
+                        defined_in[s] = new
+                        changed = True
+        return defined_in, returned
+
+    def solve_functions(self, members):
+        """
+        Computes the registers that each function defines on every path, by
+        running local_definitions until the summaries stop changing.
+        """
+        self.summary = {}
+        while True:
+            local, summary = {}, {}
+            for c, indices in members.items():
+                local[c], summary[c] = self.local_definitions(c, indices)
+            if summary == self.summary:
+                return local
+            self.summary = summary
+
+    def check_definitions(self, fr):
+        """
+        Checks that every register is written before it is read.
+        """
+        self.frames = fr
+        self.number_registers()
+        self.address_taken = sorted({inst.lab for inst in self.insts
+                                     if isinstance(inst, AsmModule.La)})
+        members = {}
+        for i, c in enumerate(fr.context):
+            if fr.reached[i]:
+                members.setdefault(c, []).append(i)
+        local = self.solve_functions(members)
+        entry = {c: None for c in members}
+        entry[0] = self.bits(self.prog.get_registers())
+        changed = True
+        while changed:
+            changed = False
+            state = {c: None for c in members}
+            state[0] = entry[0]
+            for c, indices in members.items():
+                if entry[c] is None:
+                    continue
+                for i in indices:
+                    inst = self.insts[i]
+                    jumps = is_call(inst) or is_tail_call(inst, fr.functions)
+                    if not jumps or i not in local[c]:
+                        continue
+                    before = entry[c] | local[c][i] | \
+                        self.bits(inst.get_defs())
+                    for callee in self.callees(inst):
+                        if callee in state:
+                            state[callee] = meet(state[callee], before)
+            if state != entry:
+                entry, changed = state, True
+        for c, indices in members.items():
+            if entry[c] is None:
+                continue
+            for i in indices:
+                if i not in local[c]:
+                    continue
+                defined = entry[c] | local[c][i]
+                for reg in self.insts[i].get_uses():
+                    if reg != "x0" and not defined >> self.index[reg] & 1:
+                        self.report(
+                            i, f"register {reg} might be read before it is "
+                            "written")
+
+
+def verify(prog):
+    """
+    Returns the list of problems that keep the program prog from running
+    without checks; the list is empty if there is none.
+
+    Example:
+        >>> import Visitor
+        >>> from Expression import *
+        >>> f = Fn('x', IfThenElse(Lth(Var('x'), Num(2)), Num(1), Var('x')))
+        >>> e = Let('f', f, Add(App(Var('f'), Num(1)), App(Var('f'), Num(3))))
+        >>> p = AsmModule.Program(100, {}, [])
+        >>> v = e.accept(Visitor.GenVisitor(), p)
+        >>> verify(p)
+        []
+        >>> p.eval_unchecked()
+        >>> p.get_val(v)
+        4
+    """
+    return Verifier(prog).check()
+
+
+def run(prog):
+    """
+    Evaluates the program prog, without checks if the verifier accepts it.
+    Returns True if it ran without checks.
+    """
+    if verify(prog):
+        prog.eval()
+        return False
+    prog.eval_unchecked()
+    return True
@@ -1,6 +1,7 @@
 import sys
 from abc import ABC, abstractmethod
 from Expression import *
+import Expression as ExpressionModule
 import Asm as AsmModule
 
 
@@ -53,6 +54,10 @@ class Visitor(ABC):
     def visit_div(self, exp, arg):
         pass
 
+    @abstractmethod
+    def visit_mod(self, exp, arg):
+        pass
+
     @abstractmethod
     def visit_leq(self, exp, arg):
         pass
@@ -94,29 +99,78 @@ class GenVisitor(Visitor):
 
     def __init__(self):
         self.next_var_counter = 0
+        self.constants = {}
+        self.known = {}
+        self.captures = {}
+        self.registers = {}
+        self.tail_calls = set()
+        self.frame = None
+        self.records = {}
 
     def next_var_name(self):
         self.next_var_counter += 1
         return f"v{self.next_var_counter}"
 
+    def constant(self, value, prog):
+        """
+        Returns a register that contains value. Within the same function,
+        constants are loaded only once, and their registers are shared. The
+        cache of constants only contains registers that are written on every
+        path to the current instruction: code that runs conditionally must be
+        generated between calls of save_constants and restore_constants.
+
+        Usage:
+            >>> p = AsmModule.Program(1000, {}, [])
+            >>> g = GenVisitor()
+            >>> g.constant(7, p) == g.constant(7, p), g.constant(0, p)
+            (True, 'x0')
+            >>> p.get_number_of_instructions()
+            1
+        """
+        if value == 0:
+            return "x0"
+        if value not in self.constants:
+            v_name = self.next_var_name()
+            prog.add_inst(AsmModule.Addi(v_name, "x0", value))
+            self.constants[value] = v_name
+        return self.constants[value]
+
+    def save_constants(self):
+        return dict(self.constants)
+
+    def restore_constants(self, constants):
+        self.constants = constants
+
+    @staticmethod
+    def literal(exp):
+        """
+        Returns the value of exp, if it is a number or a boolean literal, and
+        None otherwise.
+        """
+        if isinstance(exp, ExpressionModule.Num):
+            return exp.num
+        if isinstance(exp, ExpressionModule.Bln):
+            return int(exp.bln)
+        return None
+
     def visit_var(self, exp, prog):
         """
         Usage:
             >>> e = Var('x')
-            >>> p = AsmModule.Program({"x":1}, [])
+            >>> p = AsmModule.Program(1000, {"x":1}, [])
             >>> g = GenVisitor()
             >>> v = e.accept(g, p)
             >>> p.eval()
             >>> p.get_val(v)
             1
         """
-        return exp.identifier
+        return self.registers.get(exp.identifier, exp.identifier)
 
     def visit_bln(self, exp, prog):
         """
         Usage:
             >>> e = Bln(True)
-            >>> p = AsmModule.Program({}, [])
+            >>> p = AsmModule.Program(1000, {}, [])
             >>> g = GenVisitor()
             >>> v = e.accept(g, p)
             >>> p.eval()
@@ -124,39 +178,32 @@ class GenVisitor(Visitor):
             1
 
             >>> e = Bln(False)
-            >>> p = AsmModule.Program({}, [])
+            >>> p = AsmModule.Program(1000, {}, [])
             >>> g = GenVisitor()
             >>> v = e.accept(g, p)
             >>> p.eval()
             >>> p.get_val(v)
             0
         """
-        if exp.bln:
-            var_name = self.next_var_name()
-            prog.add_inst(AsmModule.Addi(var_name, "x0", 1))
-            return var_name
-        else:
-            return "x0"
+        return self.constant(int(exp.bln), prog)
 
     def visit_num(self, exp, prog):
         """
         Usage:
             >>> e = Num(13)
-            >>> p = AsmModule.Program({}, [])
+            >>> p = AsmModule.Program(1000, {}, [])
             >>> g = GenVisitor()
             >>> v = e.accept(g, p)
             >>> p.eval()
             >>> p.get_val(v)
             13
         """
-        v_name = self.next_var_name()
-        prog.add_inst(AsmModule.Addi(v_name, "x0", exp.num))
-        return v_name
+        return self.constant(exp.num, prog)
 
     def visit_eql(self, exp, prog):
         """
         >>> e = Eql(Num(13), Num(13))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -164,7 +211,7 @@ class GenVisitor(Visitor):
         1
 
         >>> e = Eql(Num(13), Num(10))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -172,34 +219,187 @@ class GenVisitor(Visitor):
         0
 
         >>> e = Eql(Num(-1), Num(1))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
         >>> p.get_val(v)
         0
+
+        >>> e = Eql(Var('x'), Num(4))
+        >>> p = AsmModule.Program(1000, {"x":4}, [])
+        >>> g = GenVisitor()
+        >>> v = e.accept(g, p)
+        >>> p.eval()
+        >>> p.get_val(v), p.get_number_of_instructions()
+        (1, 2)
         """
+        value = self.literal(exp.right)
+        if value is not None:
+            return self.is_zero(exp.left, value, prog)
+        value = self.literal(exp.left)
+        if value is not None:
+            return self.is_zero(exp.right, value, prog)
+
         l_name = exp.left.accept(self, prog)
         r_name = exp.right.accept(self, prog)
 
-        l_less_r_name = self.next_var_name()
-        prog.add_inst(AsmModule.Slt(l_less_r_name, l_name, r_name))
-
-        r_less_l_name = self.next_var_name()
-        prog.add_inst(AsmModule.Slt(r_less_l_name, r_name, l_name))
+        diff_name = self.next_var_name()
+        prog.add_inst(AsmModule.Xor(diff_name, l_name, r_name))
 
-        is_different_name = self.next_var_name()
-        prog.add_inst(AsmModule.Add(is_different_name,
-                      l_less_r_name, r_less_l_name))
+        v_name = self.next_var_name()
+        prog.add_inst(AsmModule.Seqz(v_name, diff_name))
+        return v_name
 
+    def is_zero(self, exp, value, prog):
+        """
+        Produces code that tests if exp - value is zero, i.e., if exp is equal
+        to the constant value.
+        """
+        name = exp.accept(self, prog)
+        if value != 0:
+            diff_name = self.next_var_name()
+            prog.add_inst(AsmModule.Xori(diff_name, name, value))
+            name = diff_name
         v_name = self.next_var_name()
-        prog.add_inst(AsmModule.Xori(v_name, is_different_name, 1))
+        prog.add_inst(AsmModule.Seqz(v_name, name))
         return v_name
 
+    def patch(self, jumps, prog):
+        """
+        Makes the jumps point to the next instruction that will be emitted.
+        """
+        n_inst = prog.get_number_of_instructions()
+        for jump in jumps:
+            jump.set_target(n_inst)
+
+    def condition(self, exp, prog):
+        """
+        Produces code that evaluates the operands of the condition exp, and
+        returns a branch that jumps if exp is true. The branch is neither
+        added to the program nor has a target: the caller must do it. This
+        way, 'a <= b' becomes 'bge b a', and its negation 'blt b a'.
+        """
+        if isinstance(exp, ExpressionModule.Eql):
+            l_name = exp.left.accept(self, prog)
+            r_name = exp.right.accept(self, prog)
+            return AsmModule.Beq(l_name, r_name)
+        if isinstance(exp, ExpressionModule.Lth):
+            l_name = exp.left.accept(self, prog)
+            r_name = exp.right.accept(self, prog)
+            return AsmModule.Blt(l_name, r_name)
+        if isinstance(exp, ExpressionModule.Leq):
+            l_name = exp.left.accept(self, prog)
+            r_name = exp.right.accept(self, prog)
+            return AsmModule.Bge(r_name, l_name)
+        name = exp.accept(self, prog)
+        return AsmModule.Bne(name, "x0")
+
+    def jump_if_false(self, exp, prog):
+        """
+        Produces code that evaluates the condition exp, and that jumps if it
+        is false. Returns the list of jumps, whose targets must be set by the
+        caller. If the condition is true, the code falls through. Conditions
+        are never stored in registers: comparisons and logical operators
+        branch directly.
+
+        Usage:
+            >>> e = And(Lth(Var('x'), Num(3)), Leq(Var('x'), Var('y')))
+            >>> p = AsmModule.Program(1000, {"x":2, "y":5}, [])
+            >>> g = GenVisitor()
+            >>> jumps = g.jump_if_false(e, p)
+            >>> p.add_inst(AsmModule.Addi("r", "x0", 1))
+            >>> g.patch(jumps, p)
+            >>> p.eval()
+            >>> p.get_val("r"), p.get_number_of_instructions()
+            (1, 4)
+        """
+        if isinstance(exp, ExpressionModule.Bln):
+            if exp.bln:
+                return []
+            jump = AsmModule.Jal("x0")
+            prog.add_inst(jump)
+            return [jump]
+        if isinstance(exp, ExpressionModule.Not):
+            return self.jump_if_true(exp.exp, prog)
+        if isinstance(exp, ExpressionModule.And):
+            jumps = self.jump_if_false(exp.left, prog)
+            constants = self.save_constants()
+            jumps += self.jump_if_false(exp.right, prog)
+            self.restore_constants(constants)
+            return jumps
+        if isinstance(exp, ExpressionModule.Or):
+            true_jumps = self.jump_if_true(exp.left, prog)
+            constants = self.save_constants()
+            jumps = self.jump_if_false(exp.right, prog)
+            self.restore_constants(constants)
+            self.patch(true_jumps, prog)
+            return jumps
+        jump = self.condition(exp, prog).negate()
+        prog.add_inst(jump)
+        return [jump]
+
+    def jump_if_true(self, exp, prog):
+        """
+        Produces code that evaluates the condition exp, and that jumps if it
+        is true. Returns the list of jumps, whose targets must be set by the
+        caller. If the condition is false, the code falls through.
+
+        Usage:
+            >>> e = Or(Eql(Var('x'), Num(3)), Not(Var('y')))
+            >>> p = AsmModule.Program(1000, {"x":3, "y":1, "r":0}, [])
+            >>> g = GenVisitor()
+            >>> jumps = g.jump_if_true(e, p)
+            >>> p.add_inst(AsmModule.Addi("r", "x0", 1))
+            >>> g.patch(jumps, p)
+            >>> p.eval()
+            >>> p.get_val("r")
+            0
+        """
+        if isinstance(exp, ExpressionModule.Bln):
+            if not exp.bln:
+                return []
+            jump = AsmModule.Jal("x0")
+            prog.add_inst(jump)
+            return [jump]
+        if isinstance(exp, ExpressionModule.Not):
+            return self.jump_if_false(exp.exp, prog)
+        if isinstance(exp, ExpressionModule.Or):
+            jumps = self.jump_if_true(exp.left, prog)
+            constants = self.save_constants()
+            jumps += self.jump_if_true(exp.right, prog)
+            self.restore_constants(constants)
+            return jumps
+        if isinstance(exp, ExpressionModule.And):
+            false_jumps = self.jump_if_false(exp.left, prog)
+            constants = self.save_constants()
+            jumps = self.jump_if_true(exp.right, prog)
+            self.restore_constants(constants)
+            self.patch(false_jumps, prog)
+            return jumps
+        jump = self.condition(exp, prog)
+        prog.add_inst(jump)
+        return [jump]
+
+    def materialize(self, exp, prog):
+        """
+        Produces code that stores the value of the condition exp in a new
+        register, as 1 or 0.
+        """
+        false_jumps = self.jump_if_false(exp, prog)
+        r = self.next_var_name()
+        prog.add_inst(AsmModule.Addi(r, "x0", 1))
+        end = AsmModule.Jal("x0")
+        prog.add_inst(end)
+        self.patch(false_jumps, prog)
+        prog.add_inst(AsmModule.Addi(r, "x0", 0))
+        self.patch([end], prog)
+        return r
+
     def visit_and(self, exp, prog):
         """
         >>> e = And(Bln(True), Bln(True))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -207,7 +407,7 @@ class GenVisitor(Visitor):
         1
 
         >>> e = And(Bln(False), Bln(True))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -215,7 +415,7 @@ class GenVisitor(Visitor):
         0
 
         >>> e = And(Bln(True), Bln(False))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -223,7 +423,7 @@ class GenVisitor(Visitor):
         0
 
         >>> e = And(Bln(False), Bln(False))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -231,35 +431,19 @@ class GenVisitor(Visitor):
         0
 
         >>> e = And(Bln(False), Div(Num(3), Num(0)))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
         >>> p.get_val(v)
         0
         """
-        left = exp.left.accept(self, prog)
-        beq_left = AsmModule.Beq(left, "x0")
-        prog.add_inst(beq_left)
-        right = exp.right.accept(self, prog)
-        beq_right = AsmModule.Beq(right, "x0")
-        prog.add_inst(beq_right)
-        r = self.next_var_name()
-        prog.add_inst(AsmModule.Addi(r, "x0", 1))
-        end = AsmModule.Jal("x0")
-        prog.add_inst(end)
-        n_inst = prog.get_number_of_instructions()
-        beq_left.set_target(n_inst)
-        beq_right.set_target(n_inst)
-        prog.add_inst(AsmModule.Addi(r, "x0", 0))
-        n_inst = prog.get_number_of_instructions()
-        end.set_target(n_inst)
-        return r
+        return self.materialize(exp, prog)
 
     def visit_or(self, exp, prog):
         """
         >>> e = Or(Bln(True), Bln(True))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -267,7 +451,7 @@ class GenVisitor(Visitor):
         1
 
         >>> e = Or(Bln(False), Bln(True))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -275,7 +459,7 @@ class GenVisitor(Visitor):
         1
 
         >>> e = Or(Bln(True), Bln(False))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -283,7 +467,7 @@ class GenVisitor(Visitor):
         1
 
         >>> e = Or(Bln(False), Bln(False))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -291,37 +475,19 @@ class GenVisitor(Visitor):
         0
 
         >>> e = Or(Bln(True), Div(Num(3), Num(0)))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
         >>> p.get_val(v)
         1
         """
-        one = self.next_var_name()
-        prog.add_inst(AsmModule.Addi(one, "x0", 1))
-        left = exp.left.accept(self, prog)
-        beq_left = AsmModule.Beq(left, one)
-        prog.add_inst(beq_left)
-        right = exp.right.accept(self, prog)
-        beq_right = AsmModule.Beq(right, one)
-        prog.add_inst(beq_right)
-        r = self.next_var_name()
-        prog.add_inst(AsmModule.Addi(r, "x0", 0))
-        end = AsmModule.Jal("x0")
-        prog.add_inst(end)
-        n_inst = prog.get_number_of_instructions()
-        beq_left.set_target(n_inst)
-        beq_right.set_target(n_inst)
-        prog.add_inst(AsmModule.Addi(r, "x0", 1))
-        n_inst = prog.get_number_of_instructions()
-        end.set_target(n_inst)
-        return r
+        return self.materialize(exp, prog)
 
     def visit_add(self, exp, prog):
         """
         >>> e = Add(Num(13), Num(-13))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -329,23 +495,43 @@ class GenVisitor(Visitor):
         0
 
         >>> e = Add(Num(13), Num(10))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
         >>> p.get_val(v)
         23
+
+        >>> e = Add(Num(3), Var('x'))
+        >>> p = AsmModule.Program(1000, {"x":4}, [])
+        >>> g = GenVisitor()
+        >>> v = e.accept(g, p)
+        >>> p.eval()
+        >>> p.get_val(v), p.get_number_of_instructions()
+        (7, 1)
         """
+        value = self.literal(exp.right)
+        if value is not None:
+            return self.add_immediate(exp.left, value, prog)
+        value = self.literal(exp.left)
+        if value is not None:
+            return self.add_immediate(exp.right, value, prog)
         l_name = exp.left.accept(self, prog)
         r_name = exp.right.accept(self, prog)
         v_name = self.next_var_name()
         prog.add_inst(AsmModule.Add(v_name, l_name, r_name))
         return v_name
 
+    def add_immediate(self, exp, value, prog):
+        name = exp.accept(self, prog)
+        v_name = self.next_var_name()
+        prog.add_inst(AsmModule.Addi(v_name, name, value))
+        return v_name
+
     def visit_sub(self, exp, prog):
         """
         >>> e = Sub(Num(13), Num(-13))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -353,13 +539,16 @@ class GenVisitor(Visitor):
         26
 
         >>> e = Sub(Num(13), Num(10))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
         >>> p.get_val(v)
         3
         """
+        value = self.literal(exp.right)
+        if value is not None:
+            return self.add_immediate(exp.left, -value, prog)
         l_name = exp.left.accept(self, prog)
         r_name = exp.right.accept(self, prog)
         v_name = self.next_var_name()
@@ -369,7 +558,7 @@ class GenVisitor(Visitor):
     def visit_mul(self, exp, prog):
         """
         >>> e = Mul(Num(13), Num(2))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -377,7 +566,7 @@ class GenVisitor(Visitor):
         26
 
         >>> e = Mul(Num(13), Num(10))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -393,7 +582,7 @@ class GenVisitor(Visitor):
     def visit_div(self, exp, prog):
         """
         >>> e = Div(Num(13), Num(2))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -401,7 +590,7 @@ class GenVisitor(Visitor):
         6
 
         >>> e = Div(Num(13), Num(10))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -414,10 +603,34 @@ class GenVisitor(Visitor):
         prog.add_inst(AsmModule.Div(v_name, l_name, r_name))
         return v_name
 
+    def visit_mod(self, exp, prog):
+        """
+        >>> e = Mod(Num(13), Num(5))
+        >>> p = AsmModule.Program(1000, {}, [])
+        >>> g = GenVisitor()
+        >>> v = e.accept(g, p)
+        >>> p.eval()
+        >>> p.get_val(v)
+        3
+
+        >>> e = Mod(Num(-13), Num(5))
+        >>> p = AsmModule.Program(1000, {}, [])
+        >>> g = GenVisitor()
+        >>> v = e.accept(g, p)
+        >>> p.eval()
+        >>> p.get_val(v)
+        2
+        """
+        l_name = exp.left.accept(self, prog)
+        r_name = exp.right.accept(self, prog)
+        v_name = self.next_var_name()
+        prog.add_inst(AsmModule.Rem(v_name, l_name, r_name))
+        return v_name
+
     def visit_leq(self, exp, prog):
         """
         >>> e = Leq(Num(3), Num(2))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -425,7 +638,7 @@ class GenVisitor(Visitor):
         0
 
         >>> e = Leq(Num(3), Num(3))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -433,7 +646,7 @@ class GenVisitor(Visitor):
         1
 
         >>> e = Leq(Num(2), Num(3))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -441,7 +654,7 @@ class GenVisitor(Visitor):
         1
 
         >>> e = Leq(Num(-3), Num(-2))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -449,7 +662,7 @@ class GenVisitor(Visitor):
         1
 
         >>> e = Leq(Num(-3), Num(-3))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -457,13 +670,27 @@ class GenVisitor(Visitor):
         1
 
         >>> e = Leq(Num(-2), Num(-3))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
         >>> p.get_val(v)
         0
+
+        >>> e = Leq(Var('x'), Num(3))
+        >>> p = AsmModule.Program(1000, {"x":3}, [])
+        >>> g = GenVisitor()
+        >>> v = e.accept(g, p)
+        >>> p.eval()
+        >>> p.get_val(v), p.get_number_of_instructions()
+        (1, 1)
         """
+        value = self.literal(exp.right)
+        if value is not None:
+            return self.less_than_immediate(exp.left, value + 1, prog)
+        value = self.literal(exp.left)
+        if value is not None:
+            return self.not_less_than_immediate(exp.right, value, prog)
         l_name = exp.left.accept(self, prog)
         r_name = exp.right.accept(self, prog)
 
@@ -477,7 +704,7 @@ class GenVisitor(Visitor):
     def visit_lth(self, exp, prog):
         """
         >>> e = Lth(Num(3), Num(2))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -485,7 +712,7 @@ class GenVisitor(Visitor):
         0
 
         >>> e = Lth(Num(3), Num(3))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -493,13 +720,27 @@ class GenVisitor(Visitor):
         0
 
         >>> e = Lth(Num(2), Num(3))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
         >>> p.get_val(v)
         1
+
+        >>> e = Lth(Num(2), Var('x'))
+        >>> p = AsmModule.Program(1000, {"x":2}, [])
+        >>> g = GenVisitor()
+        >>> v = e.accept(g, p)
+        >>> p.eval()
+        >>> p.get_val(v)
+        0
         """
+        value = self.literal(exp.right)
+        if value is not None:
+            return self.less_than_immediate(exp.left, value, prog)
+        value = self.literal(exp.left)
+        if value is not None:
+            return self.not_less_than_immediate(exp.right, value + 1, prog)
         l_name = exp.left.accept(self, prog)
         r_name = exp.right.accept(self, prog)
 
@@ -507,10 +748,22 @@ class GenVisitor(Visitor):
         prog.add_inst(AsmModule.Slt(v_name, l_name, r_name))
         return v_name
 
+    def less_than_immediate(self, exp, value, prog):
+        name = exp.accept(self, prog)
+        v_name = self.next_var_name()
+        prog.add_inst(AsmModule.Slti(v_name, name, value))
+        return v_name
+
+    def not_less_than_immediate(self, exp, value, prog):
+        is_less_name = self.less_than_immediate(exp, value, prog)
+        v_name = self.next_var_name()
+        prog.add_inst(AsmModule.Xori(v_name, is_less_name, 1))
+        return v_name
+
     def visit_neg(self, exp, prog):
         """
         >>> e = Neg(Num(3))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -518,7 +771,7 @@ class GenVisitor(Visitor):
         -3
 
         >>> e = Neg(Num(0))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -526,7 +779,7 @@ class GenVisitor(Visitor):
         0
 
         >>> e = Neg(Num(-3))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -541,7 +794,7 @@ class GenVisitor(Visitor):
     def visit_not(self, exp, prog):
         """
         >>> e = Not(Bln(True))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -549,7 +802,7 @@ class GenVisitor(Visitor):
         0
 
         >>> e = Not(Bln(False))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -557,7 +810,7 @@ class GenVisitor(Visitor):
         1
 
         >>> e = Not(Num(0))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -565,7 +818,7 @@ class GenVisitor(Visitor):
         1
 
         >>> e = Not(Num(-2))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -573,33 +826,20 @@ class GenVisitor(Visitor):
         0
 
         >>> e = Not(Num(2))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
         >>> p.get_val(v)
         0
         """
-        val = exp.exp.accept(self, prog)
-
-        is_neg = self.next_var_name()
-        is_pos = self.next_var_name()
-
-        prog.add_inst(AsmModule.Slt(is_neg, val, "x0"))
-        prog.add_inst(AsmModule.Slt(is_pos, "x0", val))
-
-        is_not_zero = self.next_var_name()
-        prog.add_inst(AsmModule.Add(is_not_zero, is_neg, is_pos))
-
-        v_name = self.next_var_name()
-        prog.add_inst(AsmModule.Xori(v_name, is_not_zero, 1))
-        return v_name
+        return self.is_zero(exp.exp, 0, prog)
 
     def visit_let(self, exp, prog):
         """
         Usage:
             >>> e = Let('v', Not(Bln(False)), Var('v'))
-            >>> p = AsmModule.Program({}, [])
+            >>> p = AsmModule.Program(1000, {}, [])
             >>> g = GenVisitor()
             >>> v = e.accept(g, p)
             >>> p.eval()
@@ -607,7 +847,7 @@ class GenVisitor(Visitor):
             1
 
             >>> e = Let('v', Num(2), Add(Var('v'), Num(3)))
-            >>> p = AsmModule.Program({}, [])
+            >>> p = AsmModule.Program(1000, {}, [])
             >>> g = GenVisitor()
             >>> v = e.accept(g, p)
             >>> p.eval()
@@ -616,22 +856,42 @@ class GenVisitor(Visitor):
 
             >>> e0 = Let('x', Num(2), Add(Var('x'), Num(3)))
             >>> e1 = Let('y', e0, Mul(Var('y'), Num(10)))
-            >>> p = AsmModule.Program({}, [])
+            >>> p = AsmModule.Program(1000, {}, [])
             >>> g = GenVisitor()
             >>> v = e1.accept(g, p)
             >>> p.eval()
             >>> p.get_val(v)
             50
+
+        Each variable gets its own register, even if it shadows another one,
+        as the register of the outer variable might still be read:
+            >>> e0 = Let('x', Num(2), Add(Var('x'), Num(3)))
+            >>> e1 = Let('x', Num(7), Add(e0, Var('x')))
+            >>> p = AsmModule.Program(1000, {}, [])
+            >>> v = e1.accept(GenVisitor(), p)
+            >>> p.eval()
+            >>> p.get_val(v)
+            12
         """
-        exp_def_name = exp.exp_def.accept(self, prog)
-        prog.add_inst(AsmModule.Add(exp.identifier, exp_def_name, "x0"))
+        if isinstance(exp.exp_def, ExpressionModule.Fn):
+            exp_def_name = self.gen_function(exp.exp_def, prog, exp.identifier)
+        else:
+            exp_def_name = exp.exp_def.accept(self, prog)
+        register = self.next_var_name()
+        prog.add_inst(AsmModule.Add(register, exp_def_name, "x0"))
+        known = self.save_known()
+        self.bind_known(register, self.known.get(exp_def_name))
+        registers = dict(self.registers)
+        self.registers[exp.identifier] = register
         exp_body_name = exp.exp_body.accept(self, prog)
+        self.registers = registers
+        self.restore_known(known)
         return exp_body_name
 
     def visit_ifThenElse(self, exp, prog):
         """
         >>> e = IfThenElse(Bln(True), Num(3), Num(5))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -639,7 +899,7 @@ class GenVisitor(Visitor):
         3
 
         >>> e = IfThenElse(Bln(False), Num(3), Num(5))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -647,7 +907,7 @@ class GenVisitor(Visitor):
         5
 
         >>> e = IfThenElse(And(Bln(True), Bln(True)), Num(3), Num(5))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e.accept(g, p)
         >>> p.eval()
@@ -656,7 +916,7 @@ class GenVisitor(Visitor):
 
         >>> e0 = Mul(Num(2), Add(Num(3), Num(4)))
         >>> e1 = IfThenElse(And(Bln(True), Bln(False)), Num(3), e0)
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e1.accept(g, p)
         >>> p.eval()
@@ -665,7 +925,7 @@ class GenVisitor(Visitor):
 
         >>> e0 = Div(Num(2), Num(0))
         >>> e1 = IfThenElse(Bln(True), Num(3), e0)
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e1.accept(g, p)
         >>> p.eval()
@@ -674,59 +934,312 @@ class GenVisitor(Visitor):
 
         >>> e0 = Div(Num(2), Num(0))
         >>> e1 = IfThenElse(Bln(False), e0, Num(3))
-        >>> p = AsmModule.Program({}, [])
+        >>> p = AsmModule.Program(1000, {}, [])
         >>> g = GenVisitor()
         >>> v = e1.accept(g, p)
         >>> p.eval()
         >>> p.get_val(v)
         3
         """
-        cond_name = exp.cond.accept(self, prog)
-        else_beq = AsmModule.Beq(cond_name, "x0")
-        prog.add_inst(else_beq)
+        else_jumps = self.jump_if_false(exp.cond, prog)
+        constants = self.save_constants()
         then_name = exp.e0.accept(self, prog)
+        self.restore_constants(dict(constants))
         r = self.next_var_name()
         prog.add_inst(AsmModule.Add(r, then_name, "x0"))
         end = AsmModule.Jal("x0")
         prog.add_inst(end)
-        n_inst = prog.get_number_of_instructions()
-        else_beq.set_target(n_inst)
+        self.patch(else_jumps, prog)
         else_name = exp.e1.accept(self, prog)
+        self.restore_constants(constants)
         prog.add_inst(AsmModule.Add(r, else_name, "x0"))
-        n_inst = prog.get_number_of_instructions()
-        end.set_target(n_inst)
+        self.patch([end], prog)
         return r
 
-    def visit_fn(self, exp, prog):
-        addr_var = self.next_var_name()
-        func_addr = prog.get_number_of_instructions()+2
-        prog.add_inst(AsmModule.Addi(addr_var, "x0", func_addr))
+    @staticmethod
+    def find_tail_calls(exp):
+        """
+        Returns the applications in tail position in exp: those whose value
+        is the value of exp, so that nothing else is evaluated after them.
 
-        func_after = AsmModule.Jal("x0")
-        prog.add_inst(func_after)
+        Usage:
+            >>> e = IfThenElse(Var('b'), App(Var('f'), Num(1)),
+            ...                Add(Num(2), App(Var('f'), Num(3))))
+            >>> [str(a.actual.num) for a in GenVisitor.find_tail_calls(e)]
+            ['1']
+        """
+        if isinstance(exp, ExpressionModule.App):
+            return [exp]
+        if isinstance(exp, ExpressionModule.Let):
+            return GenVisitor.find_tail_calls(exp.exp_body)
+        if isinstance(exp, ExpressionModule.IfThenElse):
+            return (GenVisitor.find_tail_calls(exp.e0) +
+                    GenVisitor.find_tail_calls(exp.e1))
+        return []
+
+    @staticmethod
+    def makes_calls(exp, tail_calls=()):
+        """
+        Tells if evaluating exp might call a function, other than through the
+        applications in tail_calls, which is a set of ids. The bodies of the
+        functions that exp creates do not count, as they only run when these
+        functions are called.
 
-        prog.add_inst(AsmModule.Addi("sp", "sp", -4))
-        prog.add_inst(AsmModule.Sw("sp", 0, "ra"))
+        Usage:
+            >>> GenVisitor.makes_calls(Add(Num(1), App(Var('f'), Num(2))))
+            True
+            >>> GenVisitor.makes_calls(Fn('x', App(Var('f'), Var('x'))))
+            False
+            >>> e = App(Var('f'), Num(2))
+            >>> GenVisitor.makes_calls(e, {id(e)})
+            False
+        """
+        if isinstance(exp, ExpressionModule.App) and id(exp) not in tail_calls:
+            return True
+        if isinstance(exp, ExpressionModule.Fn):
+            return False
+        return any(GenVisitor.makes_calls(e, tail_calls)
+                   for e in vars(exp).values()
+                   if isinstance(e, ExpressionModule.Expression))
+
+    @staticmethod
+    def local_functions(exp):
+        """
+        Returns the functions that evaluating exp creates, not counting those
+        created by the bodies of these functions.
 
-        prog.add_inst(AsmModule.Add(exp.formal, "a0", "x0"))
+        Usage:
+            >>> e = Let('f', Fn('x', Fn('y', Var('x'))), App(Var('f'), Num(1)))
+            >>> [fn.formal for fn in GenVisitor.local_functions(e)]
+            ['x']
+        """
+        if isinstance(exp, ExpressionModule.Fn):
+            return [exp]
+        return [fn for e in vars(exp).values()
+                if isinstance(e, ExpressionModule.Expression)
+                for fn in GenVisitor.local_functions(e)]
 
-        return_var = exp.body.accept(self, prog)
-        prog.add_inst(AsmModule.Add("a0", return_var, "x0"))
+    def save_known(self):
+        return dict(self.known)
 
-        prog.add_inst(AsmModule.Lw("sp", 0, "ra"))
-        prog.add_inst(AsmModule.Addi("sp", "sp", 4))
+    def restore_known(self, known):
+        self.known = known
 
-        prog.add_inst(AsmModule.Jalr("x0", "ra"))
+    def bind_known(self, name, entry):
+        """
+        Records that register name holds the address of the function whose
+        entry point is the label entry, or, if entry is None, that the
+        function in register name is not known.
+        """
+        if entry is None:
+            self.known.pop(name, None)
+        else:
+            self.known[name] = entry
 
-        func_after.set_target(prog.get_number_of_instructions())
+    def visit_fn(self, exp, prog):
+        """
+        Usage:
+            >>> e = App(Fn('x', Add(Var('x'), Num(1))), Num(2))
+            >>> p = AsmModule.Program(1000, {}, [])
+            >>> g = GenVisitor()
+            >>> v = e.accept(g, p)
+            >>> p.eval()
+            >>> p.get_val(v), p.get_symbols()
+            (3, {'v1': 8})
+        """
+        return self.gen_function(exp, prog, None)
 
-        return addr_var
+    def gen_function(self, exp, prog, name):
+        """
+        Produces the code of the function exp, and returns the register that
+        contains its closure: the address of a record whose first cell holds
+        the entry point of the function, and whose next cells hold the values
+        of its free variables, at offsets 4, 8, etc. A caller passes the
+        closure in a1, and the function loads its free variables from there
+        when it starts. Records are allocated in the heap, unless the escape
+        analysis of Escape.py finds that the function does not escape: then
+        its record is part of the stack frame of the function that creates
+        it, or of the static data, if the main program creates it.
+
+        The code of the function goes to a section of its own, which is placed
+        after the main program when the program is linked, so that the code
+        that creates the function does not have to jump over it. The entry
+        point of the function is recorded in the symbol table of the
+        program, under the given name, or under the name of the register that
+        holds it, if name is None or already taken. Applications of the
+        function, through its closure, or through variables that are bound to
+        it, are direct calls. Applications in tail position are jumps: the
+        callee returns straight to the caller of this function. Functions that
+        make no calls, other than tail calls, do not save ra, and, unless
+        they hold records, have no stack frame. The registers of the caller
+        are saved by the pass in CallConv.py.
+
+        Usage:
+            >>> f = Fn('x', Fn('y', Sub(Var('x'), Var('y'))))
+            >>> e = Let('x', Num(1), App(Var('g'), Num(2)))
+            >>> e = Let('g', App(f, Num(5)), e)
+            >>> p = AsmModule.Program(1000, {}, [])
+            >>> v = e.accept(GenVisitor(), p)
+            >>> p.eval()
+            >>> p.get_val(v)
+            3
+
+        Below, only the closure returned by 'twice' goes to the heap:
+            >>> from Escape import analyze_escapes
+            >>> body = App(Var('f'), App(Var('f'), Var('y')))
+            >>> twice = Fn('f', Fn('y', body))
+            >>> k = Fn('z', Add(Var('z'), Var('n')))
+            >>> g = Fn('n', Add(Num(1), App(App(Var('t'), k), Var('n'))))
+            >>> e = analyze_escapes(Let('t', twice, App(g, Num(3))))
+            >>> p = AsmModule.Program(1000, {}, [])
+            >>> v = e.accept(GenVisitor(), p)
+            >>> [i.get_opcode() for i in p.get_insts()].count("alloc")
+            1
+            >>> p.eval()
+            >>> p.get_val(v)
+            10
+        """
+        addr_var = self.next_var_name()
+        func_addr = prog.open_section()
+        if name is None or name in prog.get_symbols():
+            name = addr_var
+        prog.add_symbol(name, func_addr)
+
+        tail_calls = {id(app) for app in self.find_tail_calls(exp.body)}
+        saves_ra = self.makes_calls(exp.body, tail_calls)
+        size, records = 4 if saves_ra else 0, {}
+        for fn in self.local_functions(exp.body):
+            if not fn.escapes:
+                records[id(fn)] = size
+                size += 4 * (len(ExpressionModule.free_variables(fn)) + 1)
+        frame = (size, saves_ra)
+        if size:
+            prog.add_inst(AsmModule.Addi("sp", "sp", -size))
+        if saves_ra:
+            prog.add_inst(AsmModule.Sw("sp", 0, "ra"))
+
+        formal = self.next_var_name()
+        prog.add_inst(AsmModule.Add(formal, "a0", "x0"))
+
+        free_vars = sorted(ExpressionModule.free_variables(exp))
+        captured = [self.registers.get(x, x) for x in free_vars]
+        registers, known = {exp.formal: formal}, {}
+        for k, x in enumerate(free_vars):
+            registers[x] = self.next_var_name()
+            prog.add_inst(AsmModule.Lw("a1", 4 * (k + 1), registers[x]))
+            if captured[k] in self.known:
+                known[registers[x]] = self.known[captured[k]]
+
+        constants = self.save_constants()
+        self.restore_constants({})
+        outer = (self.known, self.registers, self.tail_calls, self.frame,
+                 self.records)
+        self.known, self.registers = known, registers
+        self.tail_calls, self.frame, self.records = tail_calls, frame, records
+        return_var = exp.body.accept(self, prog)
+        (self.known, self.registers, self.tail_calls, self.frame,
+         self.records) = outer
+        self.restore_constants(constants)
+
+        last = exp.body
+        while isinstance(last, ExpressionModule.Let):
+            last = last.exp_body
+        if id(last) not in tail_calls:
+            prog.add_inst(AsmModule.Add("a0", return_var, "x0"))
+            self.return_from_function(frame, prog)
+            prog.add_inst(AsmModule.Jalr("x0", "ra"))
+        prog.close_section()
+
+        prog.add_inst(AsmModule.La(addr_var, func_addr))
+        closure = self.next_var_name()
+        record_size = 4 * (len(free_vars) + 1)
+        if exp.escapes:
+            prog.add_inst(AsmModule.Alloc(closure, record_size))
+        elif self.frame is None:
+            address = prog.add_static(record_size)
+            prog.add_inst(AsmModule.Addi(closure, "x0", address))
+        else:
+            prog.add_inst(AsmModule.Addi(closure, "sp", self.records[id(exp)]))
+        prog.add_inst(AsmModule.Sw(closure, 0, addr_var))
+        for k, reg in enumerate(captured):
+            prog.add_inst(AsmModule.Sw(closure, 4 * (k + 1), reg))
+        self.captures[func_addr] = bool(free_vars)
+        self.known[closure] = func_addr
+        return closure
+
+    def return_from_function(self, frame, prog):
+        """
+        Restores ra, if the current function saved it, and pops its frame,
+        if it has one, so that the next jump leaves the function.
+        """
+        size, saves_ra = frame
+        if saves_ra:
+            prog.add_inst(AsmModule.Lw("sp", 0, "ra"))
+        if size:
+            prog.add_inst(AsmModule.Addi("sp", "sp", size))
 
     def visit_app(self, exp, prog):
-        func_label = exp.function.accept(self, prog)
+        """
+        Applications of known functions jump directly to their entry points;
+        other applications load the entry point from the closure. The closure
+        goes in a1, unless the function is known to have no free variables,
+        and the argument goes in a0. Applications in tail position do not
+        return: they jump to the callee after popping the frame of the
+        current function.
+
+        Usage:
+            >>> f = Fn('x', Mul(Var('x'), Num(3)))
+            >>> e = Let('f', f, Let('g', Var('f'), App(Var('g'), Num(2))))
+            >>> p = AsmModule.Program(1000, {}, [])
+            >>> g = GenVisitor()
+            >>> v = e.accept(g, p)
+            >>> p.eval()
+            >>> p.get_val(v), p.get_symbols()
+            (6, {'f': 10})
+            >>> [str(i) for i in p.get_insts() if i.get_opcode() == "jal"]
+            ['jal ra 10', 'jal x0 15']
+
+            >>> e = Let('f', f, App(Fn('f', App(Var('f'), Num(1))), Var('f')))
+            >>> p = AsmModule.Program(1000, {}, [])
+            >>> v = e.accept(GenVisitor(), p)
+            >>> p.eval()
+            >>> p.get_val(v)
+            3
+
+        Applications in tail position run in constant stack space. Below,
+        the memory has room for a few frames, and for a few of the closures
+        that each iteration allocates, which the garbage collector reclaims:
+            >>> n = Sub(Var('n'), Num(1))
+            >>> loop = App(App(Var('s'), Var('s')), n)
+            >>> body = IfThenElse(Lth(Var('n'), Num(1)), Num(0), loop)
+            >>> d = Fn('s', Fn('n', body))
+            >>> e = Let('d', d, App(App(Var('d'), Var('d')), Num(1000)))
+            >>> p = AsmModule.Program(100, {}, [])
+            >>> v = e.accept(GenVisitor(), p)
+            >>> p.eval()
+            >>> p.get_val(v)
+            0
+        """
+        closure = exp.function.accept(self, prog)
         param_value = exp.actual.accept(self, prog)
+        entry = self.known.get(closure)
+        if entry is None:
+            func_label = self.next_var_name()
+            prog.add_inst(AsmModule.Lw(closure, 0, func_label))
+        if entry is None or self.captures[entry]:
+            prog.add_inst(AsmModule.Add("a1", closure, "x0"))
         prog.add_inst(AsmModule.Add("a0", param_value, "x0"))
-        prog.add_inst(AsmModule.Jalr("ra", func_label))
+        if id(exp) in self.tail_calls:
+            self.return_from_function(self.frame, prog)
+            if entry is None:
+                prog.add_inst(AsmModule.Jalr("x0", func_label))
+            else:
+                prog.add_inst(AsmModule.Jal("x0", entry))
+            return "a0"
+        if entry is None:
+            prog.add_inst(AsmModule.Jalr("ra", func_label))
+        else:
+            prog.add_inst(AsmModule.Jal("ra", entry))
         ret_var = self.next_var_name()
         prog.add_inst(AsmModule.Add(ret_var, "a0", "x0"))
         return ret_var
@@ -882,6 +1395,10 @@ class RenameVisitor(ABC):
         exp.left.accept(self, arg)
         exp.right.accept(self, arg)
 
+    def visit_mod(self, exp, arg):
+        exp.left.accept(self, arg)
+        exp.right.accept(self, arg)
+
     def visit_leq(self, exp, arg):
         exp.left.accept(self, arg)
         exp.right.accept(self, arg)